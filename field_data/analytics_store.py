@@ -0,0 +1,372 @@
+"""
+Rollup store behind the dashboard's coverage, species and treatment views.
+
+A season of 10 Hz logs is tens of millions of records, far too many to scan on
+every page load, and the raw records already live in the detection-log segments.
+So the store (one SQLite file, stdlib only) keeps:
+
+- daily rollups per (field, day, class): record count and summed score, upserted
+  incrementally as segments are ingested (NumPy groups each batch first, so a
+  batch costs a few hundred row updates, not one per record);
+- partitions: which record range of which segment belongs to a (field, day), so a
+  drill-down reads just those slices of the memory-mapped segments;
+- treatments, with the fields the dashboard's Treatment cards show.
+
+Records are assigned to fields by polygon (GeoJSON, see add_field). The query
+functions return lists of dicts shaped like the dashboard components' props.
+
+    python analytics_store.py add-field season.db "North Block" north_block.geojson
+    python analytics_store.py ingest season.db ../imx500/survey_log
+    python analytics_store.py query season.db coverage --field "North Block"
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from common import BATCH, new_records, weed_classes
+from detection_log import DEFAULT_LABELS, read_header, read_log, record_dtype
+from spatial_index import points_in_polygon
+
+DAY = 86_400
+UNASSIGNED = ""  # field name of records outside every field polygon
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fields (
+    name TEXT PRIMARY KEY,
+    polygon TEXT NOT NULL,            -- JSON [[lat, lon], ...]
+    south REAL, west REAL, north REAL, east REAL
+);
+CREATE TABLE IF NOT EXISTS labels (class_idx INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS segments (name TEXT PRIMARY KEY, records INTEGER NOT NULL, path TEXT);
+CREATE TABLE IF NOT EXISTS daily (
+    field TEXT NOT NULL,
+    day INTEGER NOT NULL,             -- days since 1970-01-01 in the store's UTC offset
+    class_idx INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    PRIMARY KEY (field, day, class_idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS partitions (
+    field TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    segment TEXT NOT NULL,
+    start INTEGER NOT NULL,           -- record range [start, stop) within the segment
+    stop INTEGER NOT NULL,
+    records INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS partitions_field_day ON partitions (field, day);
+CREATE TABLE IF NOT EXISTS treatments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    field TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    time REAL NOT NULL,
+    chemical TEXT NOT NULL,
+    chemical_class TEXT,
+    amount TEXT,
+    lat REAL,
+    lon REAL
+);
+CREATE INDEX IF NOT EXISTS treatments_field_day ON treatments (field, day);
+"""
+
+
+def _camel(label: str) -> str:
+    """Dashboard key for a class: "Broadleaf" -> "broadleafCoverage"."""
+    words = label.replace("_", " ").split()
+    return (words[0].lower() + "".join(w.capitalize() for w in words[1:]) if words else "class") + "Coverage"
+
+
+class AnalyticsStore:
+    def __init__(self, path: str, utc_offset_hours: float = 0.0):
+        """Open (or create) the store; days start at midnight in the given UTC offset."""
+        self.path = path
+        self.utc_offset = utc_offset_hours * 3600
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self._fields = None
+
+    def close(self):
+        self.db.close()
+
+    def labels(self) -> List[str]:
+        rows = self.db.execute("SELECT name FROM labels ORDER BY class_idx").fetchall()
+        return [r[0] for r in rows] or list(DEFAULT_LABELS)
+
+    def add_field(self, name: str, polygon: Sequence[Sequence[float]]):
+        """Field boundary as [(lat, lon), ...]; records are only rolled up under fields added before ingest."""
+        polygon = np.asarray(polygon, dtype=np.float64)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO fields VALUES (?, ?, ?, ?, ?, ?)",
+                            (name, json.dumps(polygon.tolist()), polygon[:, 0].min(), polygon[:, 1].min(),
+                             polygon[:, 0].max(), polygon[:, 1].max()))
+        self._fields = None
+
+    def fields(self) -> List[tuple]:
+        if self._fields is None:
+            self._fields = [(name, np.asarray(json.loads(poly)))
+                            for name, poly in self.db.execute("SELECT name, polygon FROM fields ORDER BY name")]
+        return self._fields
+
+    def _assign(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Field number (index into fields(), -1 for none) of every record; first matching field wins."""
+        field = np.full(len(lat), -1, dtype=np.int64)
+        for i, (_, poly) in enumerate(self.fields()):
+            box = ((field < 0) & (lat >= poly[:, 0].min()) & (lat <= poly[:, 0].max())
+                   & (lon >= poly[:, 1].min()) & (lon <= poly[:, 1].max()))
+            candidates = np.flatnonzero(box)
+            inside = points_in_polygon(lon[candidates], lat[candidates], poly[:, 1], poly[:, 0])
+            field[candidates[inside]] = i
+        return field
+
+    def _day(self, timestamp: np.ndarray) -> np.ndarray:
+        return np.floor((timestamp + self.utc_offset) / DAY).astype(np.int64)
+
+    def add_records(self, records: np.ndarray, segment: str, offset: int = 0, path: Optional[str] = None):
+        """Roll up detection-log records; `offset` is the index of records[0] within the segment.
+
+        With the segment's path, its ingested record count is advanced in the same
+        transaction, so an interrupted ingest never counts records twice or skips them.
+        """
+        names = [name for name, _ in self.fields()] + [UNASSIGNED]
+        daily, partitions = [], []
+        for start in range(0, len(records), BATCH):
+            batch = records[start:start + BATCH]
+            lat, lon = np.asarray(batch["lat"]), np.asarray(batch["lon"])
+            field = self._assign(lat, lon)
+            field[field < 0] = len(names) - 1
+            day = self._day(np.asarray(batch["timestamp"])) + (1 << 31)  # non-negative for packing
+            class_idx = np.asarray(batch["class_idx"], dtype=np.int64)
+
+            # group by (field, day, class) in NumPy, one upsert per group
+            key = (field * (1 << 32) + day) * 256 + class_idx
+            keys, inverse = np.unique(key, return_inverse=True)
+            counts = np.bincount(inverse)
+            scores = np.bincount(inverse, weights=np.asarray(batch["score"], dtype=np.float64))
+            daily += [(names[k >> 40], int(((k >> 8) & 0xFFFFFFFF) - (1 << 31)), int(k & 0xFF), int(n), float(s))
+                      for k, n, s in zip(keys.tolist(), counts, scores)]
+
+            # records of one drive are in time order, so a (field, day) is a few contiguous runs
+            key >>= 8
+            runs = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+            stops = np.r_[runs[1:], len(key)]
+            partitions += [(names[field[a]], int(day[a]) - (1 << 31), segment, offset + start + int(a), offset + start + int(b),
+                            int(b - a)) for a, b in zip(runs, stops)]
+        with self.db:
+            self.db.executemany("""
+                INSERT INTO daily VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (field, day, class_idx)
+                DO UPDATE SET records = records + excluded.records, score_sum = score_sum + excluded.score_sum
+            """, daily)
+            self.db.executemany("INSERT INTO partitions VALUES (?, ?, ?, ?, ?, ?)", partitions)
+            if path is not None:
+                self.db.execute("INSERT OR REPLACE INTO segments VALUES (?, ?, ?)",
+                                (segment, offset + len(records), os.path.abspath(path)))
+
+    def ingest(self, paths: Sequence[str]) -> int:
+        """Roll up the records not yet ingested from each segment (new segments and appended tails)."""
+        added = 0
+        ingested = dict(self.db.execute("SELECT name, records FROM segments"))
+        for key, path, start, records in new_records(paths, ingested):
+            if not self.db.execute("SELECT 1 FROM labels").fetchone():
+                labels = read_header(path)["labels"] or DEFAULT_LABELS
+                with self.db:
+                    self.db.executemany("INSERT INTO labels VALUES (?, ?)", list(enumerate(labels)))
+            self.add_records(records, key, start, path)
+            added += len(records)
+        return added
+
+    def add_treatment(self, field: str, time_s: float, chemical: str, chemical_class: str = "",
+                      amount: str = "", lat: Optional[float] = None, lon: Optional[float] = None) -> int:
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO treatments (field, day, time, chemical, chemical_class, amount, lat, lon) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (field, int(self._day(np.array([time_s]))[0]), time_s, chemical, chemical_class, amount, lat, lon))
+        return cursor.lastrowid
+
+    def _date(self, day: int) -> str:
+        return datetime.fromtimestamp(day * DAY, tz=timezone.utc).strftime("%Y-%m-%d")
+
+    def _range(self, start: Optional[str], end: Optional[str]):
+        to_day = lambda s: int(datetime.strptime(s, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()) // DAY
+        return (to_day(start) if start else -(1 << 40)), (to_day(end) if end else 1 << 40)
+
+    def day_start(self, date: str) -> float:
+        """Unix time of midnight starting a YYYY-MM-DD day, in the store's UTC offset."""
+        return self._range(date, None)[0] * DAY - self.utc_offset
+
+    def coverage(self, field: str, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+        """Per day, the percentage of records of every class (WeedCoverageGraph's DataPoint)."""
+        first, last = self._range(start, end)
+        labels = self.labels()
+        points = {}
+        for day, class_idx, records in self.db.execute(
+                "SELECT day, class_idx, records FROM daily WHERE field = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (field, first, last)):
+            points.setdefault(day, np.zeros(len(labels)))[class_idx] += records
+        result = []
+        for day, counts in points.items():
+            point = {"date": self._date(day), "timestamp": day * DAY}
+            point.update({_camel(label): round(100 * float(c) / float(counts.sum()), 2) for label, c in zip(labels, counts)})
+            result.append(point)
+        return result
+
+    def species(self, field: str, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+        """Records, share, mean score and treatment success per weed class over a date range (WeedSpeciesTable).
+
+        Soil is not a species and is left out, though its records still count in the
+        shares. success is how much of the class's share of records the field's
+        treatments in the range removed: 100 * (1 - share after the last / share before
+        the first), clipped to 0-100, and 0 without a treatment and records on both sides.
+        """
+        first, last = self._range(start, end)
+        labels = self.labels()
+        weeds = weed_classes(labels)
+        counts = {}
+        for day, class_idx, records in self.db.execute(
+                "SELECT day, class_idx, records FROM daily WHERE field = ? AND day BETWEEN ? AND ?",
+                (field, first, last)):
+            counts.setdefault(day, np.zeros(len(labels)))[class_idx] += records
+        days = np.array(sorted(counts), dtype=np.int64)
+        daily = np.array([counts[d] for d in days]).reshape(len(days), len(labels))
+        treated = self.db.execute("SELECT MIN(day), MAX(day) FROM treatments WHERE field = ? AND day BETWEEN ? AND ?",
+                                  (field, first, last)).fetchone()
+        before = daily[days < treated[0]].sum(axis=0) if treated[0] is not None else np.zeros(len(labels))
+        after = daily[days > treated[1]].sum(axis=0) if treated[1] is not None else np.zeros(len(labels))
+        rows = self.db.execute(
+            "SELECT class_idx, SUM(records), SUM(score_sum) FROM daily "
+            "WHERE field = ? AND day BETWEEN ? AND ? GROUP BY class_idx ORDER BY 2 DESC", (field, first, last)).fetchall()
+        total = sum(r[1] for r in rows) or 1
+        result = []
+        for c, n, s in rows:
+            if c not in weeds:
+                continue
+            success = 0.0
+            if before.sum() and after.sum() and before[c]:
+                success = float(np.clip(100 * (1 - (after[c] / after.sum()) / (before[c] / before.sum())), 0, 100))
+            result.append({"name": labels[c] if c < len(labels) else str(c), "count": n,
+                           "share": round(100 * n / total, 2), "mean_score": round(s / n, 4),
+                           "success": round(success, 1)})
+        return result
+
+    def treatments(self, field: Optional[str] = None) -> List[dict]:
+        """Treatment history, newest first, shaped like the dashboard's Treatment."""
+        query = "SELECT id, chemical, chemical_class, day, amount, lat, lon FROM treatments"
+        rows = self.db.execute(query + (" WHERE field = ?" if field else "") + " ORDER BY time DESC",
+                               (field,) if field else ())
+        return [{"id": str(i), "chemical": chem, "class": cls, "date": self._date(day), "amount": amount,
+                 "lat": "" if lat is None else f"{lat:.6f}", "long": "" if lon is None else f"{lon:.6f}"}
+                for i, chem, cls, day, amount, lat, lon in rows]
+
+    def records(self, field: str, date: str) -> np.ndarray:
+        """The raw records of one field and day, read from the segments through the partition table."""
+        day = self._range(date, None)[0]
+        parts = self.db.execute(
+            "SELECT p.start, p.stop, s.path FROM partitions p JOIN segments s ON s.name = p.segment "
+            "WHERE p.field = ? AND p.day = ? ORDER BY s.name, p.start", (field, day)).fetchall()
+        arrays = [read_log(path)[start:stop] for start, stop, path in parts]
+        return np.concatenate(arrays) if arrays else np.zeros(0, dtype=record_dtype())
+
+
+QUERIES = {"coverage": AnalyticsStore.coverage, "species": AnalyticsStore.species}
+
+
+def benchmark(n: int = 10_000_000, days: int = 100):
+    """Ingest n synthetic 10 Hz records over `days` days into a temporary store and time the queries."""
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    directory = tempfile.mkdtemp(prefix="analytics_")
+    store = AnalyticsStore(os.path.join(directory, "season.db"))
+    lat0, lon0 = 38.5382, -121.7617
+    for i, name in enumerate(["North Block", "South Block"]):
+        south = lat0 + i * 0.004
+        store.add_field(name, [(south, lon0), (south, lon0 + 0.004), (south + 0.004, lon0 + 0.004),
+                               (south + 0.004, lon0)])
+    records = np.zeros(n, dtype=record_dtype())
+    records["timestamp"] = 1.75e9 + np.sort(rng.integers(0, days, n)) * DAY + np.tile(np.arange(n // days + 1) / 10,
+                                                                                      days)[:n]
+    sweep = np.tile(np.linspace(0, 1, n // days + 1), days)[:n]  # one drive through both blocks per day
+    records["lat"] = lat0 + 0.008 * sweep + rng.normal(0, 1e-5, n)
+    records["lon"] = lon0 + rng.uniform(0, 0.004, n)
+    records["class_idx"] = rng.integers(0, 3, n)
+    records["score"] = rng.uniform(0.5, 1.0, n)
+    start = time.perf_counter()
+    store.add_records(records, "synthetic")
+    elapsed = time.perf_counter() - start
+    print(f"ingested {n} records over {days} days in {elapsed:.1f} s ({n / elapsed / 1e6:.1f} M records/s), "
+          f"{os.path.getsize(store.path) / 1e6:.1f} MB")
+    for name, query in (("coverage", lambda: store.coverage("North Block")),
+                        ("species", lambda: store.species("North Block")),
+                        ("treatments", lambda: store.treatments("North Block"))):
+        start = time.perf_counter()
+        for _ in range(20):
+            result = query()
+        print(f"{name:>10}: {(time.perf_counter() - start) / 20 * 1000:.2f} ms ({len(result)} rows)")
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--utc-offset", type=float, default=0.0, help="Hours; days start at local midnight")
+    sub = parser.add_subparsers(dest="command", required=True)
+    field = sub.add_parser("add-field", help="Add or replace a field boundary")
+    field.add_argument("db")
+    field.add_argument("name")
+    field.add_argument("geojson", help="GeoJSON file with the field Polygon (first feature)")
+    ingest = sub.add_parser("ingest", help="Roll up new log records")
+    ingest.add_argument("db")
+    ingest.add_argument("paths", nargs="+", help="Segment files or log directories")
+    treatment = sub.add_parser("add-treatment", help="Record a treatment")
+    treatment.add_argument("db")
+    treatment.add_argument("field")
+    treatment.add_argument("chemical")
+    treatment.add_argument("--date", type=str, help="YYYY-MM-DD (default: now)")
+    treatment.add_argument("--class", dest="chemical_class", default="")
+    treatment.add_argument("--amount", default="")
+    treatment.add_argument("--position", type=str, help="lat,lon")
+    query = sub.add_parser("query", help="Print a dashboard query as JSON")
+    query.add_argument("db")
+    query.add_argument("view", choices=list(QUERIES) + ["treatments", "fields"])
+    query.add_argument("--field", type=str, default=UNASSIGNED)
+    query.add_argument("--start", type=str, help="YYYY-MM-DD")
+    query.add_argument("--end", type=str, help="YYYY-MM-DD")
+    bench = sub.add_parser("benchmark", help="Time ingest and queries on synthetic records")
+    bench.add_argument("-n", type=int, default=10_000_000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.command == "benchmark":
+        benchmark(args.n)
+        sys.exit()
+    store = AnalyticsStore(args.db, args.utc_offset)
+    if args.command == "add-field":
+        with open(args.geojson) as f:
+            geometry = json.load(f)
+        geometry = geometry["features"][0]["geometry"] if "features" in geometry else geometry
+        store.add_field(args.name, [(lat, lon) for lon, lat in geometry["coordinates"][0]])
+    elif args.command == "ingest":
+        start = time.perf_counter()
+        added = store.ingest(args.paths)
+        print(f"Rolled up {added} records in {time.perf_counter() - start:.2f} s")
+    elif args.command == "add-treatment":
+        when = store.day_start(args.date) if args.date else time.time()
+        lat, lon = [float(v) for v in args.position.split(",")] if args.position else (None, None)
+        print(store.add_treatment(args.field, when, args.chemical, args.chemical_class, args.amount, lat, lon))
+    elif args.view == "fields":
+        print(json.dumps([name for name, _ in store.fields()]))
+    elif args.view == "treatments":
+        print(json.dumps(store.treatments(args.field or None), indent=2))
+    else:
+        print(json.dumps(QUERIES[args.view](store, args.field, args.start, args.end), indent=2))
+    store.close()
@@ -0,0 +1,121 @@
+"""
+Plumbing shared by the field_data tools.
+
+Importing this module puts imx500/ on sys.path, so import it before detection_log.
+It also holds the pieces every store repeats: expanding log paths into segments,
+tracking how many records of each segment were already added (so updates only read
+new segments and appended tails), growing a (..., ny, nx) cell array, dropping implausible fixes before they are binned,
+and the update commands' load-or-create step with its origin taken from the first
+GPS-fixed record.
+"""
+import os
+import sys
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "imx500"))
+from detection_log import DEFAULT_LABELS, list_segments, read_header, read_log
+
+BATCH = 1 << 20  # records handled per vectorized call
+MAX_EXTENT_M = 5000.0  # fixes further than this from a store's origin are dropped
+
+
+def expand_paths(paths: Sequence[str]) -> List[str]:
+    """Log segments from a mix of segment files and log directories."""
+    segments = []
+    for p in paths:
+        segments += list_segments(p) if os.path.isdir(p) else [p]
+    return segments
+
+
+def weed_classes(labels: Sequence[str], names: Optional[Sequence[str]] = None) -> List[int]:
+    """Class indices counted as weeds: the given names, or every label except Soil."""
+    if names:
+        return [labels.index(n) for n in names]
+    return [i for i, label in enumerate(labels) if label.lower() != "soil"]
+
+
+def segment_key(path: str) -> str:
+    """Name a segment is tracked under in a store's `ingested` bookkeeping: <log dir>/<file>.
+
+    Segment file names only carry their start second, so two devices' logs (stored as
+    <root>/<device>/ by ingest_server.py) can share one; the directory tells them apart.
+    """
+    return f"{os.path.basename(os.path.dirname(os.path.abspath(path)))}/{os.path.basename(path)}"
+
+
+def new_records(paths: Sequence[str], ingested: Dict[str, int]) -> List[Tuple[str, str, int, np.ndarray]]:
+    """(key, path, start, records[start:]) of every segment with records past ingested[key].
+
+    The caller adds the records and then sets ingested[key] = start + len(records).
+    """
+    pending = []
+    for path in expand_paths(paths):
+        key = segment_key(path)
+        records = read_log(path)
+        start = ingested.get(key, 0)
+        if len(records) > start:
+            pending.append((key, path, start, records[start:]))
+    return pending
+
+
+def grow(array: np.ndarray, ix0: int, iy0: int, ix_min: int, ix_max: int, iy_min: int, iy_max: int,
+         fill=0) -> Tuple[np.ndarray, int, int]:
+    """Enlarge a (..., ny, nx) array whose [..., 0, 0] is absolute cell (ix0, iy0) to cover
+    cells [ix_min, ix_max] x [iy_min, iy_max]; returns the array and its new (ix0, iy0)."""
+    ny, nx = array.shape[-2:]
+    if nx and ny:
+        ix_min, iy_min = min(ix_min, ix0), min(iy_min, iy0)
+        ix_max, iy_max = max(ix_max, ix0 + nx - 1), max(iy_max, iy0 + ny - 1)
+        if (ix_min, iy_min) == (ix0, iy0) and (ix_max - ix_min + 1, iy_max - iy_min + 1) == (nx, ny):
+            return array, ix0, iy0
+    grown = np.full(array.shape[:-2] + (iy_max - iy_min + 1, ix_max - ix_min + 1), fill, dtype=array.dtype)
+    if nx and ny:
+        y, x = iy0 - iy_min, ix0 - ix_min
+        grown[..., y:y + ny, x:x + nx] = array
+    return grown, int(ix_min), int(iy_min)
+
+
+def on_field(projection, lat: np.ndarray, lon: np.ndarray, max_extent: float = MAX_EXTENT_M):
+    """(keep, east, north): projected fixes and the mask of those worth binning.
+
+    NaN fixes, the 0,0 some receivers report before they have a fix, and outliers
+    more than max_extent metres from the origin are dropped. One such point would
+    otherwise stretch the grid's bounding box across a continent.
+    """
+    east, north = projection.forward(lat, lon)
+    keep = (np.hypot(east, north) <= max_extent) & ~((lat == 0) & (lon == 0))
+    return keep, east, north
+
+
+def first_fix(segments: Sequence[str]) -> Optional[Tuple[float, float]]:
+    """(lat, lon) of the first record with a GPS fix, or None if no segment has one."""
+    for path in segments:
+        records = read_log(path)
+        lat, lon = records["lat"], records["lon"]
+        placed = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon) | ((lat == 0) & (lon == 0))))
+        if len(placed):
+            return float(records["lat"][placed[0]]), float(records["lon"][placed[0]])
+    return None
+
+
+def origin_and_labels(segments: Sequence[str], origin: Optional[str] = None) -> Tuple[float, float, List[str]]:
+    """For the CLIs: origin from "lat,lon" or the first fix, and the logs' labels; exits with a hint if neither."""
+    if not segments:
+        sys.exit("No log segments found")
+    if origin:
+        lat, lon = [float(v) for v in origin.split(",")]
+    else:
+        fix = first_fix(segments)
+        if fix is None:
+            sys.exit("No records with a GPS fix in the logs, give --origin")
+        lat, lon = fix
+    return lat, lon, read_header(segments[0])["labels"] or list(DEFAULT_LABELS)
+
+
+def load_or_create(path: str, segments: Sequence[str], origin: Optional[str], load: Callable, create: Callable):
+    """The update commands' store: load(path) if it exists, else create(origin_lat, origin_lon, labels)."""
+    if os.path.exists(path):
+        return load(path)
+    return create(*origin_and_labels(segments, origin))
@@ -0,0 +1,277 @@
+"""
+Weed-density grid over the field, built from the detection logs.
+
+Geotagged classification records (imx500/detection_log.py) are binned into a metric
+grid around a fixed origin (geo.LocalProjection): per cell and class the number of
+records and their summed score. Binning is a single np.bincount per batch over the
+bounding box of the batch, so millions of records take well under a second, and
+the grid grows as drives cover new ground.
+
+The grid is saved as one .npz together with how many records of each log segment
+it already holds, so `update` after every drive only reads the new records.
+`tiles` writes a multi-resolution pyramid (2x2 cells summed per level) as sparse
+JSON tiles plus a GeoJSON of cells for the dashboard, which then never touches raw
+records:
+
+    python density_grid.py update field.npz ../imx500/survey_log --cell-size 1
+    python density_grid.py tiles field.npz tiles/ --levels 5 --geojson density.geojson
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from common import BATCH, MAX_EXTENT_M, expand_paths, grow, load_or_create, new_records, on_field, weed_classes
+from detection_log import DEFAULT_LABELS
+from geo import LocalProjection
+
+
+def _pool(counts: np.ndarray, ix0: int, iy0: int):
+    """Sum 2x2 blocks of (..., ny, nx) aligned to even absolute cell indices."""
+    pad_x0, pad_y0 = ix0 % 2, iy0 % 2
+    ny, nx = counts.shape[-2:]
+    pad_x1, pad_y1 = (nx + pad_x0) % 2, (ny + pad_y0) % 2
+    padded = np.pad(counts, [(0, 0)] * (counts.ndim - 2) + [(pad_y0, pad_y1), (pad_x0, pad_x1)])
+    ny, nx = padded.shape[-2:]
+    pooled = padded.reshape(counts.shape[:-2] + (ny // 2, 2, nx // 2, 2)).sum(axis=(-3, -1))
+    return pooled, ix0 // 2, iy0 // 2
+
+
+class DensityGrid:
+    def __init__(self, origin_lat: float, origin_lon: float, cell_size: float = 1.0,
+                 labels: Sequence[str] = DEFAULT_LABELS, max_extent: float = MAX_EXTENT_M):
+        """Cells of cell_size metres; cell (ix, iy) covers east [ix, ix + 1) and north [iy, iy + 1) * cell_size.
+
+        Records more than max_extent metres from the origin are taken for GPS glitches and skipped.
+        """
+        self.projection = LocalProjection(origin_lat, origin_lon)
+        self.cell_size = float(cell_size)
+        self.max_extent = float(max_extent)
+        self.labels = list(labels)
+        self.num_classes = len(self.labels)
+        self.ix0 = self.iy0 = 0  # absolute index of cell [:, 0, 0]
+        self.counts = np.zeros((self.num_classes, 0, 0), dtype=np.int64)
+        self.score_sum = np.zeros((self.num_classes, 0, 0), dtype=np.float64)
+        self.ingested: Dict[str, int] = {}  # segment key -> records already added
+
+    @property
+    def shape(self):
+        return self.counts.shape[1:]
+
+    def _grow(self, ix_min: int, ix_max: int, iy_min: int, iy_max: int):
+        """Make sure absolute cells [ix_min, ix_max] x [iy_min, iy_max] exist."""
+        bounds = (ix_min, ix_max, iy_min, iy_max)
+        counts, ix0, iy0 = grow(self.counts, self.ix0, self.iy0, *bounds)
+        self.score_sum, _, _ = grow(self.score_sum, self.ix0, self.iy0, *bounds)
+        self.counts, self.ix0, self.iy0 = counts, ix0, iy0
+
+    def add(self, lat: np.ndarray, lon: np.ndarray, class_idx: np.ndarray, score: Optional[np.ndarray] = None) -> int:
+        """Bin records into the grid; records without a plausible fix or with an unknown class are skipped."""
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        class_idx = np.asarray(class_idx, dtype=np.int64)
+        keep, east, north = on_field(self.projection, lat, lon, self.max_extent)
+        keep &= class_idx < self.num_classes
+        if not keep.all():
+            east, north, class_idx = east[keep], north[keep], class_idx[keep]
+            score = None if score is None else np.asarray(score)[keep]
+        if not len(east):
+            return 0
+        ix = np.floor(east / self.cell_size).astype(np.int64)
+        iy = np.floor(north / self.cell_size).astype(np.int64)
+        ix_min, ix_max, iy_min, iy_max = int(ix.min()), int(ix.max()), int(iy.min()), int(iy.max())
+        self._grow(ix_min, ix_max, iy_min, iy_max)
+
+        # bincount over the batch's bounding box only, then add that window into the grid
+        ny, nx = iy_max - iy_min + 1, ix_max - ix_min + 1
+        flat = (class_idx * ny + (iy - iy_min)) * nx + (ix - ix_min)
+        size = self.num_classes * ny * nx
+        y, x = iy_min - self.iy0, ix_min - self.ix0
+        self.counts[:, y:y + ny, x:x + nx] += np.bincount(flat, minlength=size).reshape(-1, ny, nx)
+        if score is not None:
+            self.score_sum[:, y:y + ny, x:x + nx] += np.bincount(flat, weights=score, minlength=size).reshape(-1, ny, nx)
+        return len(east)
+
+    def add_records(self, records: np.ndarray) -> int:
+        """Bin detection-log records, in batches so memory-mapped logs are never loaded whole."""
+        added = 0
+        for start in range(0, len(records), BATCH):
+            batch = records[start:start + BATCH]
+            added += self.add(batch["lat"], batch["lon"], batch["class_idx"], batch["score"])
+        return added
+
+    def update_from_logs(self, paths: Sequence[str]) -> int:
+        """Add the records not yet in the grid from each segment (new segments and appended tails)."""
+        added = 0
+        for key, _, start, records in new_records(paths, self.ingested):
+            added += self.add_records(records)
+            self.ingested[key] = start + len(records)
+        return added
+
+    def density(self, classes: Optional[Sequence[int]] = None, counts: Optional[np.ndarray] = None) -> np.ndarray:
+        """Fraction of each cell's records in `classes` (default weed_classes), NaN where there are none."""
+        counts = self.counts if counts is None else counts
+        classes = weed_classes(self.labels) if classes is None else classes
+        total = counts.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(total > 0, counts[list(classes)].sum(axis=0) / total, np.nan)
+
+    def pyramid(self, levels: int = 4) -> List[dict]:
+        """Level 0 is the grid itself; every further level sums 2x2 cells of the one below."""
+        counts, score_sum, ix0, iy0 = self.counts, self.score_sum, self.ix0, self.iy0
+        result = [{"level": 0, "cell_size": self.cell_size, "ix0": ix0, "iy0": iy0,
+                   "counts": counts, "score_sum": score_sum}]
+        for level in range(1, levels):
+            score_sum, _, _ = _pool(score_sum, ix0, iy0)
+            counts, ix0, iy0 = _pool(counts, ix0, iy0)
+            result.append({"level": level, "cell_size": self.cell_size * 2 ** level, "ix0": ix0, "iy0": iy0,
+                           "counts": counts, "score_sum": score_sum})
+        return result
+
+    def cell_bounds(self, ix: np.ndarray, iy: np.ndarray, cell_size: Optional[float] = None):
+        """(south, west, north, east) in degrees of absolute cells."""
+        cell_size = self.cell_size if cell_size is None else cell_size
+        south, west = self.projection.inverse(ix * cell_size, iy * cell_size)
+        north, east = self.projection.inverse((ix + 1) * cell_size, (iy + 1) * cell_size)
+        return south, west, north, east
+
+    def save(self, path: str):
+        meta = {**self.projection.to_dict(), "cell_size": self.cell_size, "labels": self.labels,
+                "max_extent": self.max_extent, "ix0": self.ix0, "iy0": self.iy0, "ingested": self.ingested}
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, counts=self.counts, score_sum=self.score_sum, meta=json.dumps(meta))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DensityGrid":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            grid = cls(meta["origin_lat"], meta["origin_lon"], meta["cell_size"], meta["labels"],
+                       meta.get("max_extent", MAX_EXTENT_M))
+            grid.counts, grid.score_sum = data["counts"], data["score_sum"]
+        grid.ix0, grid.iy0, grid.ingested = meta["ix0"], meta["iy0"], meta["ingested"]
+        return grid
+
+
+def write_tiles(grid: DensityGrid, out_dir: str, levels: int = 4, tile_cells: int = 256) -> int:
+    """Sparse JSON tiles, out_dir/<level>/<tx>_<ty>.json, plus out_dir/index.json describing them.
+
+    A tile lists its non-empty cells as [ix, iy, count per class...] with absolute
+    cell indices; cell bounds follow from the origin and cell size in index.json.
+    """
+    index = {**grid.projection.to_dict(), "labels": grid.labels, "tile_cells": tile_cells,
+             "weed_classes": weed_classes(grid.labels), "levels": []}
+    written = 0
+    for level in grid.pyramid(levels):
+        counts = level["counts"]
+        iy, ix = np.nonzero(counts.sum(axis=0))
+        tiles = []
+        if len(ix):
+            abs_ix, abs_iy = ix + level["ix0"], iy + level["iy0"]
+            tx, ty = abs_ix // tile_cells, abs_iy // tile_cells
+            order = np.lexsort((ty, tx))
+            keys = np.stack([tx[order], ty[order]], axis=1)
+            starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+            os.makedirs(os.path.join(out_dir, str(level["level"])), exist_ok=True)
+            for s, e in zip(starts, np.r_[starts[1:], len(order)]):
+                cells = order[s:e]
+                rows = np.column_stack([abs_ix[cells], abs_iy[cells], counts[:, iy[cells], ix[cells]].T])
+                name = f"{keys[s, 0]}_{keys[s, 1]}"
+                with open(os.path.join(out_dir, str(level["level"]), name + ".json"), "w") as f:
+                    json.dump({"level": level["level"], "cell_size": level["cell_size"], "cells": rows.tolist()}, f,
+                              separators=(",", ":"))
+                tiles.append(name)
+                written += 1
+        index["levels"].append({"level": level["level"], "cell_size": level["cell_size"], "tiles": tiles})
+    with open(os.path.join(out_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+    return written
+
+
+def export_geojson(grid: DensityGrid, path: str, level: int = 0, min_count: int = 1):
+    """Non-empty cells of one pyramid level as polygons with counts and weed density."""
+    data = grid.pyramid(level + 1)[level]
+    counts = data["counts"]
+    total = counts.sum(axis=0)
+    density = grid.density(counts=counts)
+    iy, ix = np.nonzero(total >= min_count)
+    south, west, north, east = grid.cell_bounds(ix + data["ix0"], iy + data["iy0"], data["cell_size"])
+    features = [{
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": [[[round(float(w), 7), round(float(s), 7)],
+                                                         [round(float(e), 7), round(float(s), 7)],
+                                                         [round(float(e), 7), round(float(n), 7)],
+                                                         [round(float(w), 7), round(float(n), 7)],
+                                                         [round(float(w), 7), round(float(s), 7)]]]},
+        "properties": {"count": int(total[y, x]), "density": round(float(density[y, x]), 4),
+                       **{label: int(counts[c, y, x]) for c, label in enumerate(grid.labels)}},
+    } for s, w, n, e, y, x in zip(south, west, north, east, iy, ix)]
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def benchmark(n: int = 10_000_000, cell_size: float = 1.0):
+    """Bin n synthetic records over a 400 x 400 m block and write the tile pyramid."""
+    rng = np.random.default_rng(0)
+    grid = DensityGrid(38.5382, -121.7617, cell_size)
+    lat = 38.5382 + rng.uniform(0, 400, n) / 111_320.0
+    lon = -121.7617 + rng.uniform(0, 400, n) / 87_000.0
+    classes = rng.integers(0, 3, n)
+    scores = rng.uniform(0.5, 1.0, n).astype(np.float32)
+    start = time.perf_counter()
+    for s in range(0, n, BATCH):
+        grid.add(lat[s:s + BATCH], lon[s:s + BATCH], classes[s:s + BATCH], scores[s:s + BATCH])
+    binned = time.perf_counter() - start
+    out_dir = tempfile.mkdtemp(prefix="density_tiles_")
+    start = time.perf_counter()
+    tiles = write_tiles(grid, out_dir, levels=5)
+    print(f"{n} records into {grid.shape[1]}x{grid.shape[0]} cells: {binned:.2f} s "
+          f"({n / binned / 1e6:.1f} M records/s), {tiles} tiles in {time.perf_counter() - start:.2f} s")
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    update = sub.add_parser("update", help="Add new log records to a grid (created if missing)")
+    update.add_argument("grid", help="Grid .npz")
+    update.add_argument("paths", nargs="+", help="Segment files or log directories")
+    update.add_argument("--cell-size", type=float, default=1.0, help="Cell size in metres (new grids only)")
+    update.add_argument("--origin", type=str, help="lat,lon of the grid origin (new grids; default: first record)")
+    update.add_argument("--max-extent", type=float, default=MAX_EXTENT_M,
+                        help="Skip fixes further than this from the origin, in metres (new grids only)")
+    tiles = sub.add_parser("tiles", help="Write the tile pyramid and/or a GeoJSON for the dashboard")
+    tiles.add_argument("grid", help="Grid .npz")
+    tiles.add_argument("out_dir", nargs="?", help="Tile directory")
+    tiles.add_argument("--levels", type=int, default=4)
+    tiles.add_argument("--tile-cells", type=int, default=256, help="Cells per tile side")
+    tiles.add_argument("--geojson", type=str, help="Also write cells of --geojson-level as GeoJSON polygons")
+    tiles.add_argument("--geojson-level", type=int, default=0)
+    bench = sub.add_parser("benchmark", help="Time binning synthetic records")
+    bench.add_argument("-n", type=int, default=10_000_000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.command == "benchmark":
+        benchmark(args.n)
+    elif args.command == "update":
+        segments = expand_paths(args.paths)
+        grid = load_or_create(args.grid, segments, args.origin, DensityGrid.load,
+                              lambda lat, lon, labels: DensityGrid(lat, lon, args.cell_size, labels, args.max_extent))
+        start = time.perf_counter()
+        added = grid.update_from_logs(segments)
+        grid.save(args.grid)
+        print(f"Added {added} records in {time.perf_counter() - start:.2f} s; "
+              f"grid {grid.shape[1]}x{grid.shape[0]} cells of {grid.cell_size:g} m, {int(grid.counts.sum())} records")
+    else:
+        grid = DensityGrid.load(args.grid)
+        if args.out_dir:
+            print(f"Wrote {write_tiles(grid, args.out_dir, args.levels, args.tile_cells)} tiles to {args.out_dir}")
+        if args.geojson:
+            export_geojson(grid, args.geojson, args.geojson_level)
+            print(f"Wrote {args.geojson}")
@@ -0,0 +1,285 @@
+"""
+Multi-pass fusion of the detection logs into per-cell class posteriors.
+
+Every mowing pass re-observes the same rows. Instead of counting records (as
+density_grid.py does), each grid cell keeps a Dirichlet posterior over the classes,
+stored as a dense (num_classes, ny, nx) array of concentration parameters `alpha`.
+An observation adds evidence to alpha:
+
+- its class evidence is the stored probability vector when the log has one,
+  otherwise the top-1 score on its class with the rest spread evenly;
+- it is weighted by confidence, (score - 1/K) / (1 - 1/K), so near-uniform
+  outputs count for nothing;
+- GPS uncertainty is modelled by splitting the observation over the cells within
+  about 2 sigma, using Gaussian weights from the record's exact position.
+
+All of this is a handful of np.bincount calls per drive. Before each drive the
+evidence decays towards the prior with a half-life, so old passes fade out instead
+of outvoting recent ones. Snapshots of the posterior (e.g. at a treatment) are kept
+in the store, so "weed pressure now" and "change since the last treatment" are
+answered from alpha alone, without reprocessing any history.
+
+    python fusion.py update field_fusion.npz ../imx500/survey_log --gps-sigma 1.5 --half-life 14
+    python fusion.py snapshot field_fusion.npz treatment-2026-05-02
+    python fusion.py query field_fusion.npz --since treatment-2026-05-02 --geojson change.geojson
+"""
+import argparse
+import json
+import math
+import os
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from common import BATCH, MAX_EXTENT_M, expand_paths, grow, load_or_create, new_records, on_field, weed_classes
+from detection_log import DEFAULT_LABELS, FLAG_NO_FIX
+from geo import LocalProjection
+
+DAY = 86_400.0
+
+
+class FusionStore:
+    def __init__(self, origin_lat: float, origin_lon: float, cell_size: float = 1.0,
+                 labels: Sequence[str] = DEFAULT_LABELS, prior: float = 0.5, gps_sigma: float = 1.5,
+                 half_life_days: float = 14.0, max_extent: float = MAX_EXTENT_M):
+        """Dirichlet(prior, ..., prior) per cell; evidence halves every half_life_days (0 = never).
+
+        Observations more than max_extent metres from the origin are taken for GPS glitches and skipped.
+        """
+        self.projection = LocalProjection(origin_lat, origin_lon)
+        self.cell_size = float(cell_size)
+        self.max_extent = float(max_extent)
+        self.labels = list(labels)
+        self.num_classes = len(self.labels)
+        self.prior = prior
+        self.gps_sigma = gps_sigma
+        self.half_life_days = half_life_days
+        self.ix0 = self.iy0 = 0
+        self.alpha = np.full((self.num_classes, 0, 0), prior, dtype=np.float32)
+        self.time = 0.0  # unix time the evidence is decayed to
+        self.snapshots: Dict[str, dict] = {}
+        self.ingested: Dict[str, int] = {}  # segment key -> records already fused
+
+    @property
+    def shape(self):
+        return self.alpha.shape[1:]
+
+    def _grow(self, ix_min: int, ix_max: int, iy_min: int, iy_max: int):
+        self.alpha, self.ix0, self.iy0 = grow(self.alpha, self.ix0, self.iy0, ix_min, ix_max, iy_min, iy_max,
+                                              fill=self.prior)
+
+    def decay_to(self, t: float):
+        """Shrink the evidence (alpha above the prior) for the time elapsed since the last update."""
+        if self.time and self.half_life_days and t > self.time:
+            factor = np.float32(0.5 ** ((t - self.time) / (self.half_life_days * DAY)))
+            self.alpha -= self.prior
+            self.alpha *= factor
+            self.alpha += self.prior
+        self.time = max(self.time, t)
+
+    def evidence(self, class_idx: np.ndarray, score: np.ndarray,
+                 probabilities: Optional[np.ndarray] = None) -> np.ndarray:
+        """(N, K) confidence-weighted class evidence of N observations."""
+        k = self.num_classes
+        score = np.clip(np.asarray(score, dtype=np.float64), 0.0, 1.0)
+        if probabilities is not None:
+            probs = np.asarray(probabilities, dtype=np.float64)
+            probs = probs / np.maximum(probs.sum(axis=1, keepdims=True), 1e-9)
+        else:
+            probs = np.repeat(((1 - score) / max(k - 1, 1))[:, None], k, axis=1)
+            probs[np.arange(len(score)), class_idx] = score
+        confidence = np.clip((probs.max(axis=1) - 1 / k) / (1 - 1 / k), 0.0, 1.0)
+        return probs * confidence[:, None]
+
+    def add(self, lat: np.ndarray, lon: np.ndarray, class_idx: np.ndarray, score: np.ndarray,
+            probabilities: Optional[np.ndarray] = None) -> int:
+        """Fuse observations, each spread over the cells around it by the GPS uncertainty."""
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        class_idx = np.asarray(class_idx, dtype=np.int64)
+        keep, x, y = on_field(self.projection, lat, lon, self.max_extent)
+        keep &= class_idx < self.num_classes
+        if not keep.all():
+            x, y, class_idx, score = x[keep], y[keep], class_idx[keep], np.asarray(score)[keep]
+            probabilities = None if probabilities is None else np.asarray(probabilities)[keep]
+        if not len(x):
+            return 0
+        evidence = self.evidence(class_idx, score, probabilities)
+        fx, fy = x / self.cell_size, y / self.cell_size
+        ix, iy = np.floor(fx).astype(np.int64), np.floor(fy).astype(np.int64)
+
+        radius = int(math.ceil(2 * self.gps_sigma / self.cell_size)) if self.gps_sigma > 0 else 0
+        ix_min, ix_max = int(ix.min()) - radius, int(ix.max()) + radius
+        iy_min, iy_max = int(iy.min()) - radius, int(iy.max()) + radius
+        self._grow(ix_min, ix_max, iy_min, iy_max)
+
+        # The Gaussian is separable: per-axis weights of each neighbour cell centre, normalised per axis.
+        # Distances are taken relative to the nearest centre before exp, so the largest weight is 1 and
+        # a tiny sigma (or gps_sigma 0, radius 0) cannot underflow every weight to 0 and divide 0 by 0.
+        sigma = max(self.gps_sigma / self.cell_size, 1e-6)
+        steps = np.arange(-radius, radius + 1)[:, None]
+        dx2 = (ix + steps + 0.5 - fx) ** 2
+        dy2 = (iy + steps + 0.5 - fy) ** 2
+        wx = np.exp(-(dx2 - dx2.min(axis=0)) / (2 * sigma ** 2))
+        wy = np.exp(-(dy2 - dy2.min(axis=0)) / (2 * sigma ** 2))
+        wx /= wx.sum(axis=0)
+        wy /= wy.sum(axis=0)
+
+        ny, nx = iy_max - iy_min + 1, ix_max - ix_min + 1
+        window = np.zeros((self.num_classes, ny * nx))
+        for a, dy in enumerate(steps[:, 0]):
+            for b, dx in enumerate(steps[:, 0]):
+                flat = (iy + dy - iy_min) * nx + (ix + dx - ix_min)
+                weight = wy[a] * wx[b]
+                for c in range(self.num_classes):
+                    window[c] += np.bincount(flat, weights=weight * evidence[:, c], minlength=ny * nx)
+        y0, x0 = iy_min - self.iy0, ix_min - self.ix0
+        self.alpha[:, y0:y0 + ny, x0:x0 + nx] += window.reshape(-1, ny, nx).astype(np.float32)
+        return len(x)
+
+    def add_records(self, records: np.ndarray) -> int:
+        """Fuse one drive's detection-log records, decaying the store to the drive's time first."""
+        records = records[(records["flags"] & FLAG_NO_FIX) == 0]
+        if not len(records):
+            return 0
+        self.decay_to(float(np.median(records["timestamp"])))
+        probabilities = "probabilities" in records.dtype.names
+        added = 0
+        for start in range(0, len(records), BATCH):
+            batch = records[start:start + BATCH]
+            added += self.add(batch["lat"], batch["lon"], batch["class_idx"], batch["score"],
+                              batch["probabilities"] if probabilities else None)
+        return added
+
+    def update_from_logs(self, paths: Sequence[str]) -> int:
+        """Fuse the records not seen yet, segment by segment in time order."""
+        added = 0
+        for key, _, start, records in sorted(new_records(paths, self.ingested), key=lambda p: p[3]["timestamp"][0]):
+            added += self.add_records(records)
+            self.ingested[key] = start + len(records)
+        return added
+
+    def posterior(self) -> np.ndarray:
+        """Posterior mean class probabilities, (K, ny, nx)."""
+        return self.alpha / self.alpha.sum(axis=0, keepdims=True)
+
+    def pressure(self, classes: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Posterior probability that each cell is weed (any of `classes`, default weed_classes)."""
+        classes = weed_classes(self.labels) if classes is None else classes
+        return self.posterior()[list(classes)].sum(axis=0)
+
+    def certainty(self) -> np.ndarray:
+        """Evidence per cell above the prior, in (decayed) observations."""
+        return self.alpha.sum(axis=0) - self.prior * self.num_classes
+
+    def snapshot(self, name: str, classes: Optional[Sequence[int]] = None):
+        """Remember the current weed pressure under `name`, e.g. when a block is treated."""
+        self.snapshots[name] = {"time": self.time, "ix0": self.ix0, "iy0": self.iy0,
+                                "pressure": self.pressure(classes).astype(np.float32)}
+
+    def change_since(self, name: str, classes: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Weed pressure now minus at the snapshot; cells the snapshot didn't cover compare to the prior."""
+        snap = self.snapshots[name]
+        before = np.full(self.shape, len(weed_classes(self.labels) if classes is None else classes) /
+                         self.num_classes, dtype=np.float32)
+        old = snap["pressure"]
+        y, x = snap["iy0"] - self.iy0, snap["ix0"] - self.ix0
+        before[y:y + old.shape[0], x:x + old.shape[1]] = old
+        return self.pressure(classes) - before
+
+    def save(self, path: str):
+        meta = {**self.projection.to_dict(), "cell_size": self.cell_size, "labels": self.labels,
+                "prior": self.prior, "gps_sigma": self.gps_sigma, "half_life_days": self.half_life_days,
+                "max_extent": self.max_extent,
+                "ix0": self.ix0, "iy0": self.iy0, "time": self.time, "ingested": self.ingested,
+                "snapshots": {name: {k: v for k, v in s.items() if k != "pressure"}
+                              for name, s in self.snapshots.items()}}
+        arrays = {f"snapshot_{i}": s["pressure"] for i, s in enumerate(self.snapshots.values())}
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, alpha=self.alpha, meta=json.dumps(meta), **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "FusionStore":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            store = cls(meta["origin_lat"], meta["origin_lon"], meta["cell_size"], meta["labels"], meta["prior"],
+                        meta["gps_sigma"], meta["half_life_days"], meta.get("max_extent", MAX_EXTENT_M))
+            store.alpha = data["alpha"]
+            for i, (name, snap) in enumerate(meta["snapshots"].items()):
+                store.snapshots[name] = {**snap, "pressure": data[f"snapshot_{i}"]}
+        store.ix0, store.iy0, store.time, store.ingested = meta["ix0"], meta["iy0"], meta["time"], meta["ingested"]
+        return store
+
+
+def export_geojson(store: FusionStore, path: str, values: np.ndarray, name: str, min_certainty: float = 1.0):
+    """Cells with enough evidence as polygons carrying `name` (e.g. pressure or change) and certainty."""
+    certainty = store.certainty()
+    iy, ix = np.nonzero(certainty >= min_certainty)
+    cs = store.cell_size
+    south, west = store.projection.inverse((ix + store.ix0) * cs, (iy + store.iy0) * cs)
+    north, east = store.projection.inverse((ix + store.ix0 + 1) * cs, (iy + store.iy0 + 1) * cs)
+    features = []
+    for s, w, n, e, y, x in zip(south, west, north, east, iy, ix):
+        ring = [[round(float(lon), 7), round(float(lat), 7)] for lon, lat in ((w, s), (e, s), (e, n), (w, n), (w, s))]
+        features.append({"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]},
+                         "properties": {name: round(float(values[y, x]), 4),
+                                        "certainty": round(float(certainty[y, x]), 2)}})
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    update = sub.add_parser("update", help="Fuse new log records into a store (created if missing)")
+    update.add_argument("store", help="Store .npz")
+    update.add_argument("paths", nargs="+", help="Segment files or log directories")
+    update.add_argument("--cell-size", type=float, default=1.0, help="Cell size in metres (new stores only)")
+    update.add_argument("--origin", type=str, help="lat,lon of the origin (new stores; default: first record)")
+    update.add_argument("--gps-sigma", type=float, default=1.5, help="GPS position error, 1 sigma (m)")
+    update.add_argument("--half-life", type=float, default=14.0, help="Days for old evidence to halve (0 = never)")
+    update.add_argument("--max-extent", type=float, default=MAX_EXTENT_M,
+                        help="Skip fixes further than this from the origin, in metres (new stores only)")
+    snapshot = sub.add_parser("snapshot", help="Remember the current weed pressure, e.g. at a treatment")
+    snapshot.add_argument("store", help="Store .npz")
+    snapshot.add_argument("name", help="Snapshot name")
+    query = sub.add_parser("query", help="Summarise weed pressure, or its change since a snapshot")
+    query.add_argument("store", help="Store .npz")
+    query.add_argument("--since", type=str, help="Snapshot to compare against")
+    query.add_argument("--min-certainty", type=float, default=1.0, help="Evidence a cell needs to be reported")
+    query.add_argument("--geojson", type=str, help="Write the cells as GeoJSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.command == "update":
+        segments = expand_paths(args.paths)
+        store = load_or_create(args.store, segments, args.origin, FusionStore.load,
+                               lambda lat, lon, labels: FusionStore(lat, lon, args.cell_size, labels,
+                                                                    gps_sigma=args.gps_sigma,
+                                                                    half_life_days=args.half_life,
+                                                                    max_extent=args.max_extent))
+        start = time.perf_counter()
+        added = store.update_from_logs(segments)
+        store.save(args.store)
+        print(f"Fused {added} records in {time.perf_counter() - start:.2f} s into "
+              f"{store.shape[1]}x{store.shape[0]} cells")
+    elif args.command == "snapshot":
+        store = FusionStore.load(args.store)
+        store.snapshot(args.name)
+        store.save(args.store)
+        print(f"Saved snapshot {args.name}")
+    else:
+        store = FusionStore.load(args.store)
+        values = store.change_since(args.since) if args.since else store.pressure()
+        name = "change" if args.since else "pressure"
+        reported = store.certainty() >= args.min_certainty
+        if reported.any():
+            v = values[reported]
+            print(f"{name}: {reported.sum()} cells, mean {v.mean():.3f}, "
+                  f"p90 {np.percentile(v, 90):.3f}, max {v.max():.3f}")
+        if args.geojson:
+            export_geojson(store, args.geojson, values, name, args.min_certainty)
@@ -0,0 +1,272 @@
+"""
+Ingestion endpoint for the device uploader (imx500/uploader.py).
+
+Segments are stored as <root>/<device>/<segment>, byte-identical to the copy on the
+Pi, so every other field_data tool reads them as ordinary log directories. A POST
+is decompressed, checked against its X-Content-SHA256, and appended only past the
+current length of the file:
+
+- offset == length: append, fsync, acknowledge the new length;
+- offset < length: a resend (the response to an earlier request was lost); the
+  overlapping bytes are compared with what is stored and only the tail is written;
+- offset > length: 409 with the stored length, and the uploader resumes from there.
+
+With --store, touched segments are rolled up into an analytics_store database on a
+background thread, so the dashboard views follow the uploads.
+
+--throttle and --drop simulate a rural link when testing: request bodies are read at
+a fixed rate and a fraction of requests are cut off, half of them mid-body and half
+after the batch is stored but before the reply (which exercises the dedupe). The benchmark command
+runs the real uploader against a throttled, lossy server on localhost and checks the
+copies:
+
+    python ingest_server.py serve /srv/weed_logs --store season.db
+    python ingest_server.py benchmark --throttle 256 --drop 0.1
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from analytics_store import AnalyticsStore
+from common import expand_paths
+from detection_log import SEGMENT_SUFFIX, DetectionRecorder
+from uploader import Uploader
+
+MAX_BODY = 16 * 1024 * 1024  # compressed or decompressed, per request
+PATH = re.compile(r"^/v1/segments/(?!\.+/)([\w.-]+)/([\w.-]+)$")  # a device name of only dots is not a name
+
+
+class IngestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root: str, store: Optional[str] = None, throttle_kbps: float = 0.0,
+                 drop: float = 0.0):
+        """Serve uploads into root; throttle_kbps and drop simulate a slow, unreliable link."""
+        super().__init__(address, IngestHandler)
+        self.root = root
+        self.throttle = throttle_kbps * 1000 / 8  # bytes/s
+        self.drop = drop
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.received = self.duplicate = self.written = 0
+        self._rollup = None
+        if store:
+            self._rollup = queue.Queue()
+            threading.Thread(target=self._run_rollup, args=(store,), daemon=True, name="rollup").start()
+
+    def segment_path(self, device: str, name: str) -> Optional[str]:
+        """Where a device's segment is stored, or None if that would be outside the root."""
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, device, name))
+        return path if os.path.dirname(os.path.dirname(path)) == root else None
+
+    def lock(self, path: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def touched(self, path: str):
+        if self._rollup is not None:
+            self._rollup.put(path)
+
+    def _run_rollup(self, store_path: str):
+        # SQLite connections stay on the thread that opened them
+        store = AnalyticsStore(store_path)
+        while True:
+            paths = {self._rollup.get()}
+            time.sleep(1.0)  # let a burst of batches land, then roll them up together
+            while not self._rollup.empty():
+                paths.add(self._rollup.get_nowait())
+            store.ingest(sorted(paths))
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    server: IngestServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _segment(self) -> Optional[str]:
+        match = PATH.match(self.path.split("?")[0])
+        path = self.server.segment_path(*match.groups()) if match else None
+        if path is None or not path.endswith(SEGMENT_SUFFIX):
+            self._reply(404, {"error": "expected /v1/segments/<device>/<segment>.wlog"})
+            return None
+        return path
+
+    def _read_body(self, length: int) -> Optional[bytes]:
+        """Read the body, paced to the simulated link; None if the link 'drops'."""
+        server = self.server
+        self.lose_reply = False
+        if not server.throttle:
+            return self.rfile.read(length)
+        cut = -1
+        if random.random() < server.drop:
+            if random.random() < 0.5:
+                cut = int(length * random.random())
+            else:
+                self.lose_reply = True
+        chunks, done = [], 0
+        start = time.perf_counter()
+        while done < length:
+            chunk = self.rfile.read(min(4096, length - done))
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            done += len(chunk)
+            if 0 <= cut < done:
+                return None
+            delay = done / server.throttle - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        return b"".join(chunks)
+
+    def do_GET(self):
+        path = self._segment()
+        if path:
+            self._reply(200, {"size": os.path.getsize(path) if os.path.exists(path) else 0})
+
+    def do_POST(self):
+        path = self._segment()
+        if not path:
+            return
+        query = dict(p.split("=", 1) for p in self.path.partition("?")[2].split("&") if "=" in p)
+        length = int(self.headers.get("Content-Length", 0))
+        if "offset" not in query or not 0 < length <= MAX_BODY:
+            self._reply(400, {"error": "offset and a body of at most 16 MiB are required"})
+            return
+        offset = int(query["offset"])
+        body = self._read_body(length)
+        if body is None:
+            self.close_connection = True
+            return
+        try:
+            if self.headers.get("Content-Encoding") == "deflate":
+                decompressor = zlib.decompressobj()
+                body = decompressor.decompress(body, MAX_BODY)
+                if decompressor.unconsumed_tail:
+                    raise zlib.error("decompressed body too large")
+        except zlib.error as e:
+            self._reply(400, {"error": str(e)})
+            return
+        if hashlib.sha256(body).hexdigest() != self.headers.get("X-Content-SHA256", ""):
+            self._reply(400, {"error": "content hash mismatch"})
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.server.lock(path):
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset > size:
+                self._reply(409, {"size": size})
+                return
+            overlap = min(size - offset, len(body))
+            if overlap:
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    if f.read(overlap) != body[:overlap]:
+                        self._reply(409, {"size": size, "error": "resent bytes differ from the stored copy"})
+                        return
+                self.server.duplicate += overlap
+            if overlap < len(body):
+                with open(path, "ab") as f:
+                    f.write(body[overlap:])
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.server.written += len(body) - overlap
+                size += len(body) - overlap
+            self.server.received += length
+        self.server.touched(path)
+        if self.lose_reply:
+            self.close_connection = True
+            return
+        self._reply(200, {"size": size})
+
+
+def benchmark(records: int = 20_000, num_classes: int = 3, throttle_kbps: float = 256.0, drop: float = 0.1,
+              batch_kb: int = 64):
+    """Upload a synthetic log through a throttled, lossy localhost server and verify the copy."""
+    import numpy as np
+
+    directory = tempfile.mkdtemp(prefix="ingest_")
+    log_dir = os.path.join(directory, "device")
+    recorder = DetectionRecorder(log_dir, num_classes=num_classes, max_bytes=4 * 1024 * 1024, queue_size=records + 1)
+    rng = np.random.default_rng(0)
+    lat = 38.5382 + np.cumsum(rng.normal(0, 1e-6, records))
+    for i in range(records):
+        probabilities = rng.dirichlet(np.ones(num_classes)).astype(np.float32)
+        recorder.record(1.75e9 + i / 10, lat[i], -121.7617, int(probabilities.argmax()), float(probabilities.max()),
+                        probabilities)
+    recorder.close()
+    log_bytes = sum(os.path.getsize(p) for p in expand_paths([log_dir]))
+
+    server = IngestServer(("127.0.0.1", 0), os.path.join(directory, "server"), throttle_kbps=throttle_kbps, drop=drop)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    uploader = Uploader(log_dir, f"http://127.0.0.1:{server.server_port}", "pi-01", batch_kb * 1024, timeout=5.0)
+    start = time.perf_counter()
+    while True:
+        try:
+            uploader.sync()
+            break
+        except OSError:
+            uploader.retries += 1
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    for path in expand_paths([log_dir]):
+        with open(path, "rb") as a, open(server.segment_path("pi-01", os.path.basename(path)), "rb") as b:
+            assert a.read() == b.read(), f"{path} differs on the server"
+    print(f"{records} records, {log_bytes / 1e6:.1f} MB of log in {len(expand_paths([log_dir]))} segments, "
+          f"link {throttle_kbps:.0f} kbit/s, {drop:.0%} of requests dropped")
+    print(f"uploaded in {elapsed:.1f} s: {log_bytes / elapsed / 1e3:.1f} kB/s of log, "
+          f"{uploader.sent_bytes * 8 / elapsed / 1e3:.0f} kbit/s on the wire, "
+          f"compression {log_bytes / uploader.sent_bytes:.2f}x")
+    print(f"{uploader.batches} batches acknowledged, {uploader.retries} retries, "
+          f"{server.duplicate} resent bytes deduplicated; copies verified")
+    shutil.rmtree(directory)
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Accept uploads")
+    serve.add_argument("root", help="Directory to store segments in, one subdirectory per device")
+    serve.add_argument("--host", type=str, default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8750)
+    serve.add_argument("--store", type=str, help="analytics_store database to roll uploads up into")
+    serve.add_argument("--throttle", type=float, default=0.0, help="Simulated link speed in kbit/s")
+    serve.add_argument("--drop", type=float, default=0.0, help="Fraction of requests to cut off (needs --throttle)")
+    bench = sub.add_parser("benchmark", help="Upload a synthetic log through a throttled localhost server")
+    bench.add_argument("-n", type=int, default=20_000, help="Records")
+    bench.add_argument("--throttle", type=float, default=256.0, help="Link speed in kbit/s")
+    bench.add_argument("--drop", type=float, default=0.1, help="Fraction of requests cut off mid-body")
+    bench.add_argument("--batch-kb", type=int, default=64)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.command == "benchmark":
+        benchmark(args.n, throttle_kbps=args.throttle, drop=args.drop, batch_kb=args.batch_kb)
+    else:
+        server = IngestServer((args.host, args.port), args.root, args.store, args.throttle, args.drop)
+        print(f"Accepting uploads on {args.host}:{args.port} into {args.root}")
+        server.serve_forever()
@@ -0,0 +1,321 @@
+"""
+Grid-hash spatial index over the accumulated detections of every drive.
+
+Points are projected to local metres (geo.LocalProjection) and bucketed into square
+cells. The records are kept sorted by cell key (row-major, row = north index), so
+all the points of one row of cells within an east range form one contiguous slice
+found with np.searchsorted. A bbox query is therefore one searchsorted per cell row
+plus an exact vectorized filter of the candidates; radius, polygon and row
+(distance to a polyline) queries start from their bounding box.
+
+Inserts go to a small unsorted pending buffer that every query also scans; once it
+grows past a fraction of the sorted part it is merged in. The index is saved as
+one .npz with the per-segment record counts already added, so `update` only reads
+the new records of each drive, as in density_grid.py.
+
+    python spatial_index.py update field_index.npz ../imx500/survey_log
+    python spatial_index.py query field_index.npz --radius 38.5383,-121.7616,5
+    python spatial_index.py benchmark -n 10000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from common import expand_paths, load_or_create, new_records
+from detection_log import DEFAULT_LABELS
+from geo import LocalProjection
+
+INDEX_DTYPE = np.dtype([
+    ("x", "<f8"),           # metres east of the origin
+    ("y", "<f8"),           # metres north of the origin
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("timestamp", "<f8"),
+    ("score", "<f4"),
+    ("class_idx", "<u2"),
+    ("id", "<i8"),          # insertion order, stable across merges
+])
+_OFFSET = 1 << 31  # cell indices are shifted to non-negative before packing into a key
+
+
+def _keys(ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+    return ((iy + _OFFSET) << 32) | (ix + _OFFSET)
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, stop) for every pair, without a Python loop."""
+    lengths = stops - starts
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    return np.arange(lengths.sum()) + offsets
+
+
+def points_in_polygon(x: np.ndarray, y: np.ndarray, poly_x: np.ndarray, poly_y: np.ndarray) -> np.ndarray:
+    """Even-odd rule, vectorized over the points (one pass per polygon edge)."""
+    inside = np.zeros(len(x), dtype=bool)
+    x0, y0 = poly_x, poly_y
+    x1, y1 = np.roll(poly_x, -1), np.roll(poly_y, -1)
+    for ax, ay, bx, by in zip(x0, y0, x1, y1):
+        crosses = (ay > y) != (by > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            at_x = ax + (y - ay) * (bx - ax) / (by - ay)
+        inside ^= crosses & (x < at_x)
+    return inside
+
+
+def distance_to_polyline(x: np.ndarray, y: np.ndarray, line_x: np.ndarray, line_y: np.ndarray) -> np.ndarray:
+    """Distance of every point to the nearest segment of the polyline."""
+    best = np.full(len(x), np.inf)
+    for ax, ay, bx, by in zip(line_x[:-1], line_y[:-1], line_x[1:], line_y[1:]):
+        dx, dy = bx - ax, by - ay
+        t = np.clip(((x - ax) * dx + (y - ay) * dy) / max(dx * dx + dy * dy, 1e-12), 0.0, 1.0)
+        np.minimum(best, np.hypot(x - (ax + t * dx), y - (ay + t * dy)), out=best)
+    return best
+
+
+class SpatialIndex:
+    def __init__(self, origin_lat: float, origin_lon: float, cell_size: float = 5.0,
+                 labels: Sequence[str] = DEFAULT_LABELS, merge_fraction: float = 0.05, min_merge: int = 4096):
+        """Cells of cell_size metres; pending inserts are merged beyond merge_fraction of the sorted records."""
+        self.projection = LocalProjection(origin_lat, origin_lon)
+        self.cell_size = float(cell_size)
+        self.labels = list(labels)
+        self.merge_fraction = merge_fraction
+        self.min_merge = min_merge
+        self.records = np.zeros(0, dtype=INDEX_DTYPE)   # sorted by cell key
+        self.keys = np.zeros(0, dtype=np.int64)
+        self._pending = []
+        self._pending_count = 0
+        self.next_id = 0
+        self.ingested: Dict[str, int] = {}  # segment key -> records already added
+
+    def __len__(self):
+        return len(self.records) + self._pending_count
+
+    def _cell(self, x: np.ndarray, y: np.ndarray):
+        return np.floor(x / self.cell_size).astype(np.int64), np.floor(y / self.cell_size).astype(np.int64)
+
+    def _make(self, lat, lon, class_idx, score, timestamp) -> np.ndarray:
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        placed = ~(np.isnan(lat) | np.isnan(lon))
+        records = np.zeros(int(placed.sum()), dtype=INDEX_DTYPE)
+        records["lat"], records["lon"] = lat[placed], lon[placed]
+        records["x"], records["y"] = self.projection.forward(records["lat"], records["lon"])
+        for name, values in (("class_idx", class_idx), ("score", score), ("timestamp", timestamp)):
+            if values is not None:
+                records[name] = np.broadcast_to(values, placed.shape)[placed]
+        records["id"] = np.arange(self.next_id, self.next_id + len(records))
+        self.next_id += len(records)
+        return records
+
+    def bulk_load(self, lat, lon, class_idx=0, score=0.0, timestamp=0.0):
+        """Add many records at once, sorting them straight into the index."""
+        self._merge(self._make(lat, lon, class_idx, score, timestamp))
+
+    def insert(self, lat, lon, class_idx=0, score=0.0, timestamp=0.0):
+        """Add records to the pending buffer, merging it in once it is large enough."""
+        records = self._make(lat, lon, class_idx, score, timestamp)
+        self._pending.append(records)
+        self._pending_count += len(records)
+        if self._pending_count > max(self.min_merge, self.merge_fraction * len(self.records)):
+            self._merge()
+
+    def _merge(self, extra: Optional[np.ndarray] = None):
+        parts = [self.records] + self._pending + ([extra] if extra is not None else [])
+        self._pending, self._pending_count = [], 0
+        records = np.concatenate(parts)
+        keys = _keys(*self._cell(records["x"], records["y"]))
+        order = np.argsort(keys, kind="stable")
+        self.records, self.keys = records[order], keys[order]
+
+    @property
+    def pending(self) -> np.ndarray:
+        if len(self._pending) > 1:
+            self._pending = [np.concatenate(self._pending)]
+        return self._pending[0] if self._pending else np.zeros(0, dtype=INDEX_DTYPE)
+
+    def _candidates(self, x_min: float, y_min: float, x_max: float, y_max: float) -> np.ndarray:
+        """Records in the cells overlapping the box (sorted part and pending), exact box filter applied."""
+        ix0, iy0 = self._cell(np.array([x_min]), np.array([y_min]))
+        ix1, iy1 = self._cell(np.array([x_max]), np.array([y_max]))
+        rows = np.arange(iy0[0], iy1[0] + 1)
+        starts = np.searchsorted(self.keys, _keys(np.full(len(rows), ix0[0]), rows), side="left")
+        stops = np.searchsorted(self.keys, _keys(np.full(len(rows), ix1[0]), rows), side="right")
+        parts = [self.records[_ranges(starts, stops)], self.pending]
+        candidates = np.concatenate(parts) if len(parts[1]) else parts[0]
+        x, y = candidates["x"], candidates["y"]
+        return candidates[(x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)]
+
+    @staticmethod
+    def _filter_classes(records: np.ndarray, classes: Optional[Sequence[int]]) -> np.ndarray:
+        return records if classes is None else records[np.isin(records["class_idx"], classes)]
+
+    def bbox(self, south: float, west: float, north: float, east: float,
+             classes: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Records inside the lat/lon box."""
+        (x0, x1), (y0, y1) = self.projection.forward([south, north], [west, east])
+        return self._filter_classes(self._candidates(x0, y0, x1, y1), classes)
+
+    def radius(self, lat: float, lon: float, radius_m: float, classes: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Records within radius_m metres of (lat, lon)."""
+        cx, cy = self.projection.forward(lat, lon)
+        found = self._candidates(cx - radius_m, cy - radius_m, cx + radius_m, cy + radius_m)
+        found = found[np.hypot(found["x"] - cx, found["y"] - cy) <= radius_m]
+        return self._filter_classes(found, classes)
+
+    def polygon(self, coords: Sequence[Sequence[float]], classes: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Records inside a polygon given as [(lat, lon), ...] (closing vertex optional)."""
+        coords = np.asarray(coords, dtype=np.float64)
+        px, py = self.projection.forward(coords[:, 0], coords[:, 1])
+        found = self._candidates(px.min(), py.min(), px.max(), py.max())
+        found = found[points_in_polygon(found["x"], found["y"], px, py)]
+        return self._filter_classes(found, classes)
+
+    def near_line(self, coords: Sequence[Sequence[float]], half_width_m: float,
+                  classes: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Records within half_width_m of a polyline [(lat, lon), ...], e.g. a tree row."""
+        coords = np.asarray(coords, dtype=np.float64)
+        lx, ly = self.projection.forward(coords[:, 0], coords[:, 1])
+        found = self._candidates(lx.min() - half_width_m, ly.min() - half_width_m,
+                                 lx.max() + half_width_m, ly.max() + half_width_m)
+        found = found[distance_to_polyline(found["x"], found["y"], lx, ly) <= half_width_m]
+        return self._filter_classes(found, classes)
+
+    def add_records(self, records: np.ndarray):
+        """Detection-log records; large batches are sorted in directly, small ones go to pending."""
+        columns = (records["lat"], records["lon"], records["class_idx"], records["score"], records["timestamp"])
+        if len(records) > max(self.min_merge, self.merge_fraction * len(self.records)):
+            self.bulk_load(*columns)
+        else:
+            self.insert(*columns)
+
+    def update_from_logs(self, paths: Sequence[str]) -> int:
+        """Add the records not yet indexed from each segment (new segments and appended tails)."""
+        added = 0
+        for key, _, start, records in new_records(paths, self.ingested):
+            before = len(self)
+            self.add_records(records)
+            added += len(self) - before
+            self.ingested[key] = start + len(records)
+        return added
+
+    def save(self, path: str):
+        self._merge()
+        meta = {**self.projection.to_dict(), "cell_size": self.cell_size, "labels": self.labels,
+                "next_id": self.next_id, "ingested": self.ingested}
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, records=self.records, meta=json.dumps(meta))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "SpatialIndex":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            records = data["records"]
+        index = cls(meta["origin_lat"], meta["origin_lon"], meta["cell_size"], meta["labels"], **kwargs)
+        index.records = records
+        index.keys = _keys(*index._cell(records["x"], records["y"]))
+        index.next_id, index.ingested = meta["next_id"], meta["ingested"]
+        return index
+
+
+def benchmark(n: int = 1_000_000, queries: int = 200, cell_size: float = 5.0):
+    """Compare index queries against a full scan on n points spread over a 1 x 1 km block."""
+    rng = np.random.default_rng(0)
+    lat0, lon0 = 38.5382, -121.7617
+    lat = lat0 + rng.uniform(0, 1000, n) / 111_320.0
+    lon = lon0 + rng.uniform(0, 1000, n) / 87_000.0
+    index = SpatialIndex(lat0, lon0, cell_size)
+    start = time.perf_counter()
+    index.bulk_load(lat, lon, rng.integers(0, 3, n), rng.uniform(0.5, 1.0, n))
+    print(f"bulk load {n} points: {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    for _ in range(100):
+        index.insert(lat0 + rng.uniform(0, 1000, 100) / 111_320.0, lon0 + rng.uniform(0, 1000, 100) / 87_000.0)
+    print(f"100 inserts of 100 points: {(time.perf_counter() - start) * 10:.2f} ms each")
+
+    x, y = index.projection.forward(lat, lon)
+    centres = rng.uniform(50, 950, (queries, 2))
+    cases = {
+        "radius 10 m": (lambda cx, cy: index.radius(*index.projection.inverse(cx, cy), 10.0),
+                        lambda cx, cy: np.flatnonzero(np.hypot(x - cx, y - cy) <= 10.0)),
+        "bbox 50x50 m": (lambda cx, cy: index.bbox(*index.projection.inverse(cx - 25, cy - 25),
+                                                  *index.projection.inverse(cx + 25, cy + 25)),
+                         lambda cx, cy: np.flatnonzero((np.abs(x - cx) <= 25) & (np.abs(y - cy) <= 25))),
+        "polygon 40 m": (lambda cx, cy: index.polygon(np.column_stack(index.projection.inverse(
+                             cx + 20 * np.cos(np.arange(8) * np.pi / 4), cy + 20 * np.sin(np.arange(8) * np.pi / 4)))),
+                         lambda cx, cy: np.flatnonzero(points_in_polygon(
+                             x, y, cx + 20 * np.cos(np.arange(8) * np.pi / 4), cy + 20 * np.sin(np.arange(8) * np.pi / 4)))),
+    }
+    for name, (indexed, scan) in cases.items():
+        start = time.perf_counter()
+        found = sum(len(indexed(cx, cy)) for cx, cy in centres)
+        indexed_ms = (time.perf_counter() - start) / queries * 1000
+        start = time.perf_counter()
+        for cx, cy in centres[:20]:
+            scan(cx, cy)
+        scan_ms = (time.perf_counter() - start) / 20 * 1000
+        print(f"{name:>13}: index {indexed_ms:.3f} ms, full scan {scan_ms:.1f} ms "
+              f"({scan_ms / indexed_ms:.0f}x), {found / queries:.0f} points per query")
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    update = sub.add_parser("update", help="Index new log records (index created if missing)")
+    update.add_argument("index", help="Index .npz")
+    update.add_argument("paths", nargs="+", help="Segment files or log directories")
+    update.add_argument("--cell-size", type=float, default=5.0, help="Cell size in metres (new indexes only)")
+    update.add_argument("--origin", type=str, help="lat,lon of the origin (new indexes; default: first record)")
+    query = sub.add_parser("query", help="Print matching records")
+    query.add_argument("index", help="Index .npz")
+    query.add_argument("--bbox", type=str, help="south,west,north,east")
+    query.add_argument("--radius", type=str, help="lat,lon,metres")
+    query.add_argument("--polygon", type=str, help="GeoJSON file with a Polygon (first feature)")
+    query.add_argument("--classes", type=str, help="Comma separated labels to keep")
+    bench = sub.add_parser("benchmark", help="Index vs full scan on synthetic points")
+    bench.add_argument("-n", type=int, default=1_000_000)
+    bench.add_argument("--cell-size", type=float, default=5.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.command == "benchmark":
+        benchmark(args.n, cell_size=args.cell_size)
+    elif args.command == "update":
+        segments = expand_paths(args.paths)
+        index = load_or_create(args.index, segments, args.origin, SpatialIndex.load,
+                               lambda lat, lon, labels: SpatialIndex(lat, lon, args.cell_size, labels))
+        start = time.perf_counter()
+        added = index.update_from_logs(segments)
+        index.save(args.index)
+        print(f"Indexed {added} records in {time.perf_counter() - start:.2f} s, {len(index)} in total")
+    else:
+        index = SpatialIndex.load(args.index)
+        classes = [index.labels.index(c) for c in args.classes.split(",")] if args.classes else None
+        start = time.perf_counter()
+        if args.bbox:
+            found = index.bbox(*[float(v) for v in args.bbox.split(",")], classes=classes)
+        elif args.radius:
+            found = index.radius(*[float(v) for v in args.radius.split(",")], classes=classes)
+        elif args.polygon:
+            with open(args.polygon) as f:
+                geometry = json.load(f)
+            geometry = geometry["features"][0]["geometry"] if "features" in geometry else geometry
+            found = index.polygon([(lat, lon) for lon, lat in geometry["coordinates"][0]], classes=classes)
+        else:
+            sys.exit("Give --bbox, --radius or --polygon")
+        elapsed = (time.perf_counter() - start) * 1000
+        counts = np.bincount(found["class_idx"], minlength=len(index.labels))
+        print(f"{len(found)} records in {elapsed:.2f} ms:",
+              ", ".join(f"{label} {count}" for label, count in zip(index.labels, counts)))
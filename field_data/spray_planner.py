@@ -0,0 +1,398 @@
+"""
+Spray plan for a block: which stretches of each row to spray, in what order, and
+how much herbicide that takes compared with spraying everything.
+
+1. Records are binned into a density_grid.DensityGrid (or a saved grid is loaded).
+2. Every row (GeoJSON LineStrings, or parallel rows generated over the grid) is
+   sampled every `step` metres. A sample is a weed hit if any grid cell under the
+   boom there has a weed density above the threshold (and enough records to trust).
+3. Hits are merged into spray intervals along the row: each hit covers its step,
+   intervals are padded by `margin`, and gaps the nozzles could not close and
+   reopen in time (speed x (on + off latency)) are bridged.
+4. The intervals are ordered with nearest neighbour and then 2-opt over each end's
+   nearest neighbours, within a time budget. Each segment can be driven in either
+   direction, and a 2-opt move reverses the segments it flips. Travel between segments is straight-line distance, which ignores
+   headland turns but ranks orders the same way for parallel rows.
+5. Once the driving direction of each segment is known, the valve commands are
+   moved ahead of the spray: on by speed x on_latency before the patch, off by
+   speed x off_latency before its end, so the nozzles are open exactly over it.
+   start_m/end_m (and their xy) are where the commands fire; spray_start_m and
+   spray_end_m are where herbicide lands.
+
+    python spray_planner.py field.npz --row-spacing 3 --row-bearing 0 -o plan.json --geojson plan.geojson
+    python spray_planner.py ../imx500/survey_log --rows rows.geojson --threshold 0.3
+"""
+import argparse
+import json
+import math
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from common import expand_paths, origin_and_labels, weed_classes
+from density_grid import DensityGrid
+
+LITRES_PER_HA_PER_GAL_PER_ACRE = 9.354
+
+
+def parallel_rows(grid: DensityGrid, spacing: float, bearing_deg: float = 0.0) -> List[np.ndarray]:
+    """Rows `spacing` metres apart at the given bearing (degrees from north) covering the grid, in metres."""
+    ny, nx = grid.shape
+    x0, y0 = grid.ix0 * grid.cell_size, grid.iy0 * grid.cell_size
+    x1, y1 = x0 + nx * grid.cell_size, y0 + ny * grid.cell_size
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    half = math.hypot(x1 - x0, y1 - y0) / 2
+    along = np.array([math.sin(math.radians(bearing_deg)), math.cos(math.radians(bearing_deg))])
+    across = np.array([along[1], -along[0]])
+    rows = []
+    for offset in np.arange(-half, half + spacing, spacing):
+        centre = np.array([cx, cy]) + offset * across
+        line = np.array([centre - half * along, centre + half * along])
+        # clip to the grid's box so rows don't run far past the surveyed area
+        t = np.linspace(0, 1, 2 * int(half / grid.cell_size) + 2)
+        points = line[0] + t[:, None] * (line[1] - line[0])
+        inside = (points[:, 0] >= x0) & (points[:, 0] <= x1) & (points[:, 1] >= y0) & (points[:, 1] <= y1)
+        if inside.sum() >= 2:
+            rows.append(points[inside][[0, -1]])
+    return rows
+
+
+def load_rows(path: str, grid: DensityGrid) -> List[np.ndarray]:
+    """LineStrings of a GeoJSON file, projected to the grid's metres."""
+    with open(path) as f:
+        data = json.load(f)
+    features = data["features"] if "features" in data else [data]
+    rows = []
+    for feature in features:
+        geometry = feature.get("geometry", feature)
+        lines = [geometry["coordinates"]] if geometry["type"] == "LineString" else geometry["coordinates"]
+        for coords in lines:
+            coords = np.asarray(coords, dtype=np.float64)
+            rows.append(np.column_stack(grid.projection.forward(coords[:, 1], coords[:, 0])))
+    return rows
+
+
+def sample_row(row: np.ndarray, step: float):
+    """Samples every `step` metres along a polyline: (distances, points (K, 2), unit normals (K, 2), length)."""
+    seg = np.diff(row, axis=0)
+    seg_len = np.hypot(seg[:, 0], seg[:, 1])
+    cumulative = np.r_[0.0, np.cumsum(seg_len)]
+    s = np.arange(step / 2, cumulative[-1], step)
+    i = np.clip(np.searchsorted(cumulative, s, side="right") - 1, 0, len(seg) - 1)
+    t = (s - cumulative[i]) / np.maximum(seg_len[i], 1e-9)
+    points = row[i] + t[:, None] * seg[i]
+    direction = seg[i] / np.maximum(seg_len[i], 1e-9)[:, None]
+    return s, points, np.column_stack([-direction[:, 1], direction[:, 0]]), cumulative[-1]
+
+
+def merge_intervals(starts: np.ndarray, ends: np.ndarray, min_gap: float, margin: float,
+                    length: float) -> np.ndarray:
+    """Sorted intervals padded by margin, with gaps shorter than min_gap closed; (K, 2) clipped to the row."""
+    if not len(starts):
+        return np.zeros((0, 2))
+    starts, ends = np.maximum(starts - margin, 0.0), np.minimum(ends + margin, length)
+    new = np.r_[True, starts[1:] - ends[:-1] >= min_gap]
+    groups = np.cumsum(new) - 1
+    merged = np.zeros((groups[-1] + 1, 2))
+    merged[:, 0] = starts[new]
+    merged[:, 1] = np.maximum.reduceat(ends, np.flatnonzero(new))
+    return merged
+
+
+def spray_segments(grid: DensityGrid, rows: Sequence[np.ndarray], threshold: float = 0.2, min_count: int = 3,
+                   boom_width: float = 2.0, step: float = 0.5, margin: float = 0.5, speed: float = 2.0,
+                   on_latency: float = 0.3, off_latency: float = 0.2,
+                   classes: Optional[Sequence[int]] = None) -> List[dict]:
+    """Spray intervals of every row where the weed density under the boom passes threshold."""
+    density = grid.density(classes)
+    density = np.where(grid.counts.sum(axis=0) >= min_count, density, 0.0)
+    density = np.nan_to_num(density)
+    ny, nx = density.shape
+    lateral = np.linspace(-boom_width / 2, boom_width / 2, max(2, int(math.ceil(boom_width / grid.cell_size)) + 1))
+    min_gap = speed * (on_latency + off_latency)
+    segments = []
+    for row_id, row in enumerate(rows):
+        s, points, normals, length = sample_row(row, step)
+        if not len(s):
+            continue
+        # every sample looks at the cells under the whole boom width
+        x = points[:, 0, None] + lateral[None, :] * normals[:, 0, None]
+        y = points[:, 1, None] + lateral[None, :] * normals[:, 1, None]
+        ix = np.floor(x / grid.cell_size).astype(np.int64) - grid.ix0
+        iy = np.floor(y / grid.cell_size).astype(np.int64) - grid.iy0
+        valid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        values = np.where(valid, density[np.clip(iy, 0, ny - 1), np.clip(ix, 0, nx - 1)], 0.0)
+        hit = values.max(axis=1) >= threshold
+        intervals = merge_intervals(s[hit] - step / 2, s[hit] + step / 2, min_gap, margin, length)
+        xy = _points_at(row, intervals.ravel()).reshape(-1, 2, 2)
+        for (start, end), (start_xy, end_xy) in zip(intervals, xy):
+            segments.append({"row": row_id, "start_m": float(start), "end_m": float(end),
+                             "start_xy": start_xy, "end_xy": end_xy})
+    return segments
+
+
+def _points_at(row: np.ndarray, distance: np.ndarray) -> np.ndarray:
+    """(x, y) at distances along a polyline."""
+    cumulative = np.r_[0.0, np.cumsum(np.hypot(*np.diff(row, axis=0).T))]
+    return np.column_stack([np.interp(distance, cumulative, row[:, 0]), np.interp(distance, cumulative, row[:, 1])])
+
+
+def route_length(order: np.ndarray, flipped: np.ndarray, ends: np.ndarray) -> float:
+    """Travel between segments (sprayed lengths excluded) for an order and orientations."""
+    a = ends[order, (~flipped).astype(int)]  # exit point of each segment
+    b = ends[order, flipped.astype(int)]     # entry point
+    return float(np.hypot(*(b[1:] - a[:-1]).T).sum())
+
+
+def _nearest_ends(ends: np.ndarray, k: int) -> np.ndarray:
+    """The k nearest ends of other segments to every segment end, nearest first.
+
+    Ends are numbered segment * 2 + side. They are bucketed into square cells holding
+    about k of them, and each end only looks at its own and the 8 surrounding cells
+    (ends with fewer than k ends of other segments there look at all of them).
+    """
+    points = ends.reshape(-1, 2)
+    m = len(points)
+    k = min(k, m - 2)
+    extent = np.maximum(points.max(axis=0) - points.min(axis=0), 1e-3)
+    cell = max(math.sqrt(extent[0] * extent[1] * k / m), 1e-3)
+    ij = np.floor((points - points.min(axis=0)) / cell).astype(np.int64)
+    keys = ij[:, 0] * (int(ij[:, 1].max()) + 3) + ij[:, 1] + 1  # +1, +3: neighbours of edge cells stay unique
+    by_key = np.argsort(keys, kind="stable")
+    cells, first, counts = np.unique(keys[by_key], return_index=True, return_counts=True)
+    members = {key: by_key[i:i + c] for key, i, c in zip(cells.tolist(), first.tolist(), counts.tolist())}
+    stride = int(ij[:, 1].max()) + 3
+    around = [dx * stride + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+    near = np.zeros((m, k), dtype=np.int64)
+    short = []
+    for key, ids in members.items():
+        candidates = np.concatenate([members[key + o] for o in around if key + o in members])
+        if len(candidates) < k + 2:
+            short.append(ids)
+            continue
+        d = np.hypot(points[ids, None, 0] - points[None, candidates, 0], points[ids, None, 1] - points[None, candidates, 1])
+        d[(candidates[None, :] >> 1) == (ids[:, None] >> 1)] = np.inf  # the end itself and its segment's other end
+        best = np.argpartition(d, k - 1, axis=1)[:, :k]
+        best = np.take_along_axis(best, np.argsort(np.take_along_axis(d, best, 1), axis=1), 1)
+        near[ids] = candidates[best]
+    for ids in short:
+        d = np.hypot(points[ids, None, 0] - points[None, :, 0], points[ids, None, 1] - points[None, :, 1])
+        d[(np.arange(m)[None, :] >> 1) == (ids[:, None] >> 1)] = np.inf
+        best = np.argpartition(d, k - 1, axis=1)[:, :k]
+        near[ids] = np.take_along_axis(best, np.argsort(np.take_along_axis(d, best, 1), axis=1), 1)
+    return near
+
+
+def plan_route(ends: np.ndarray, start: Optional[np.ndarray] = None, max_passes: int = 20, neighbours: int = 12,
+               time_budget: float = 10.0):
+    """Order and orient segments; ends is (N, 2, 2) = (segment, start/end, xy).
+
+    Nearest neighbour from `start` (default: the first segment's start), then 2-opt
+    until no move shortens the route, max_passes passes are done or time_budget
+    seconds have passed. Only moves that join an end to one of its `neighbours`
+    nearest segment ends are tried, which keeps a pass linear in N instead of
+    quadratic (a long link is almost never part of a better route). Returns
+    (order, flipped).
+    """
+    deadline = time.perf_counter() + time_budget
+    n = len(ends)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    # plain Python lists from here: the moves are scalar work, NumPy indexing would dominate
+    near = _nearest_ends(ends, neighbours).tolist() if n >= 3 else None
+    xy = ends.reshape(-1, 2).tolist()
+    points = ends.reshape(-1, 2)
+    unvisited = [True] * n
+    left = np.ones(2 * n, dtype=bool)  # ends of unvisited segments, for when no candidate is left
+    position = ends[0, 0] if start is None else np.asarray(start, dtype=np.float64)
+    current = None
+    order, flipped = [], []
+    for _ in range(n):
+        # the nearest end of an unvisited segment: the first such candidate, else a full search
+        q = None
+        if near is not None and current is not None:
+            q = next((q for q in near[current] if unvisited[q >> 1]), None)
+        if q is None:
+            d = np.hypot(points[:, 0] - position[0], points[:, 1] - position[1])
+            d[~left] = np.inf
+            q = int(np.argmin(d))
+        seg, side = q >> 1, q & 1
+        order.append(seg)
+        flipped.append(side == 1)
+        unvisited[seg] = False
+        left[2 * seg:2 * seg + 2] = False
+        current = 2 * seg + 1 - side
+        position = xy[current]
+    if n < 3:
+        return np.array(order, dtype=np.int64), np.array(flipped, dtype=bool)
+    pos = [0] * n
+    for k, seg in enumerate(order):
+        pos[seg] = k
+
+    def exit_of(k):
+        return 2 * order[k] + (not flipped[k])
+
+    def entry_of(k):
+        return 2 * order[k] + flipped[k]
+
+    def dist(a, b):
+        return math.hypot(xy[a][0] - xy[b][0], xy[a][1] - xy[b][1])
+
+    def reverse(a, b):
+        """Reverse order[a..b] if that shortens the route: exit(a-1)->exit(b), entry(a)->entry(b+1)."""
+        before = dist(exit_of(a - 1), entry_of(a))
+        after = dist(exit_of(a - 1), exit_of(b))
+        if b < n - 1:
+            before += dist(exit_of(b), entry_of(b + 1))
+            after += dist(entry_of(a), entry_of(b + 1))
+        if before - after <= 1e-6:
+            return False
+        order[a:b + 1] = order[a:b + 1][::-1]
+        flipped[a:b + 1] = [not f for f in flipped[a:b + 1][::-1]]
+        for k in range(a, b + 1):
+            pos[order[k]] = k
+        return True
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n):
+            # link the exit of i to a nearby exit further on, reversing what lies between
+            for q in near[exit_of(i)]:
+                b = pos[q >> 1]
+                if b > i and q == exit_of(b) and reverse(i + 1, b):
+                    improved = True
+                    break
+            # or the entry of i to a nearby entry earlier on
+            for q in near[entry_of(i)]:
+                a = pos[q >> 1]
+                if 0 < a < i and q == entry_of(a) and reverse(a, i - 1):
+                    improved = True
+                    break
+        if not improved or time.perf_counter() > deadline:
+            break
+    return np.array(order, dtype=np.int64), np.array(flipped, dtype=bool)
+
+
+def valve_points(start_m: float, end_m: float, reversed_: bool, length: float, speed: float,
+                 on_latency: float, off_latency: float):
+    """Where along the row to command the valve on and off (as start_m, end_m) so the spray covers
+    [start_m, end_m] when driven in the given direction; clipped to the row."""
+    on_lead, off_lead = speed * on_latency, speed * off_latency
+    if reversed_:  # driven from end_m towards start_m, so "earlier" is further along the row
+        return min(start_m + off_lead, length), min(end_m + on_lead, length)
+    return max(start_m - on_lead, 0.0), max(end_m - off_lead, 0.0)
+
+
+def plan(grid: DensityGrid, rows: Sequence[np.ndarray], rate_l_per_ha: float = 187.0, boom_width: float = 2.0,
+         speed: float = 2.0, on_latency: float = 0.3, off_latency: float = 0.2, **kwargs) -> dict:
+    """Segments in driving order with valve command points, the travel distance and herbicide estimate."""
+    start = time.perf_counter()
+    segments = spray_segments(grid, rows, boom_width=boom_width, speed=speed, on_latency=on_latency,
+                              off_latency=off_latency, **kwargs)
+    ends = np.array([[s["start_xy"], s["end_xy"]] for s in segments]).reshape(-1, 2, 2)
+    naive = route_length(np.arange(len(segments)), np.zeros(len(segments), dtype=bool), ends) if segments else 0.0
+    order, flipped = plan_route(ends)
+    travel = route_length(order, flipped, ends) if segments else 0.0
+
+    lengths = [float(np.hypot(*np.diff(row, axis=0).T).sum()) for row in rows]
+    row_length = sum(lengths)
+    sprayed = sum(s["end_m"] - s["start_m"] for s in segments)
+    litres = sprayed * boom_width / 10_000 * rate_l_per_ha
+    blanket = row_length * boom_width / 10_000 * rate_l_per_ha
+    ordered = []
+    for k, (i, flip) in enumerate(zip(order, flipped)):
+        s = dict(segments[i])
+        s["order"], s["reversed"] = k, bool(flip)
+        s["spray_start_m"], s["spray_end_m"] = s["start_m"], s["end_m"]
+        s["start_m"], s["end_m"] = valve_points(s["start_m"], s["end_m"], bool(flip), lengths[s["row"]], speed,
+                                                on_latency, off_latency)
+        s["start_xy"], s["end_xy"] = _points_at(rows[s["row"]], np.array([s["start_m"], s["end_m"]]))
+        ordered.append(s)
+    return {
+        "segments": ordered,
+        "rows": len(rows),
+        "row_length_m": row_length,
+        "sprayed_length_m": sprayed,
+        "travel_m": travel,
+        "travel_in_row_order_m": naive,
+        "herbicide_l": litres,
+        "blanket_l": blanket,
+        "saving_percent": 100 * (1 - litres / blanket) if blanket else 0.0,
+        "rate_l_per_ha": rate_l_per_ha,
+        "rate_gal_per_acre": rate_l_per_ha / LITRES_PER_HA_PER_GAL_PER_ACRE,
+        "elapsed_s": time.perf_counter() - start,
+    }
+
+
+def to_geojson(result: dict, grid: DensityGrid) -> dict:
+    """Spray segments as LineStrings (with their order) plus the route as one LineString."""
+    def lonlat(xy):
+        lat, lon = grid.projection.inverse(xy[0], xy[1])
+        return [round(float(lon), 7), round(float(lat), 7)]
+
+    features, route = [], []
+    for s in result["segments"]:
+        a, b = (s["end_xy"], s["start_xy"]) if s["reversed"] else (s["start_xy"], s["end_xy"])
+        route += [lonlat(a), lonlat(b)]
+        features.append({"type": "Feature", "geometry": {"type": "LineString", "coordinates": [lonlat(a), lonlat(b)]},
+                         "properties": {"order": s["order"], "row": s["row"],
+                                        "length_m": round(s["spray_end_m"] - s["spray_start_m"], 2)}})
+    if route:
+        features.append({"type": "Feature", "geometry": {"type": "LineString", "coordinates": route},
+                         "properties": {"route": True, "travel_m": round(result["travel_m"], 1)}})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Grid .npz from density_grid.py, or log segments / directory")
+    parser.add_argument("more", nargs="*", help="More log segments or directories")
+    parser.add_argument("--cell-size", type=float, default=1.0, help="Grid cell size when binning logs (m)")
+    parser.add_argument("--origin", type=str, help="lat,lon of the grid origin when binning logs (default: first fix)")
+    parser.add_argument("--rows", type=str, help="GeoJSON with the row centre lines")
+    parser.add_argument("--row-spacing", type=float, default=3.0, help="Generated row spacing without --rows (m)")
+    parser.add_argument("--row-bearing", type=float, default=0.0, help="Generated row bearing, degrees from north")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Weed density that triggers spraying")
+    parser.add_argument("--min-count", type=int, default=3, help="Records a cell needs before it can trigger")
+    parser.add_argument("--weed-classes", type=str, help="Comma separated labels counted as weeds (default: not Soil)")
+    parser.add_argument("--boom-width", type=float, default=2.0, help="Sprayed width (m)")
+    parser.add_argument("--step", type=float, default=0.5, help="Sampling step along rows (m)")
+    parser.add_argument("--margin", type=float, default=0.5, help="Extra spray before and after each patch (m)")
+    parser.add_argument("--speed", type=float, default=2.0, help="Spraying speed (m/s)")
+    parser.add_argument("--on-latency", type=float, default=0.3, help="Nozzle opening delay (s)")
+    parser.add_argument("--off-latency", type=float, default=0.2, help="Nozzle closing delay (s)")
+    parser.add_argument("--rate", type=float, default=187.0, help="Application rate (L/ha)")
+    parser.add_argument("-o", "--output", type=str, help="Write the plan as JSON")
+    parser.add_argument("--geojson", type=str, help="Write segments and route as GeoJSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.source.endswith(".npz"):
+        grid = DensityGrid.load(args.source)
+    else:
+        segments = expand_paths([args.source] + args.more)
+        origin_lat, origin_lon, labels = origin_and_labels(segments, args.origin)
+        grid = DensityGrid(origin_lat, origin_lon, args.cell_size, labels)
+        grid.update_from_logs(segments)
+    rows = load_rows(args.rows, grid) if args.rows else parallel_rows(grid, args.row_spacing, args.row_bearing)
+    classes = weed_classes(grid.labels, args.weed_classes.split(",") if args.weed_classes else None)
+    result = plan(grid, rows, rate_l_per_ha=args.rate, boom_width=args.boom_width, threshold=args.threshold,
+                  min_count=args.min_count, step=args.step, margin=args.margin, speed=args.speed,
+                  on_latency=args.on_latency, off_latency=args.off_latency, classes=classes)
+    print(f"{len(result['segments'])} spray segments on {result['rows']} rows "
+          f"({result['sprayed_length_m']:.0f} of {result['row_length_m']:.0f} m), "
+          f"travel {result['travel_m']:.0f} m (row order {result['travel_in_row_order_m']:.0f} m), "
+          f"{result['herbicide_l']:.1f} L vs {result['blanket_l']:.1f} L blanket "
+          f"({result['saving_percent']:.0f}% saved), planned in {result['elapsed_s']:.2f} s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({**result, "segments": [{k: (v.tolist() if isinstance(v, np.ndarray) else v)
+                                               for k, v in s.items()} for s in result["segments"]]}, f, indent=2)
+    if args.geojson:
+        with open(args.geojson, "w") as f:
+            json.dump(to_geojson(result, grid), f)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from density_grid import DensityGrid
+from fusion import FusionStore
+
+LABELS = ["Broadleaf", "Grass", "Soil"]
+
+
+def field_with_glitches(projection):
+    """Ten fixes on a 10 m strip, then a 0,0 fix and one 800 km away."""
+    lat, lon = projection.inverse(np.arange(10.0), np.zeros(10))
+    lat = np.append(lat, [0.0, projection.origin_lat + 7.0])
+    lon = np.append(lon, [0.0, projection.origin_lon])
+    return lat, lon, np.zeros(len(lat), dtype=np.int64), np.full(len(lat), 0.9)
+
+
+def test_grid_skips_implausible_fixes():
+    grid = DensityGrid(38.5, -121.7, cell_size=1.0, labels=LABELS)
+    assert grid.add(*field_with_glitches(grid.projection)) == 10
+    assert grid.shape == (1, 10)
+    assert grid.counts.sum() == 10
+
+
+def test_fusion_skips_implausible_fixes():
+    store = FusionStore(38.5, -121.7, cell_size=1.0, labels=LABELS, gps_sigma=0.0)
+    assert store.add(*field_with_glitches(store.projection)) == 10
+    assert store.shape == (1, 10)
+
+
+def test_max_extent_is_configurable_and_saved(tmp_path):
+    grid = DensityGrid(38.5, -121.7, labels=LABELS, max_extent=5.5)
+    assert grid.add(*field_with_glitches(grid.projection)) == 6
+    grid.save(str(tmp_path / "grid.npz"))
+    assert DensityGrid.load(str(tmp_path / "grid.npz")).max_extent == 5.5
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from density_grid import DensityGrid
+from spray_planner import plan, valve_points
+
+
+def test_valve_points_lead_the_patch_in_the_driving_direction():
+    # 2 m/s: on 0.3 s -> 0.6 m early, off 0.2 s -> 0.4 m early
+    assert valve_points(10.0, 20.0, False, 100.0, 2.0, 0.3, 0.2) == pytest.approx((9.4, 19.6))
+    assert valve_points(10.0, 20.0, True, 100.0, 2.0, 0.3, 0.2) == pytest.approx((10.4, 20.6))
+    assert valve_points(0.2, 99.9, False, 100.0, 2.0, 0.3, 0.2)[0] == 0.0
+    assert valve_points(0.2, 99.9, True, 100.0, 2.0, 0.3, 0.2)[1] == 100.0
+
+
+def test_plan_shifts_the_valve_commands_ahead_of_the_spray():
+    grid = DensityGrid(38.5, -121.7, cell_size=1.0, labels=["Broadleaf", "Grass", "Soil"])
+    # one weedy patch, 20-30 m north along a single row, soil elsewhere
+    north = np.repeat(np.arange(0.5, 50, 1.0), 5)
+    lat, lon = grid.projection.inverse(np.zeros_like(north), north)
+    grid.add(lat, lon, np.where((north > 20) & (north < 30), 0, 2))
+    row = np.array([[0.0, 0.0], [0.0, 50.0]])
+    speed, on, off = 3.0, 0.4, 0.1
+    result = plan(grid, [row], speed=speed, on_latency=on, off_latency=off, margin=0.0, min_count=1,
+                  classes=[0, 1])
+    (segment,) = result["segments"]
+    assert not segment["reversed"]
+    assert segment["spray_start_m"] == pytest.approx(20.0, abs=0.5)
+    assert segment["start_m"] == pytest.approx(segment["spray_start_m"] - speed * on)
+    assert segment["end_m"] == pytest.approx(segment["spray_end_m"] - speed * off)
+    assert segment["start_xy"][1] == pytest.approx(segment["start_m"])
+    assert result["sprayed_length_m"] == pytest.approx(segment["spray_end_m"] - segment["spray_start_m"])
@@ -0,0 +1,237 @@
+"""
+Audit-frame sampling: keep the few camera frames worth labelling.
+
+Saving every frame fills the SD card in minutes and most frames repeat what the model
+already gets right. AuditSampler scores each new inference and keeps a frame when
+
+    weight_margin * (1 - (p1 - p2)) + weight_rarity * (1 - share of its top-1 class)
+
+reaches threshold, i.e. when the model is torn between two classes or predicts a class
+it has rarely seen this run (shares are decayed counts, so they follow the field). A
+kept frame also needs its own spacing cell (min_spacing metres, one frame per cell and
+class) or, without a fix, min_interval seconds since the last one, and a token from a
+max_per_minute budget.
+
+AuditWriter copies nothing on the callback thread beyond the frame itself: the array
+goes on a queue bounded in bytes (max_queue_mb, so a full-resolution frame cannot pile
+up tens of MB) and a worker thread encodes it as JPEG or WebP (dropped, and counted,
+if it does not fit) until the directory reaches max_mb. The pipeline's
+AuditStage flags the frame FLAG_AUDIT, so its own log record (always written, with the
+probability vector) marks it, and the image is named by that record's timestamp
+(<timestamp>.jpg, as survey.py does).
+
+The export command turns the audit records into WeedDataset's class folders, sorted
+by predicted class, with a manifest.csv (most uncertain first) for review:
+
+    python audit_sampler.py export survey_log survey_audit ../model_development/data/audit
+"""
+import argparse
+import csv
+import math
+import os
+import queue
+import shutil
+import threading
+import time
+import cv2
+import numpy as np
+
+from detection_log import FLAG_AUDIT, list_segments, read_header, read_log
+from gps_track import EARTH_RADIUS_M
+
+# WeedDataset's folder for each model label
+DATASET_FOLDERS = {"Broadleaf": "Broadleafs", "Grass": "Grasses", "Soil": "Soil"}
+
+
+def top2_margin(probabilities: np.ndarray) -> float:
+    """p1 - p2 of a probability vector (1.0 for a single class)."""
+    if len(probabilities) < 2:
+        return 1.0
+    p2, p1 = np.partition(probabilities, len(probabilities) - 2)[-2:]
+    return float(p1 - p2)
+
+
+class AuditSampler:
+    def __init__(self, threshold: float = 0.6, weight_margin: float = 0.7, weight_rarity: float = 0.3,
+                 min_spacing: float = 5.0, min_interval: float = 2.0, max_per_minute: float = 6.0,
+                 half_life: float = 2000.0):
+        """Score frames by top-2 margin and class rarity; see the module docstring.
+
+        half_life is in inferences: class shares forget older frames at that rate.
+        """
+        self.threshold = threshold
+        self.weight_margin = weight_margin
+        self.weight_rarity = weight_rarity
+        self.min_spacing = min_spacing
+        self.min_interval = min_interval
+        self.max_per_minute = max_per_minute
+        self._decay = 0.5 ** (1.0 / half_life)
+        self.class_counts = None  # decayed top-1 counts, uniform prior; sized on the first frame
+        self._cells = set()
+        self._origin = None
+        self._last_time = -math.inf
+        self._tokens = max_per_minute
+        self._token_time = None
+        self.selected = 0
+
+    def score(self, probabilities: np.ndarray) -> float:
+        """Selection score of one probability vector (also counts its top-1 class)."""
+        class_idx = int(np.argmax(probabilities))
+        if self.class_counts is None:
+            self.class_counts = np.ones(len(probabilities))
+        self.class_counts *= self._decay
+        self.class_counts[class_idx] += 1.0
+        share = self.class_counts[class_idx] / self.class_counts.sum()
+        return self.weight_margin * (1.0 - top2_margin(probabilities)) + self.weight_rarity * (1.0 - share)
+
+    def _cell(self, lat: float, lon: float, class_idx: int) -> tuple:
+        if self._origin is None:
+            self._origin = (lat, lon)
+        north = math.radians(lat - self._origin[0]) * EARTH_RADIUS_M
+        east = math.radians(lon - self._origin[1]) * EARTH_RADIUS_M * math.cos(math.radians(self._origin[0]))
+        return math.floor(east / self.min_spacing), math.floor(north / self.min_spacing), class_idx
+
+    def select(self, probabilities: np.ndarray, lat: float, lon: float, now: float) -> bool:
+        """Whether to keep this frame; now is a monotonic time in seconds."""
+        score = self.score(probabilities)
+        if self._token_time is not None:
+            self._tokens = min(self.max_per_minute, self._tokens + (now - self._token_time) * self.max_per_minute / 60)
+        self._token_time = now
+        if score < self.threshold or self._tokens < 1.0:
+            return False
+        if math.isnan(lat):
+            if now - self._last_time < self.min_interval:
+                return False
+        else:
+            cell = self._cell(lat, lon, int(np.argmax(probabilities)))
+            if cell in self._cells:
+                return False
+            self._cells.add(cell)
+        self._last_time = now
+        self._tokens -= 1.0
+        self.selected += 1
+        return True
+
+
+class AuditWriter:
+    def __init__(self, out_dir: str, fmt: str = "jpg", quality: int = 90, max_queue_mb: float = 32.0,
+                 max_mb: float = 2000.0, rgb: bool = True):
+        """Encode queued frames on a worker thread into out_dir, up to max_mb in total.
+
+        At most max_queue_mb of raw frames wait for the encoder; one larger frame is still
+        taken when the queue is empty.
+
+        rgb: frames are RGB(X) in memory (the XBGR8888 preview stream), not OpenCV's BGR.
+        """
+        if fmt not in ("jpg", "webp"):
+            raise ValueError(f"Unsupported audit image format {fmt!r}, use jpg or webp")
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.fmt = fmt
+        quality_flag = cv2.IMWRITE_JPEG_QUALITY if fmt == "jpg" else cv2.IMWRITE_WEBP_QUALITY
+        self._params = [quality_flag, quality]
+        self.max_bytes = max_mb * 1e6
+        self.rgb = rgb
+        self.bytes = sum(entry.stat().st_size for entry in os.scandir(out_dir) if entry.is_file())
+        self.max_queue_bytes = max_queue_mb * 1e6
+        self.queued_bytes = 0
+        self._lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.dropped = 0
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="audit-writer")
+        self._thread.start()
+
+    def name(self, timestamp: float) -> str:
+        return f"{timestamp:.3f}.{self.fmt}"
+
+    @property
+    def full(self) -> bool:
+        return self.bytes >= self.max_bytes
+
+    def has_room(self, nbytes: int) -> bool:
+        """Whether a frame of nbytes would be queued; check before copying one."""
+        return not self.full and (self.queued_bytes == 0 or self.queued_bytes + nbytes <= self.max_queue_bytes)
+
+    def submit(self, image: np.ndarray, timestamp: float) -> bool:
+        """Queue a frame (the caller passes a copy); never blocks. Returns False if it was dropped."""
+        if self.full:
+            return False
+        with self._lock:
+            if not self.has_room(image.nbytes):
+                self.dropped += 1
+                return False
+            self.queued_bytes += image.nbytes
+        self.queue.put_nowait((image, timestamp))
+        return True
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            image, timestamp = item
+            with self._lock:
+                self.queued_bytes -= image.nbytes
+            if image.ndim == 3 and image.shape[2] == 4:
+                image = cv2.cvtColor(image, cv2.COLOR_RGBA2BGR if self.rgb else cv2.COLOR_BGRA2BGR)
+            elif self.rgb and image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            ok, data = cv2.imencode("." + self.fmt, image, self._params)
+            if not ok:
+                continue
+            path = os.path.join(self.out_dir, self.name(timestamp))
+            with open(path + ".tmp", "wb") as f:
+                f.write(data.tobytes())
+            os.replace(path + ".tmp", path)
+            self.bytes += len(data)
+            self.written += 1
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+
+def export_dataset(log_dir: str, audit_dir: str, dataset_dir: str) -> int:
+    """Copy audited frames into dataset_dir/<WeedDataset class folder>/ with a manifest.csv for review."""
+    rows = []
+    for path in list_segments(log_dir):
+        labels = read_header(path)["labels"]
+        records = read_log(path)
+        for record in records[(records["flags"] & FLAG_AUDIT) != 0]:
+            image = next((f"{record['timestamp']:.3f}.{ext}" for ext in ("jpg", "webp")
+                          if os.path.exists(os.path.join(audit_dir, f"{record['timestamp']:.3f}.{ext}"))), None)
+            if image is None:  # dropped by the writer or over the size budget
+                continue
+            label = labels[record["class_idx"]] if record["class_idx"] < len(labels) else str(record["class_idx"])
+            folder = DATASET_FOLDERS.get(label, label)
+            os.makedirs(os.path.join(dataset_dir, folder), exist_ok=True)
+            shutil.copy2(os.path.join(audit_dir, image), os.path.join(dataset_dir, folder, image))
+            probabilities = record["probabilities"] if "probabilities" in records.dtype.names else np.zeros(0)
+            rows.append([os.path.join(folder, image), label, f"{top2_margin(probabilities):.4f}",
+                         f"{record['lat']:.7f}", f"{record['lon']:.7f}",
+                         " ".join(f"{p:.4f}" for p in probabilities)])
+    rows.sort(key=lambda row: float(row[2]))
+    with open(os.path.join(dataset_dir, "manifest.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "predicted", "margin", "lat", "lon", "probabilities"])
+        writer.writerows(rows)
+    return len(rows)
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Copy audit frames into WeedDataset class folders")
+    export.add_argument("log_dir", help="Detection log with the audit records")
+    export.add_argument("audit_dir", help="Directory the audit frames were written to")
+    export.add_argument("dataset_dir", help="Dataset root (Broadleafs/, Grasses/, Soil/ are created in it)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    start = time.perf_counter()
+    count = export_dataset(args.log_dir, args.audit_dir, args.dataset_dir)
+    print(f"Exported {count} audit frames to {args.dataset_dir} in {time.perf_counter() - start:.1f} s")
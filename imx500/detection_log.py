@@ -0,0 +1,296 @@
+"""
+Append-only binary log of geotagged classifications.
+
+Each segment file is a header (512 bytes, more for long label lists) followed by
+fixed-width little-endian records (see record_dtype), so a log can be memory-mapped
+as a NumPy structured array and read without parsing. Records start with a marker byte
+and end with a commit byte: after a power cut the reader drops a torn record (whose
+head reached the disk but not its tail) or a zero-filled tail instead of returning
+garbage.
+
+DetectionRecorder keeps all file I/O on its own thread. The camera callback only
+puts a tuple on a bounded queue. Records are written in batches, fsynced every few
+seconds and rotated into a new segment once a segment reaches max_bytes.
+
+Export for the dashboard:
+    python detection_log.py export logs/ --format geojson -o detections.geojson
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+MAGIC = b"WTLOG\x00\x00\x01"
+VERSION = 2  # 2 added the commit byte; version 1 segments are still read
+HEADER_SIZE = 512
+RECORD_MARKER = 0xA5
+RECORD_COMMIT = 0x5A
+SEGMENT_SUFFIX = ".wlog"
+DEFAULT_LABELS = ["Broadleaf", "Grass", "Soil"]
+
+FLAG_NO_FIX = 0x01  # lat/lon are NaN, the frame could not be placed
+FLAG_CLASS_CHANGE = 0x02  # smoothed class changed on this frame
+FLAG_DISTANCE = 0x04  # logged because the distance threshold passed, class unchanged
+FLAG_AUDIT = 0x08  # an audit image was saved for this frame (audit_sampler.py), named by the timestamp;
+# probabilities are then the frame's own unsmoothed output
+
+
+def record_dtype(num_classes: int = 0, version: int = VERSION) -> np.dtype:
+    """Fixed-width record layout; probabilities are stored only if num_classes > 0."""
+    fields = [
+        ("marker", "u1"),
+        ("flags", "u1"),
+        ("class_idx", "<u2"),
+        ("score", "<f4"),
+        ("sequence", "<u4"),
+        ("timestamp", "<f8"),  # unix seconds
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+    ]
+    if num_classes:
+        fields.append(("probabilities", "<f4", (num_classes,)))
+    if version >= 2:
+        fields.append(("commit", "u1"))  # written last, so a record is whole only if it is set
+    return np.dtype(fields)
+
+
+def _write_header(fd: int, num_classes: int, labels: Sequence[str]) -> int:
+    labels_json = json.dumps(list(labels)).encode()
+    # 512 bytes, or whole multiples of it for long label lists (e.g. ImageNet)
+    header_size = -(-(28 + len(labels_json)) // HEADER_SIZE) * HEADER_SIZE
+    header = struct.pack("<8sIIII", MAGIC, VERSION, num_classes, record_dtype(num_classes).itemsize, header_size)
+    header += struct.pack("<I", len(labels_json)) + labels_json
+    os.write(fd, header.ljust(header_size, b"\x00"))
+    return header_size
+
+
+def read_header(path: str) -> dict:
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+        magic, version, num_classes, record_size, header_size = struct.unpack_from("<8sIIII", header)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a detection log")
+        header += f.read(header_size - HEADER_SIZE)
+    (labels_len,) = struct.unpack_from("<I", header, 24)
+    labels = json.loads(header[28:28 + labels_len]) if labels_len else []
+    return {"version": version, "num_classes": num_classes, "record_size": record_size,
+            "header_size": header_size, "labels": labels}
+
+
+def read_log(path: str) -> np.ndarray:
+    """Memory-map one segment, returning only complete records with a valid marker and commit byte."""
+    header = read_header(path)
+    dtype = record_dtype(header["num_classes"], header["version"])
+    count = (os.path.getsize(path) - header["header_size"]) // dtype.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=record_dtype(header["num_classes"]))
+    records = np.memmap(path, dtype=dtype, mode="r", offset=header["header_size"], shape=(count,))
+    if header["version"] < 2:
+        return _upgrade(records[records["marker"] == RECORD_MARKER], header["num_classes"])
+    valid = (records["marker"] == RECORD_MARKER) & (records["commit"] == RECORD_COMMIT)
+    if valid.all():
+        return records
+    # zero-filled blocks after a power cut show up at the tail
+    return records[valid]
+
+
+def _upgrade(records: np.ndarray, num_classes: int) -> np.ndarray:
+    """Copy version 1 records into the current layout, so segments of both versions concatenate."""
+    upgraded = np.zeros(len(records), dtype=record_dtype(num_classes))
+    for name in records.dtype.names:
+        upgraded[name] = records[name]
+    upgraded["commit"] = RECORD_COMMIT
+    return upgraded
+
+
+def list_segments(log_dir: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(log_dir, f"*{SEGMENT_SUFFIX}")))
+
+
+def read_logs(paths: Sequence[str]) -> np.ndarray:
+    """Concatenate segments (they must share the record layout)."""
+    arrays = [read_log(p) for p in paths]
+    return np.concatenate(arrays) if arrays else np.zeros(0, dtype=record_dtype())
+
+
+class DetectionRecorder:
+    def __init__(self, log_dir: str, num_classes: int = 0, labels: Optional[Sequence[str]] = None,
+                 max_bytes: int = 64 * 1024 * 1024, fsync_interval: float = 5.0, queue_size: int = 1024,
+                 batch_size: int = 256):
+        """Write records on a background thread into rotating segments in log_dir."""
+        os.makedirs(log_dir, exist_ok=True)
+        self.log_dir = log_dir
+        self.num_classes = num_classes
+        self.labels = list(labels or DEFAULT_LABELS)
+        self.dtype = record_dtype(num_classes)
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.written = 0
+        self.sequence = 0
+        self.segment_path = None
+        self._fd = None
+        self._segment = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="detection-recorder")
+        self._thread.start()
+
+    def record(self, timestamp: float, lat: float, lon: float, class_idx: int, score: float,
+               probabilities: Optional[np.ndarray] = None, flags: int = 0) -> bool:
+        """Queue one record; never blocks. Returns False if the queue was full."""
+        self.sequence += 1
+        try:
+            self.queue.put_nowait((self.sequence, timestamp, lat, lon, class_idx, score, probabilities, flags))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _open_segment(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+        self._segment += 1
+        name = f"detections_{datetime.now():%Y%m%d_%H%M%S}_{self._segment:04d}{SEGMENT_SUFFIX}"
+        self.segment_path = os.path.join(self.log_dir, name)
+        self._fd = os.open(self.segment_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = _write_header(self._fd, self.num_classes, self.labels)
+        os.fsync(self._fd)
+        # make the new directory entry durable too
+        dir_fd = os.open(self.log_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _run(self):
+        self._open_segment()
+        batch = np.zeros(self.batch_size, dtype=self.dtype)
+        batch["marker"] = RECORD_MARKER
+        batch["commit"] = RECORD_COMMIT
+        last_sync = time.monotonic()
+        done = False
+        while not done:
+            try:
+                items = [self.queue.get(timeout=self.fsync_interval)]
+            except queue.Empty:
+                items = []
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if any(item is None for item in items):
+                done = True
+                items = [item for item in items if item is not None]
+
+            if items:
+                n = len(items)
+                seq, ts, lat, lon, cls, score, probs, flags = zip(*items)
+                rows = batch[:n]
+                rows["sequence"] = seq
+                rows["timestamp"] = ts
+                rows["lat"] = np.array(lat, dtype=np.float64)  # None -> NaN
+                rows["lon"] = np.array(lon, dtype=np.float64)
+                rows["class_idx"] = cls
+                rows["score"] = score
+                rows["flags"] = np.array(flags, dtype=np.uint8) | np.where(np.isnan(rows["lat"]), FLAG_NO_FIX, 0)
+                if self.num_classes:
+                    rows["probabilities"] = [np.zeros(self.num_classes) if p is None else p for p in probs]
+                data = rows.tobytes()
+                os.write(self._fd, data)
+                self._size += len(data)
+                self.written += n
+
+            now = time.monotonic()
+            if done or now - last_sync >= self.fsync_interval:
+                os.fsync(self._fd)
+                last_sync = now
+            if self._size >= self.max_bytes and not done:
+                self._open_segment()
+
+        os.close(self._fd)
+
+
+def export_csv(records: np.ndarray, labels: Sequence[str], path: str):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        prob_cols = [f"p_{l}" for l in labels] if "probabilities" in records.dtype.names else []
+        writer.writerow(["sequence", "timestamp", "lat", "lon", "class_idx", "label", "score"] + prob_cols)
+        for r in records:
+            row = [int(r["sequence"]), f"{r['timestamp']:.3f}", f"{r['lat']:.7f}", f"{r['lon']:.7f}",
+                   int(r["class_idx"]), _label(labels, r["class_idx"]), f"{r['score']:.4f}"]
+            if prob_cols:
+                row += [f"{p:.4f}" for p in r["probabilities"]]
+            writer.writerow(row)
+
+
+def export_geojson(records: np.ndarray, labels: Sequence[str], path: str):
+    """Point features for the dashboard heatmap; records without a GPS fix are skipped."""
+    placed = records[~np.isnan(records["lat"])]
+    features = [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [round(float(r["lon"]), 7), round(float(r["lat"]), 7)]},
+        "properties": {"timestamp": float(r["timestamp"]), "class": _label(labels, r["class_idx"]),
+                       "score": round(float(r["score"]), 4)},
+    } for r in placed]
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def export_parquet(records: np.ndarray, labels: Sequence[str], path: str):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow. Install with: pip install pyarrow")
+    columns = {name: np.ascontiguousarray(records[name]) for name in records.dtype.names
+               if name not in ("marker", "commit", "probabilities")}
+    columns["label"] = np.asarray(labels, dtype=object)[records["class_idx"]] if len(labels) else None
+    if "probabilities" in records.dtype.names:
+        for i, label in enumerate(labels):
+            columns[f"p_{label}"] = np.ascontiguousarray(records["probabilities"][:, i])
+    pq.write_table(pa.table({k: v for k, v in columns.items() if v is not None}), path)
+
+
+def _label(labels, idx) -> str:
+    return labels[int(idx)] if int(idx) < len(labels) else str(int(idx))
+
+
+EXPORTERS = {"csv": export_csv, "geojson": export_geojson, "parquet": export_parquet}
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Export log segments for the dashboard")
+    export.add_argument("paths", nargs="+", help="Segment files or log directories")
+    export.add_argument("--format", choices=list(EXPORTERS), default="geojson")
+    export.add_argument("-o", "--output", type=str, required=True)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    paths = []
+    for p in args.paths:
+        paths += list_segments(p) if os.path.isdir(p) else [p]
+    records = read_logs(paths)
+    labels = read_header(paths[0])["labels"] if paths else DEFAULT_LABELS
+    EXPORTERS[args.format](records, labels, args.output)
+    print(f"Exported {len(records)} records from {len(paths)} segment(s) to {args.output}")
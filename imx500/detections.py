@@ -0,0 +1,133 @@
+"""
+Structure-of-arrays detection results with vectorized post-processing and drawing.
+
+Instead of one Python Detection object per box, a frame's detections are kept as
+NumPy arrays (boxes Nx4, scores N, classes N). Thresholding, NMS, coordinate
+scaling to the ISP output and drawing all work on the whole arrays at once.
+"""
+from typing import Optional
+
+import numpy as np
+
+from overlay import OverlayRenderer
+
+
+class Detections:
+    def __init__(self, boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray):
+        """Create a Detections object from boxes (N, 4), scores (N,) and classes (N,)."""
+        self.boxes = boxes
+        self.scores = scores
+        self.classes = classes
+
+    @classmethod
+    def empty(cls) -> "Detections":
+        return cls(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def select(self, index) -> "Detections":
+        """Keep the detections picked by a boolean mask or index array."""
+        return Detections(self.boxes[index], self.scores[index], self.classes[index])
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float, max_detections: Optional[int] = None,
+        classes: Optional[np.ndarray] = None) -> np.ndarray:
+    """Greedy non-maximum suppression on (y0, x0, y1, x1) boxes, returning the kept indices.
+
+    With classes given, boxes of different classes never suppress each other. Each
+    iteration compares the current best box against all remaining boxes at once.
+    """
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    boxes = boxes.astype(np.float32, copy=False)
+    if classes is not None:
+        # shift each class to its own region so cross-class IoU is zero
+        boxes = boxes + (classes.astype(np.float32) * (boxes.max() + 1))[:, None]
+
+    y0, x0, y1, x1 = boxes.T
+    areas = np.maximum(y1 - y0, 0) * np.maximum(x1 - x0, 0)
+    order = np.argsort(-scores, kind="stable")
+    limit = len(order) if max_detections is None else max_detections
+
+    keep = []
+    while order.size and len(keep) < limit:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        inter_h = np.clip(np.minimum(y1[best], y1[rest]) - np.maximum(y0[best], y0[rest]), 0, None)
+        inter_w = np.clip(np.minimum(x1[best], x1[rest]) - np.maximum(x0[best], x0[rest]), 0, None)
+        inter = inter_h * inter_w
+        iou = inter / np.maximum(areas[best] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def decode_ssd(boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray, threshold: float,
+               iou: float = 1.0, max_detections: Optional[int] = None, bbox_normalization: bool = False,
+               bbox_order: str = "yx", input_h: int = 1) -> Detections:
+    """Threshold, reorder and suppress the raw SSD output tensors of one frame.
+
+    Returned boxes are normalised (y0, x0, y1, x1), as expected by convert_inference_coords.
+    """
+    keep = np.flatnonzero(scores > threshold)
+    boxes = np.asarray(boxes, dtype=np.float32)[keep]
+    if bbox_normalization:
+        boxes /= input_h
+    if bbox_order == "xy":
+        boxes = boxes[:, [1, 0, 3, 2]]
+    dets = Detections(boxes, np.asarray(scores, dtype=np.float32)[keep], np.asarray(classes, dtype=np.int32)[keep])
+    if iou < 1.0 or (max_detections is not None and len(dets) > max_detections):
+        dets = dets.select(nms(dets.boxes, dets.scores, iou, max_detections, dets.classes))
+    return dets
+
+
+class CoordinateMapper:
+    def __init__(self, imx500, picam2, stream: str = "main"):
+        """Vectorized replacement for calling imx500.convert_inference_coords once per box.
+
+        The inference -> ISP mapping is an affine map per axis followed by clipping to the
+        output image. It only changes with the ScalerCrop, so it is calibrated once per
+        crop by converting a reference box through imx500.convert_inference_coords.
+        """
+        self.imx500 = imx500
+        self.picam2 = picam2
+        self.stream = stream
+        self.output_w, self.output_h = picam2.camera_configuration()[stream]["size"]
+        self._cache = {}
+
+    def _affine(self, metadata: dict):
+        key = tuple(metadata.get("ScalerCrop", ()))
+        if key not in self._cache:
+            # the reference box sits well inside any centred ROI, so it is never clipped
+            x, y, w, h = self.imx500.convert_inference_coords((0.25, 0.25, 0.75, 0.75), metadata, self.picam2,
+                                                              self.stream)
+            scale = np.array([w / 0.5, h / 0.5], dtype=np.float32)
+            offset = np.array([x, y], dtype=np.float32) - 0.25 * scale
+            self._cache[key] = (scale, offset)
+        return self._cache[key]
+
+    def to_isp(self, boxes: np.ndarray, metadata: dict) -> np.ndarray:
+        """Map normalised (y0, x0, y1, x1) boxes to integer (x, y, w, h) in the ISP output."""
+        if len(boxes) == 0:
+            return np.zeros((0, 4), dtype=np.int32)
+        scale, offset = self._affine(metadata)
+        top_left = np.clip(boxes[:, [1, 0]] * scale + offset, 0, [self.output_w, self.output_h])
+        bottom_right = np.clip(boxes[:, [3, 2]] * scale + offset, 0, [self.output_w, self.output_h])
+        return np.hstack([top_left, bottom_right - top_left]).astype(np.int32)
+
+
+def draw_detections_batch(array: np.ndarray, boxes_xywh: np.ndarray, labels, box_colour=(0, 255, 0),
+                          text_colour=(0, 0, 255), alpha: float = 0.3, renderer: Optional[OverlayRenderer] = None):
+    """Draw all boxes and labels of a frame in one OverlayRenderer pass.
+
+    Label backgrounds are blended on their own small ROIs and all boxes go out in a
+    single cv2.polylines call, so the cost does not include a full-frame copy.
+    """
+    if len(boxes_xywh) == 0:
+        return
+    renderer = renderer or OverlayRenderer(alpha=alpha, text_colour=text_colour)
+    x, y = boxes_xywh[:, 0], boxes_xywh[:, 1]
+    for tx, ty, label in zip(x + 5, y + 15, labels):
+        renderer.add_text(label, tx, ty, colour=text_colour)
+    renderer.add_boxes(boxes_xywh, box_colour)
+    renderer.render(array)
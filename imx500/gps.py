@@ -0,0 +1,317 @@
+"""
+Background GPS reader for the Spresense board.
+
+The camera callback must never wait on the serial port, so a dedicated thread polls
+the Spresense with GET_GPS (or, in stream mode, consumes its continuous NMEA output),
+parses each reply and publishes the newest fix as one immutable GpsFix. Readers just
+take `reader.latest` (a single attribute read, no lock).
+
+FakeSpresense is a pseudo-terminal stand-in that answers GET_GPS like the real board,
+so the reader can be exercised without hardware:
+    python gps.py --simulate
+runs a simulated 30 fps camera callback against the stand-in, once with the old
+blocking poll and once with the background reader, and prints the frame-time jitter.
+"""
+import argparse
+import os
+import pty
+import threading
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from gps_track import GpsTrack, sensor_clock
+
+
+class GpsFix(NamedTuple):
+    lat: float
+    lon: float
+    time: Optional[datetime]  # GPS time reported by the Spresense
+    received: float           # sensor_clock() seconds, same clock as the frames' SensorTimestamp
+    utc: float = float("nan")     # UTC seconds of day (NMEA stream)
+    speed: float = float("nan")   # ground speed m/s (NMEA RMC/VTG)
+    course: float = float("nan")  # degrees true (NMEA RMC/VTG)
+    hdop: float = float("nan")    # horizontal dilution of precision (NMEA GGA)
+
+
+def parse_response(response):
+    """Parse a Spresense 'lat,lon,alt,time' reply into (latitude, longitude, time)."""
+    try:
+        # Decode the response if it's in bytes
+        if isinstance(response, bytes):
+            response = response.decode('utf-8')
+
+        # Remove whitespace and split the response by commas
+        data = response.strip().split(',')
+
+        # Extract latitude, longitude, and time
+        latitude = float(data[0])
+        longitude = float(data[1])
+        timestamp = data[3]  # The timestamp is at the 4th position
+
+        # Convert timestamp to a datetime object for further processing
+        time_received = datetime.fromisoformat(timestamp[:-1])  # Remove 'Z' for ISO conversion
+
+        return latitude, longitude, time_received
+    except (IndexError, ValueError) as e:
+        print("Error parsing response:", e)
+        return None, None, None
+
+
+def poll_once(ser) -> Optional[GpsFix]:
+    """Send GET_GPS and block until the reply line arrives (or the port times out)."""
+    sent = sensor_clock()
+    ser.write(b"GET_GPS")
+    response = ser.readline()
+    received = sensor_clock()
+    if len(response) <= 2:
+        return None
+    lat, lon, gps_time = parse_response(response)
+    if lat is None or lon is None:
+        return None
+    # the reply describes the position somewhere in the round trip, take the midpoint
+    return GpsFix(lat, lon, gps_time, (sent + received) / 2)
+
+
+class GpsReader(threading.Thread):
+    def __init__(self, port: str = '/dev/ttyUSB0', baudrate: int = 115200, interval: float = 3.0,
+                 timeout: float = 2.0, verbose: bool = False, track: Optional[GpsTrack] = None,
+                 mode: str = "poll", telemetry=None):
+        """Read the Spresense on a daemon thread, recording fixes in `track`.
+
+        mode "poll" sends GET_GPS every `interval` seconds; mode "stream" parses the
+        board's continuous NMEA output (5-10 Hz) as it arrives. With a telemetry.Telemetry
+        each poll round trip is recorded as "gps_poll".
+        """
+        super().__init__(daemon=True, name="gps-reader")
+        self.port = port
+        self.mode = mode
+        self.baudrate = baudrate
+        self.interval = interval
+        self.timeout = timeout
+        self.verbose = verbose
+        self.track = track if track is not None else GpsTrack()
+        if mode == "poll":
+            self.track.expect_fixes_every(interval, timeout)
+        self.latest = GpsFix(0.0, 0.0, None, 0.0)  # replaced, never mutated
+        self.fix_count = 0
+        self.error_count = 0
+        self.poll_latency = telemetry.histogram("gps_poll") if telemetry is not None else None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        import serial
+
+        with serial.Serial(self.port, self.baudrate, timeout=self.timeout) as ser:
+            if self.mode == "stream":
+                self._run_stream(ser)
+                return
+            while not self._stop_event.is_set():
+                start = time.monotonic()
+                try:
+                    fix = poll_once(ser)
+                except serial.SerialException as e:
+                    print("GPS serial error:", e)
+                    fix = None
+                if self.poll_latency is not None:
+                    self.poll_latency.record(int((time.monotonic() - start) * 1e9))
+                if fix is None:
+                    self.error_count += 1
+                else:
+                    self._publish(fix)
+                self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def _run_stream(self, ser):
+        import serial
+        from nmea import NmeaStreamParser
+
+        parser = NmeaStreamParser()
+        ser.timeout = 0.1  # wake up regularly to check for stop()
+        while not self._stop_event.is_set():
+            try:
+                data = ser.read(max(1, ser.in_waiting))
+            except serial.SerialException as e:
+                print("GPS serial error:", e)
+                self._stop_event.wait(self.timeout)
+                continue
+            for fix in parser.feed(data):
+                self._publish(fix)
+            self.error_count = parser.checksum_errors
+
+    def _publish(self, fix: GpsFix):
+        self.latest = fix
+        self.track.append(fix.received, fix.lat, fix.lon)
+        self.fix_count += 1
+        if self.verbose and (self.mode == "poll" or self.fix_count % 50 == 0):
+            print(f"Latitude: {fix.lat}, Longitude: {fix.lon}, Time: {fix.time or fix.utc}")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=self.timeout + 1)
+
+
+class FakeSpresense(threading.Thread):
+    def __init__(self, lat: float = 38.5382, lon: float = -121.7617, speed_mps: float = 1.5,
+                 reply_delay: float = 0.2, nmea_rate: float = 0.0):
+        """Pseudo-terminal device answering GET_GPS with a track moving north at speed_mps.
+
+        With nmea_rate > 0 it instead streams GGA + RMC sentences at that rate (Hz).
+        """
+        super().__init__(daemon=True, name="fake-spresense")
+        self.master, slave = pty.openpty()
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self.lat, self.lon = lat, lon
+        self.speed_mps = speed_mps
+        self.reply_delay = reply_delay
+        self.nmea_rate = nmea_rate
+        self._start = time.monotonic()
+        self._running = True
+
+    def reply(self) -> bytes:
+        lat, _ = self.position()
+        stamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return f"{lat:.7f},{self.lon:.7f},12.0,{stamp}\n".encode()
+
+    def position(self):
+        elapsed = time.monotonic() - self._start
+        return self.lat + elapsed * self.speed_mps / 111_320.0, self.lon
+
+    def nmea(self) -> bytes:
+        lat, lon = self.position()
+        now = datetime.now(timezone.utc)
+        hhmmss = now.strftime("%H%M%S.") + f"{now.microsecond // 10000:02d}"
+        lat_field = f"{int(abs(lat)):02d}{abs(lat) % 1 * 60:07.4f},{'N' if lat >= 0 else 'S'}"
+        lon_field = f"{int(abs(lon)):03d}{abs(lon) % 1 * 60:07.4f},{'E' if lon >= 0 else 'W'}"
+        sentences = [
+            f"GPGGA,{hhmmss},{lat_field},{lon_field},1,08,0.9,12.0,M,0.0,M,,",
+            f"GPRMC,{hhmmss},A,{lat_field},{lon_field},{self.speed_mps / 0.514444:.2f},0.0,{now:%d%m%y},,",
+        ]
+        out = b""
+        for body in sentences:
+            checksum = 0
+            for byte in body.encode():
+                checksum ^= byte
+            out += f"${body}*{checksum:02X}\r\n".encode()
+        return out
+
+    def run(self):
+        if self.nmea_rate > 0:
+            while self._running:
+                try:
+                    os.write(self.master, self.nmea())
+                except OSError:
+                    break
+                time.sleep(1 / self.nmea_rate)
+            return
+        buffer = b""
+        while self._running:
+            try:
+                buffer += os.read(self.master, 64)
+            except OSError:
+                break
+            while b"GET_GPS" in buffer:
+                buffer = buffer.split(b"GET_GPS", 1)[1]
+                time.sleep(self.reply_delay)  # the Spresense takes a while to answer
+                os.write(self.master, self.reply())
+
+    def close(self):
+        self._running = False
+        os.close(self.master)
+        os.close(self._slave)
+
+
+def frame_jitter(frame_times_ms: np.ndarray) -> dict:
+    """Summary of callback durations: the spread is what drops frames."""
+    return {
+        "mean_ms": float(frame_times_ms.mean()),
+        "std_ms": float(frame_times_ms.std()),
+        "p99_ms": float(np.percentile(frame_times_ms, 99)),
+        "max_ms": float(frame_times_ms.max()),
+    }
+
+
+def simulate(seconds: float = 10.0, fps: float = 30.0, interval: float = 3.0):
+    """Compare callback jitter of the blocking GET_GPS poll with the background reader."""
+    import serial
+
+    frame_work = 0.005  # stand-in for parse + draw
+    results = {}
+
+    device = FakeSpresense()
+    device.start()
+
+    # Before: the callback polls the port itself every `interval` seconds
+    ser = serial.Serial(device.port, 115200, timeout=2)
+    times, last_poll = [], 0.0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        start = time.monotonic()
+        if start - last_poll > interval:
+            poll_once(ser)
+            last_poll = start
+        time.sleep(frame_work)
+        times.append((time.monotonic() - start) * 1000)
+        time.sleep(max(0.0, 1 / fps - (time.monotonic() - start)))
+    ser.close()
+    results["blocking"] = frame_jitter(np.array(times))
+
+    # After: the callback only reads the latest snapshot
+    reader = GpsReader(device.port, interval=interval)
+    reader.start()
+    times = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        start = time.monotonic()
+        fix = reader.latest
+        time.sleep(frame_work)
+        times.append((time.monotonic() - start) * 1000)
+        time.sleep(max(0.0, 1 / fps - (time.monotonic() - start)))
+    reader.stop()
+    device.close()
+    results["background"] = frame_jitter(np.array(times))
+    results["background"]["fixes"] = reader.fix_count
+
+    # Continuous NMEA output at 10 Hz through the streaming parser
+    device = FakeSpresense(nmea_rate=10)
+    device.start()
+    reader = GpsReader(device.port, mode="stream")
+    reader.start()
+    time.sleep(seconds)
+    reader.stop()
+    device.close()
+    results["stream"] = {"fixes": reader.fix_count, "fixes_per_s": reader.fix_count / seconds,
+                         "checksum_errors": reader.error_count}
+
+    for mode, stats in results.items():
+        print(f"{mode:>10}: " + ", ".join(f"{k} {v:.2f}" if isinstance(v, float) else f"{k} {v}"
+                                          for k, v in stats.items()))
+    return results
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=str, default="/dev/ttyUSB0", help="Serial port of the Spresense")
+    parser.add_argument("--interval", type=float, default=3.0, help="Seconds between GET_GPS polls")
+    parser.add_argument("--simulate", action="store_true",
+                        help="Measure callback jitter against a pseudo-terminal stand-in device")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duration of each simulated run")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.simulate:
+        simulate(args.seconds, interval=args.interval)
+    else:
+        reader = GpsReader(args.port, interval=args.interval, verbose=True)
+        reader.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("Exiting...")
+            reader.stop()
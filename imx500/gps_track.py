@@ -0,0 +1,107 @@
+"""
+Ring buffer of timestamped GPS fixes with interpolated position lookups.
+
+The Spresense only gives a fix every few seconds, and stamping the latest fix on every
+frame puts weeds metres off at mower speed. Fixes are stored with their receive time on
+the same clock as the camera's SensorTimestamp (CLOCK_BOOTTIME), so each frame can be
+placed by interpolating between the fixes around it, or extrapolating along the last
+velocity for frames newer than the last fix. Lookups take whole arrays of timestamps
+for batch post-processing.
+"""
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+EARTH_RADIUS_M = 6_371_000.0
+
+
+def sensor_clock() -> float:
+    """Seconds on the clock used by libcamera's SensorTimestamp."""
+    try:
+        return time.clock_gettime_ns(time.CLOCK_BOOTTIME) / 1e9
+    except AttributeError:  # not Linux
+        return time.monotonic()
+
+
+def sensor_time(metadata: dict) -> float:
+    """Frame timestamp in seconds from request metadata, falling back to now."""
+    ts = metadata.get("SensorTimestamp") if metadata else None
+    return ts / 1e9 if ts else sensor_clock()
+
+
+class GpsTrack:
+    def __init__(self, capacity: int = 512, max_extrapolation: float = 2.0):
+        """Keep the last `capacity` fixes; extrapolate at most max_extrapolation seconds past the last one."""
+        self.capacity = capacity
+        self.max_extrapolation = max_extrapolation
+        self._t = np.zeros(capacity)
+        self._lat = np.zeros(capacity)
+        self._lon = np.zeros(capacity)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def append(self, t: float, lat: float, lon: float):
+        """Add a fix received at sensor-clock time t. Out-of-order fixes are ignored."""
+        with self._lock:
+            if self.count and t <= self._t[(self.count - 1) % self.capacity]:
+                return
+            i = self.count % self.capacity
+            self._t[i], self._lat[i], self._lon[i] = t, lat, lon
+            self.count += 1
+
+    def expect_fixes_every(self, interval: float, slack: float = 1.0):
+        """Extrapolate across the whole gap between fixes polled every `interval` seconds.
+
+        A frame can be up to one poll interval, plus the round trip (slack), newer than
+        the last fix; with a shorter max_extrapolation those frames would get no position.
+        """
+        self.max_extrapolation = max(self.max_extrapolation, interval + slack)
+
+    def snapshot(self):
+        """Copies of (t, lat, lon) in time order."""
+        with self._lock:
+            n = min(self.count, self.capacity)
+            order = (np.arange(n) + self.count - n) % self.capacity
+            return self._t[order], self._lat[order], self._lon[order]
+
+    def position_at(self, times):
+        """Interpolated (lat, lon) at one or many sensor-clock times.
+
+        Times before the first fix, or further than max_extrapolation past the last
+        one, give NaN. Scalars in, scalars out.
+        """
+        scalar = np.ndim(times) == 0
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        t, lat, lon = self.snapshot()
+        out_lat = np.full(times.shape, np.nan)
+        out_lon = np.full(times.shape, np.nan)
+
+        if len(t):
+            inside = (times >= t[0]) & (times <= t[-1])
+            out_lat[inside] = np.interp(times[inside], t, lat)
+            out_lon[inside] = np.interp(times[inside], t, lon)
+
+            dt = times - t[-1]
+            after = (dt > 0) & (dt <= self.max_extrapolation)
+            if len(t) >= 2:
+                span = t[-1] - t[-2]
+                out_lat[after] = lat[-1] + (lat[-1] - lat[-2]) / span * dt[after]
+                out_lon[after] = lon[-1] + (lon[-1] - lon[-2]) / span * dt[after]
+            else:
+                out_lat[after], out_lon[after] = lat[-1], lon[-1]
+
+        if scalar:
+            return float(out_lat[0]), float(out_lon[0])
+        return out_lat, out_lon
+
+    def velocity(self) -> Optional[tuple]:
+        """(speed m/s, heading degrees from north) between the last two fixes."""
+        t, lat, lon = self.snapshot()
+        if len(t) < 2:
+            return None
+        north = np.radians(lat[-1] - lat[-2]) * EARTH_RADIUS_M
+        east = np.radians(lon[-1] - lon[-2]) * EARTH_RADIUS_M * np.cos(np.radians(lat[-1]))
+        dt = t[-1] - t[-2]
+        return float(np.hypot(north, east) / dt), float(np.degrees(np.arctan2(east, north)) % 360)
@@ -11,8 +11,11 @@ from picamera2.devices import IMX500
 from picamera2.devices.imx500 import NetworkIntrinsics
 from picamera2.devices.imx500.postprocess import softmax
 
+from overlay import OverlayRenderer
+
 last_detections = []
 LABELS = None
+renderer = OverlayRenderer()  # caches text metrics between frames
 
 
 class Classification:
@@ -67,32 +70,10 @@ def draw_classification_results(request: CompletedRequest, results: List[Classif
             text_left, text_top = b_x, b_y + 20
         else:
             text_left, text_top = 0, 0
-        # Drawing labels (in the ROI box if it exists)
-        for index, result in enumerate(results):
-            label = get_label(request, idx=result.idx)
-            text = f"{label}: {result.score:.3f}"
-
-            # Calculate text size and position
-            (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-            text_x = text_left + 5
-            text_y = text_top + 15 + index * 20
-
-            # Create a copy of the array to draw the background with opacity
-            overlay = m.array.copy()
-
-            # Draw the background rectangle on the overlay
-            cv2.rectangle(overlay,
-                          (text_x, text_y - text_height),
-                          (text_x + text_width, text_y + baseline),
-                          (255, 255, 255),  # Background color (white)
-                          cv2.FILLED)
-
-            alpha = 0.3
-            cv2.addWeighted(overlay, alpha, m.array, 1 - alpha, 0, m.array)
-
-            # Draw text on top of the background
-            cv2.putText(m.array, text, (text_x, text_y),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+        # Drawing labels (in the ROI box if it exists), blending each background on its own ROI
+        renderer.add_lines([f"{get_label(request, idx=result.idx)}: {result.score:.3f}" for result in results],
+                           text_left, text_top)
+        renderer.render(m.array)
 
 
 def get_args():
@@ -1,187 +1,72 @@
 import argparse
 import sys
 import time
-from typing import List
 
-import cv2
 import numpy as np
 
 from picamera2 import CompletedRequest, MappedArray, Picamera2
 from picamera2.devices import IMX500
 from picamera2.devices.imx500 import NetworkIntrinsics
-from picamera2.devices.imx500.postprocess import softmax
 
-last_detections = []
-LABELS = None
-
-import serial
-from datetime import datetime
-
-
-# Configure the serial connection
-ser = serial.Serial('/dev/ttyUSB0', 115200, timeout=2)
-
-# Ensure the serial port is open
-if ser.is_open:
-    print("Serial port is already open")
-else:
-    ser.open()
-
-# Get current time in seconds since the epoch
-timestamp_seconds_prev = time.time()
-print("Timestamp (seconds):", timestamp_seconds_prev)
-lat = 0
-lon = 0
-timestamp = "2025-05-04T13:01:57Z"
-
-# Function to parse response and extract latitude, longitude, and time
-def parse_response(response):
-    try:
-        # Decode the response if it's in bytes
-        if isinstance(response, bytes):
-            response = response.decode('utf-8')
-        
-        # Remove whitespace and split the response by commas
-        data = response.strip().split(',')
-        
-        # Extract latitude, longitude, and time
-        latitude = float(data[0])
-        longitude = float(data[1])
-        timestamp = data[3]  # The timestamp is at the 4th position
-
-        # Convert timestamp to a datetime object for further processing
-        time_received = datetime.fromisoformat(timestamp[:-1])  # Remove 'Z' for ISO conversion
-        
-        return latitude, longitude, time_received
-    except (IndexError, ValueError) as e:
-        print("Error parsing response:", e)
-        return None, None, None
-
-class Classification:
-    def __init__(self, idx: int, score: float):
-        """Create a Classification object, recording the idx and score."""
-        self.idx = idx
-        self.score = score
-
-
-def get_label(request: CompletedRequest, idx: int) -> str:
-    """Retrieve the label corresponding to the classification index."""
-    global LABELS
-    if LABELS is None:
-        LABELS = intrinsics.labels
-        assert len(LABELS) in [1000, 1001], "Labels file should contain 1000 or 1001 labels."
-        output_tensor_size = imx500.get_output_shapes(request.get_metadata())[0][0]
-        if output_tensor_size == 1000:
-            LABELS = LABELS[1:]  # Ignore the background label if present
-    return LABELS[idx]
+from audit_sampler import AuditSampler, AuditWriter
+from gps import GpsReader, frame_jitter
+from detection_log import DetectionRecorder
+from gps_track import GpsTrack, sensor_time
+from overlay import OverlayRenderer
+from pipeline import build_classification_pipeline
+from rate_control import RateController
+from survey import ThroughputMeter, run_survey
+from telemetry import Telemetry, add_telemetry_arguments
+
+# Set in __main__: background GPS reader (or the serial port itself with --gps-mode blocking)
+gps = None
+ser = None
+track = GpsTrack()  # timestamped fixes, frames are placed by interpolating along the track
+frame_times = np.zeros(300)  # callback durations (ms), printed as jitter once full
+frame_count = 0
+meter = ThroughputMeter("preview")
+controller = None  # RateController with --spacing
+pipeline = None    # parse -> smooth -> geotag -> sample -> audit -> log -> draw, see pipeline.py
+telemetry = None   # stage latency histograms and frame drops, exported with --telemetry-file/--telemetry-udp
 
 
 def parse_and_draw_classification_results(request: CompletedRequest):
     """Analyse and draw the classification results in the output tensor."""
-    results = parse_classification_results(request)
-    draw_classification_results(request, results)
-
-
-def parse_classification_results(request: CompletedRequest) -> List[Classification]:
-    """Parse the output tensor into the classification results above the threshold."""
-    global last_detections
-    np_outputs = imx500.get_outputs(request.get_metadata())
-    if np_outputs is None:
-        return last_detections
-    np_output = np_outputs[0]
-    if intrinsics.softmax:
-        np_output = softmax(np_output)
-
-    #top_indices = np.argpartition(-np_output, 3)[:3]  # Get top 3 indices with the highest scores
-    top_indices = np.argpartition(-np_output, 1)[:1]  # Get the top 1
-    top_indices = top_indices[np.argsort(-np_output[top_indices])]  # Sort the top 3 indices by their scores
-    last_detections = [Classification(index, np_output[index]) for index in top_indices]
-    return last_detections
-
-
-def draw_classification_results(request: CompletedRequest, results: List[Classification], stream: str = "main"):
-    global timestamp_seconds_prev,lat,lon,timestamp
-    """Draw the classification results for this request onto the ISP output."""
-    with MappedArray(request, stream) as m:
-        font_scale = 0.5 #0.5
-        font_thickness = 1
-        if intrinsics.preserve_aspect_ratio:
-            # Drawing ROI box
-            b_x, b_y, b_w, b_h = imx500.get_roi_scaled(request)
-            color = (255, 0, 0)  # red
-            cv2.putText(m.array, "ROI", (b_x + 5, b_y + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
-            cv2.rectangle(m.array, (b_x, b_y), (b_x + b_w, b_y + b_h), (255, 0, 0, 0))
-            text_left, text_top = b_x, b_y + 20
-        else:
-            text_left, text_top = 0, 0
-        # Drawing labels (in the ROI box if it exists)
-        for index, result in enumerate(results):
-            label = get_label(request, idx=result.idx)
-            text = f"{label}: {result.score:.3f}"
-
-            # Calculate text size and position
-            (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
-            text_x = text_left + 5
-            text_y = text_top + 15 + index * 20
-
-            # Create a copy of the array to draw the background with opacity
-            overlay = m.array.copy()
-
-            # Draw the background rectangle on the overlay
-            cv2.rectangle(overlay,
-                          (text_x, text_y - text_height),
-                          (text_x + text_width, text_y + baseline),
-                          (255, 255, 255),  # Background color (white)
-                          cv2.FILLED)
-
-            alpha = 0.3
-            cv2.addWeighted(overlay, alpha, m.array, 1 - alpha, 0, m.array)
-
-            # Draw text on top of the background
-            cv2.putText(m.array, text, (text_x, text_y),
-                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 1)
-    
-        # Get current time in seconds since the epoch
-        timestamp_seconds = time.time()
-        #print("Timestamp (seconds):", timestamp_seconds)
-        if timestamp_seconds - timestamp_seconds_prev > 3.0:
-            # Send the GET_GPS message followed by a newline if requi>
-            ser.write(b"GET_GPS")  # Use b'' to send bytes
-            timestamp_seconds_prev = timestamp_seconds
-            # Read the response (adjust the number of bytes based on >
-            response = ser.readline()  # Read a line from the serial
-            print("Response:", response.decode('utf-8').strip())
-            if len(response) > 2:
-                # Parse the response
-                lat, lon, timestamp = parse_response(response)
-                if lat is not None and lon is not None:
-                    print(f"Latitude: {lat}, Longitude: {lon}, Time: {timestamp}")
-
-
-
-        # Draw GPS Coordinate at the bottom
-        text = f"Lat:{lat:.6f} Lon: {lon:.6f} Time:{timestamp}"
-        # Calculate text size and position
-        (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
-        text_x = text_left + 5
-        text_y = text_top + 15 + (index + 1)*20
-
-        # Create a copy of the array to draw the background with opacity
-        overlay = m.array.copy()
-
-        # Draw the background rectangle on the overlay
-        cv2.rectangle(overlay,
-                (text_x, text_y - text_height),
-                (text_x + text_width, text_y + baseline),
-                (255, 255, 255),  # Background color (white)
-                cv2.FILLED)
-
-        alpha = 0.3
-        cv2.addWeighted(overlay, alpha, m.array, 1 - alpha, 0, m.array)
-
-        # Draw text on top of the background
-        cv2.putText(m.array, text, (text_x, text_y),
-                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), font_thickness)
+    global frame_count
+    start = time.perf_counter()
+    pipeline.process(request)
+    meter.tick()
+
+    frame_times[frame_count % len(frame_times)] = (time.perf_counter() - start) * 1000
+    frame_count += 1
+    if frame_count % len(frame_times) == 0:
+        print("Callback frame time:", ", ".join(f"{k} {v:.2f}" for k, v in frame_jitter(frame_times).items()))
+
+
+def survey_frame(metadata: dict, timestamp: float):
+    """Headless mode: parse and log the tensor, nothing is drawn."""
+    pipeline.process(metadata=metadata, timestamp=timestamp)
+
+
+def make_pipeline(headless: bool = False):
+    """The demo's stages, wired to this camera, GPS and the command line options."""
+    def recorder_factory(num_classes, labels):
+        return DetectionRecorder(args.log_dir, num_classes=num_classes, labels=labels)
+
+    roi = imx500.get_roi_scaled if intrinsics.preserve_aspect_ratio else None
+    sampler = writer = None
+    if args.audit_dir:
+        sampler = AuditSampler(threshold=args.audit_threshold, min_spacing=args.audit_spacing,
+                               max_per_minute=args.audit_per_minute)
+        writer = AuditWriter(args.audit_dir, fmt=args.audit_format, max_mb=args.audit_max_mb)
+    return build_classification_pipeline(
+        imx500, intrinsics.labels, track, apply_softmax=intrinsics.softmax, gps=gps, ser=ser,
+        gps_interval=args.gps_interval, smooth_window=args.smooth_window, smooth_hold=args.smooth_hold,
+        event_distance=args.event_distance, controller=controller, picam2=picam2,
+        recorder_factory=recorder_factory if args.log_dir else None, log_probabilities=args.log_probabilities,
+        audit_sampler=sampler, audit_writer=writer, renderer=None if headless else OverlayRenderer(), roi=roi, mapped_array=MappedArray,
+        telemetry=telemetry)
+
 
 def get_args():
     """Parse command line arguments."""
@@ -196,7 +81,57 @@ def get_args():
                         help="Path to the labels file")
     parser.add_argument("--print-intrinsics", action="store_true",
                         help="Print JSON network_intrinsics then exit")
-    return parser.parse_args()
+    parser.add_argument("--gps-port", type=str, default="/dev/ttyUSB0", help="Serial port of the Spresense")
+    parser.add_argument("--gps-interval", type=float, default=3.0, help="Seconds between GPS polls")
+    parser.add_argument("--gps-mode", choices=["thread", "stream", "blocking"], default="thread",
+                        help="Poll GPS on a background thread, parse the continuous NMEA stream on a background "
+                             "thread, or poll inside the camera callback (old behaviour)")
+    parser.add_argument("--log-dir", type=str,
+                        help="Append every classification with its GPS position to a binary log in this directory")
+    parser.add_argument("--log-probabilities", action="store_true",
+                        help="Also store the full class probability vector in the log")
+    parser.add_argument("--smooth-window", type=int, default=0,
+                        help="Average class probabilities over this many frames and log only class changes "
+                             "(0 = per-frame top-1, every frame logged)")
+    parser.add_argument("--smooth-hold", type=int, default=3,
+                        help="Frames a new class must lead the smoothed probabilities before switching")
+    parser.add_argument("--event-distance", type=float, default=0.0,
+                        help="With --smooth-window, also log the held class every this many metres")
+    parser.add_argument("--spacing", type=float, default=0.0,
+                        help="Log one frame per this many metres travelled, and lower the FrameRate to match "
+                             "the GPS ground speed (0 = every frame)")
+    parser.add_argument("--max-interval", type=float, default=5.0,
+                        help="With --spacing, still log a frame at least this often (seconds) when parked")
+    parser.add_argument("--headless", action="store_true",
+                        help="Survey mode: no preview or drawing, only log results (to --log-dir, default survey_log)")
+    parser.add_argument("--save-every", type=int, default=0,
+                        help="In headless mode, save every Nth frame at full resolution for auditing")
+    parser.add_argument("--frames-dir", type=str, default="survey_frames", help="Where --save-every frames go")
+    parser.add_argument("--duration", type=float, help="Stop headless mode after this many seconds")
+    parser.add_argument("--audit-dir", type=str,
+                        help="Save uncertain, rare-class and well-spaced frames here for labelling (needs --log-dir "
+                             "in preview mode; see audit_sampler.py)")
+    parser.add_argument("--audit-format", choices=["jpg", "webp"], default="jpg", help="Audit image format")
+    parser.add_argument("--audit-threshold", type=float, default=0.6,
+                        help="Selection score (top-2 margin and class rarity, 0-1) a frame needs to be saved")
+    parser.add_argument("--audit-spacing", type=float, default=5.0,
+                        help="Metres between audit frames of the same class")
+    parser.add_argument("--audit-per-minute", type=float, default=6.0, help="At most this many audit frames a minute")
+    parser.add_argument("--audit-max-mb", type=float, default=2000.0, help="Stop saving audit frames at this size")
+    parser.add_argument("--density-model", type=str,
+                        help="ONNX classifier for tiled weed-density inference on the full frame (host CPU)")
+    parser.add_argument("--density-log", type=str, default="density_log.jsonl",
+                        help="Where to append per-frame density grids with their GPS position")
+    parser.add_argument("--density-interval", type=float, default=1.0,
+                        help="Seconds between density frames")
+    parser.add_argument("--density-overlap", type=float, default=0.25, help="Fractional overlap between tiles")
+    parser.add_argument("--density-scale", type=float, default=1.0,
+                        help="Resize factor applied to the full-resolution frame before tiling")
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    if args.audit_dir and not (args.log_dir or args.headless):
+        parser.error("--audit-dir needs --log-dir: audit frames are marked in the detection log")
+    return args
 
 
 if __name__ == "__main__":
@@ -230,15 +165,95 @@ if __name__ == "__main__":
         print(intrinsics)
         exit()
 
+    telemetry = Telemetry.from_args(args, intrinsics.inference_rate)
+    if args.gps_mode in ("thread", "stream"):
+        gps = GpsReader(args.gps_port, interval=args.gps_interval, verbose=True, track=track,
+                        mode="poll" if args.gps_mode == "thread" else "stream", telemetry=telemetry)
+        gps.start()
+    else:
+        import serial
+        ser = serial.Serial(args.gps_port, 115200, timeout=2)
+
     picam2 = Picamera2(imx500.camera_num)
-    config = picam2.create_preview_configuration(controls={"FrameRate": intrinsics.inference_rate}, buffer_count=12)
+    if args.spacing > 0:
+        controller = RateController(args.spacing, max_interval=args.max_interval, max_fps=intrinsics.inference_rate)
+
+    if args.headless:
+        args.log_dir = args.log_dir or "survey_log"
+        # The main stream is only looked at for saved frames, so only then is it full resolution
+        # (audit frames use the preview-size stream)
+        main = {"size": picam2.sensor_resolution} if args.save_every else {}
+        config = picam2.create_preview_configuration(main, controls={"FrameRate": intrinsics.inference_rate},
+                                                     buffer_count=12)
+        imx500.show_network_fw_progress_bar()
+        picam2.start(config, show_preview=False)
+        if intrinsics.preserve_aspect_ratio:
+            imx500.set_auto_aspect_ratio()
+        pipeline = make_pipeline(headless=True)
+        audit = pipeline.stage("audit")
+        stats = run_survey(picam2, survey_frame, args.frames_dir, args.save_every, args.duration,
+                           ThroughputMeter("survey"), capture_wanted=audit and audit.wants_capture,
+                           on_capture=audit and audit.capture)
+        if controller is not None:
+            stats.update(controller.stats())
+        print("Survey:", ", ".join(f"{k} {v:.1f}" if isinstance(v, float) else f"{k} {v}" for k, v in stats.items()))
+        print("Stage times:", pipeline.stage_stats())
+        picam2.stop()
+        pipeline.close()
+        telemetry.close()
+        if gps is not None:
+            gps.stop()
+        exit()
+
+    # Density tiles are cut from the full sensor resolution, the preview-size stream only gives a couple
+    main = {"size": picam2.sensor_resolution} if args.density_model else {}
+    config = picam2.create_preview_configuration(main, controls={"FrameRate": intrinsics.inference_rate},
+                                                 buffer_count=12)
 
     imx500.show_network_fw_progress_bar()
     picam2.start(config, show_preview=True)
     if intrinsics.preserve_aspect_ratio:
         imx500.set_auto_aspect_ratio()
     # Register the callback to parse and draw classification results
+    pipeline = make_pipeline()
     picam2.pre_callback = parse_and_draw_classification_results
 
-    while True:
-        time.sleep(0.5)
+    writer = None
+    try:
+        if args.density_model:
+            from weed_density import DensityEstimator, DensityWriter, tile_layout
+
+            # The main stream is XBGR8888, which is RGB(X) in memory
+            estimator = DensityEstimator(args.density_model, overlap=args.density_overlap,
+                                         scale=args.density_scale, bgr=False)
+            width, height = picam2.camera_configuration()["main"]["size"]
+            layout = tile_layout(int(height * args.density_scale), int(width * args.density_scale),
+                                 overlap=args.density_overlap)
+            if max(layout["overlap_x"], layout["overlap_y"]) > args.density_overlap + 0.05:
+                print(f"Density tiles overlap {layout['overlap_x']:.0%} x {layout['overlap_y']:.0%} on the "
+                      f"{width}x{height} stream at --density-scale {args.density_scale}, "
+                      f"not {args.density_overlap:.0%}; raise the scale for finer tiling")
+            writer = DensityWriter(args.density_log)
+            while True:
+                start = time.time()
+                request = picam2.capture_request()
+                frame, frame_time = request.make_array("main"), sensor_time(request.get_metadata())
+                request.release()
+                with telemetry.timer("density"):
+                    result = estimator.estimate(frame)
+                # the estimate takes a while, so place the frame by its own timestamp, not the latest fix
+                frame_lat, frame_lon = track.position_at(frame_time)
+                writer.write(result, frame_lat, frame_lon, pipeline.stage("geotag").time_text)
+                print("Density:", ", ".join(f"{k}: {v:.2f}" for k, v in result["fractions"].items()),
+                      f"({result['tiles']} tiles, overlap {result['overlap']:.0%}, {result['elapsed_ms']:.0f} ms)")
+                time.sleep(max(0.0, args.density_interval - (time.time() - start)))
+
+        while True:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.close()
+        telemetry.close()
+        if writer is not None:
+            writer.close()
@@ -1,5 +1,6 @@
 import argparse
 import sys
+import time
 from functools import lru_cache
 
 import cv2
@@ -10,18 +11,27 @@ from picamera2.devices import IMX500
 from picamera2.devices.imx500 import (NetworkIntrinsics,
                                       postprocess_nanodet_detection)
 
-last_detections = []
-
-
-class Detection:
-    def __init__(self, coords, category, conf, metadata):
-        """Create a Detection object, recording the bounding box, category and confidence."""
-        self.category = category
-        self.conf = conf
-        self.box = imx500.convert_inference_coords(coords, metadata, picam2)
-
-
-def parse_detections(metadata: dict):
+from detection_log import DetectionRecorder
+from detections import CoordinateMapper, Detections, decode_ssd, draw_detections_batch
+from gps import GpsReader
+from gps_track import GpsTrack, sensor_time
+from overlay import OverlayRenderer
+from rate_control import RateController, ground_speed
+from runtime import FrameRuntime
+from survey import ThroughputMeter, run_survey
+from telemetry import Telemetry, add_telemetry_arguments
+from tracker import SortTracker
+
+last_detections = Detections.empty()
+renderer = OverlayRenderer()  # keeps text metrics between frames
+track = GpsTrack()  # filled by the GPS reader when --gps-port is given
+recorder = None
+controller = None  # RateController with --spacing
+tracker = None     # SortTracker with --track
+telemetry = None   # parse / draw / track latency and frame drops, see telemetry.py
+
+
+def parse_detections(metadata: dict) -> Detections:
     """Parse the output tensor into a number of detected objects, scaled to the ISP output."""
     global last_detections
     bbox_normalization = intrinsics.bbox_normalization
@@ -40,21 +50,15 @@ def parse_detections(metadata: dict):
                                           max_out_dets=max_detections)[0]
         from picamera2.devices.imx500.postprocess import scale_boxes
         boxes = scale_boxes(boxes, 1, 1, input_h, input_w, False, False)
+        detections = Detections(np.asarray(boxes, dtype=np.float32), np.asarray(scores, dtype=np.float32),
+                                np.asarray(classes, dtype=np.int32))
     else:
-        boxes, scores, classes = np_outputs[0][0], np_outputs[1][0], np_outputs[2][0]
-        if bbox_normalization:
-            boxes = boxes / input_h
-
-        if bbox_order == "xy":
-            boxes = boxes[:, [1, 0, 3, 2]]
-        boxes = np.array_split(boxes, 4, axis=1)
-        boxes = zip(*boxes)
-
-    last_detections = [
-        Detection(box, category, score, metadata)
-        for box, score, category in zip(boxes, scores, classes)
-        if score > threshold
-    ]
+        detections = decode_ssd(np_outputs[0][0], np_outputs[1][0], np_outputs[2][0], threshold,
+                                iou=iou, max_detections=max_detections, bbox_normalization=bbox_normalization,
+                                bbox_order=bbox_order, input_h=input_h)
+
+    # All boxes are converted to ISP (x, y, w, h) in one vectorized step
+    last_detections = Detections(mapper.to_isp(detections.boxes, metadata), detections.scores, detections.classes)
     return last_detections
 
 
@@ -67,41 +71,32 @@ def get_labels():
     return labels
 
 
+def update_tracks(detections: Detections, metadata: dict):
+    """Feed a frame's detections to the tracker; returns the track ID per box and the tracks that ended."""
+    x, y, w, h = detections.boxes.T
+    return tracker.update(np.stack([x, y, x + w, y + h], axis=1), detections.scores, detections.classes,
+                          sensor_time(metadata))
+
+
+def record_tracks(ended, timestamp: float):
+    """One record per tracked weed, placed at the time it was closest to the image centre."""
+    for record in ended:
+        lat, lon = track.position_at(record.time)
+        recorder.record(timestamp, lat, lon, record.class_idx, record.score)
+
+
 def draw_detections(request, stream="main"):
     """Draw the detections for this request onto the ISP output."""
-    detections = last_results
-    if detections is None:
+    results = last_results  # read once: boxes and IDs always come from the same frame
+    if results is None:
         return
+    detections, track_ids = results
     labels = get_labels()
     with MappedArray(request, stream) as m:
-        for detection in detections:
-            x, y, w, h = detection.box
-            label = f"{labels[int(detection.category)]} ({detection.conf:.2f})"
-
-            # Calculate text size and position
-            (text_width, text_height), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-            text_x = x + 5
-            text_y = y + 15
-
-            # Create a copy of the array to draw the background with opacity
-            overlay = m.array.copy()
-
-            # Draw the background rectangle on the overlay
-            cv2.rectangle(overlay,
-                          (text_x, text_y - text_height),
-                          (text_x + text_width, text_y + baseline),
-                          (255, 255, 255),  # Background color (white)
-                          cv2.FILLED)
-
-            alpha = 0.30
-            cv2.addWeighted(overlay, alpha, m.array, 1 - alpha, 0, m.array)
-
-            # Draw text on top of the background
-            cv2.putText(m.array, label, (text_x, text_y),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-
-            # Draw detection box
-            cv2.rectangle(m.array, (x, y), (x + w, y + h), (0, 255, 0, 0), thickness=2)
+        texts = [f"{labels[int(category)]} ({conf:.2f})" for category, conf in zip(detections.classes, detections.scores)]
+        if track_ids is not None:
+            texts = [f"#{track_id} {text}" for track_id, text in zip(track_ids, texts)]
+        draw_detections_batch(m.array, detections.boxes, texts, box_colour=(0, 255, 0, 0), renderer=renderer)
 
         if intrinsics.preserve_aspect_ratio:
             b_x, b_y, b_w, b_h = imx500.get_roi_scaled(request)
@@ -110,6 +105,43 @@ def draw_detections(request, stream="main"):
             cv2.rectangle(m.array, (b_x, b_y), (b_x + b_w, b_y + b_h), (255, 0, 0, 0))
 
 
+def publish_detections(result):
+    """Runtime sink: make a newly parsed frame's detections (and track IDs) the ones drawn."""
+    global last_results
+    detections = result.value
+    if last_results is not None and detections is last_results[0]:
+        return  # no new tensor, the tracker already saw these
+    track_ids = None
+    if tracker is not None:
+        track_ids, ended = update_tracks(detections, {"SensorTimestamp": result.sensor_ns})
+        for record in ended:
+            print(f"Weed #{record.track_id}: {get_labels()[record.class_idx]} ({record.score:.2f}), "
+                  f"{record.hits} frames")
+        record_tracks(ended, time.time())
+    last_results = (detections, track_ids)
+
+
+def survey_frame(metadata: dict, timestamp: float):
+    """Headless mode: one log record per detection of each new output tensor, nothing is drawn."""
+    telemetry.monitor.frame(metadata.get("SensorTimestamp"), metadata.get("FrameDuration"))
+    if controller is not None and tracker is None:  # tracking needs consecutive frames
+        speed = ground_speed(track=track)
+        controller.update_camera(picam2, speed, time.monotonic())
+        if not controller.should_process(sensor_time(metadata), speed):
+            return
+    previous = last_detections
+    detections = parse_detections(metadata)
+    telemetry.monitor.result(metadata.get("SensorTimestamp"))
+    if detections is previous:
+        return  # no new tensor for this frame
+    if tracker is not None:
+        record_tracks(update_tracks(detections, metadata)[1], timestamp)
+        return
+    lat, lon = track.position_at(sensor_time(metadata))
+    for category, conf in zip(detections.classes, detections.scores):
+        recorder.record(timestamp, lat, lon, int(category), float(conf))
+
+
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--model", type=str, help="Path of the model",
@@ -130,6 +162,27 @@ def get_args():
                         help="Path to the labels file")
     parser.add_argument("--print-intrinsics", action="store_true",
                         help="Print JSON network_intrinsics then exit")
+    parser.add_argument("--headless", action="store_true",
+                        help="Survey mode: no preview or drawing, only log detections to --log-dir")
+    parser.add_argument("--log-dir", type=str, default="survey_log",
+                        help="Detection log directory (headless, or with --track in preview)")
+    parser.add_argument("--save-every", type=int, default=0,
+                        help="In headless mode, save every Nth frame at full resolution for auditing")
+    parser.add_argument("--frames-dir", type=str, default="survey_frames", help="Where --save-every frames go")
+    parser.add_argument("--duration", type=float, help="Stop headless mode after this many seconds")
+    parser.add_argument("--spacing", type=float, default=0.0,
+                        help="Headless: log one frame per this many metres travelled, lowering the FrameRate "
+                             "to match the GPS ground speed (needs --gps-port, 0 = every frame)")
+    parser.add_argument("--track", action="store_true",
+                        help="Track detections across frames and log one record per weed when its track ends "
+                             "(headless ignores --spacing while tracking)")
+    parser.add_argument("--track-iou", type=float, default=0.3, help="Minimum IoU to continue a track")
+    parser.add_argument("--track-max-age", type=int, default=5, help="Frames a track survives without a match")
+    parser.add_argument("--track-min-hits", type=int, default=3, help="Matches needed before a track is reported")
+    parser.add_argument("--gps-port", type=str, help="Serial port of the Spresense, to geotag logged detections")
+    parser.add_argument("--queue-size", type=int, default=2,
+                        help="Frames waiting for post-processing before the oldest is dropped (preview)")
+    add_telemetry_arguments(parser)
     return parser.parse_args()
 
 
@@ -164,7 +217,49 @@ if __name__ == "__main__":
         print(intrinsics)
         exit()
 
+    telemetry = Telemetry.from_args(args, intrinsics.inference_rate)
+    parse_detections = telemetry.wrap(parse_detections, "parse")
+    draw_detections = telemetry.wrap(draw_detections, "draw")
+    update_tracks = telemetry.wrap(update_tracks, "track")
+
+    gps = None
+    if args.gps_port:
+        gps = GpsReader(args.gps_port, track=track, telemetry=telemetry)
+        gps.start()
+
     picam2 = Picamera2(imx500.camera_num)
+
+    if args.headless:
+        # The main stream is only looked at for audit frames, so only then is it full resolution
+        main = {"size": picam2.sensor_resolution} if args.save_every else {}
+        config = picam2.create_preview_configuration(main, controls={"FrameRate": intrinsics.inference_rate},
+                                                     buffer_count=12)
+        imx500.show_network_fw_progress_bar()
+        picam2.start(config, show_preview=False)
+        if intrinsics.preserve_aspect_ratio:
+            imx500.set_auto_aspect_ratio()
+        mapper = CoordinateMapper(imx500, picam2)
+        if args.track:
+            tracker = SortTracker(iou_threshold=args.track_iou, max_age=args.track_max_age,
+                                  min_hits=args.track_min_hits, centre=(mapper.output_w / 2, mapper.output_h / 2))
+        recorder = DetectionRecorder(args.log_dir, labels=get_labels())
+        if args.spacing > 0:
+            controller = RateController(args.spacing, max_fps=intrinsics.inference_rate)
+        stats = run_survey(picam2, survey_frame, args.frames_dir, args.save_every, args.duration,
+                           ThroughputMeter("survey"))
+        if controller is not None:
+            stats.update(controller.stats())
+        print("Survey:", ", ".join(f"{k} {v:.1f}" if isinstance(v, float) else f"{k} {v}" for k, v in stats.items()))
+        print("Stage times:", telemetry.totals())
+        picam2.stop()
+        if tracker is not None:
+            record_tracks(tracker.flush(), time.time())
+        recorder.close()
+        telemetry.close()
+        if gps is not None:
+            gps.stop()
+        exit()
+
     config = picam2.create_preview_configuration(controls={"FrameRate": intrinsics.inference_rate}, buffer_count=12)
 
     imx500.show_network_fw_progress_bar()
@@ -173,7 +268,30 @@ if __name__ == "__main__":
     if intrinsics.preserve_aspect_ratio:
         imx500.set_auto_aspect_ratio()
 
-    last_results = None
+    mapper = CoordinateMapper(imx500, picam2)
+    if args.track:
+        tracker = SortTracker(iou_threshold=args.track_iou, max_age=args.track_max_age,
+                              min_hits=args.track_min_hits, centre=(mapper.output_w / 2, mapper.output_h / 2))
+        recorder = DetectionRecorder(args.log_dir, labels=get_labels())
+    last_results = None  # (detections, track IDs or None), replaced as one tuple by publish_detections
     picam2.pre_callback = draw_detections
-    while True:
-        last_results = parse_detections(picam2.capture_metadata())
+    meter = ThroughputMeter("preview")
+    # Parsing runs on a worker thread, so this loop only waits on the camera
+    runtime = FrameRuntime(parse_detections, sink=publish_detections, queue_size=args.queue_size,
+                           telemetry=telemetry)
+    try:
+        while True:
+            metadata = picam2.capture_metadata()
+            runtime.submit(metadata, metadata.get("SensorTimestamp"), metadata.get("FrameDuration"))
+            meter.tick()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runtime.close()
+        print("Runtime:", runtime.stats())
+        if tracker is not None:
+            record_tracks(tracker.flush(), time.time())
+            recorder.close()
+        telemetry.close()
+        if gps is not None:
+            gps.stop()
@@ -3,6 +3,7 @@ import multiprocessing
 import queue
 import sys
 import threading
+import time
 from functools import lru_cache
 
 import cv2
@@ -13,46 +14,71 @@ from picamera2.devices import IMX500
 from picamera2.devices.imx500 import (NetworkIntrinsics,
                                       postprocess_nanodet_detection)
 
+from detections import CoordinateMapper, Detections, decode_ssd, draw_detections_batch
+from overlay import OverlayRenderer
+from shared_tensors import SharedTensorRing
 
-class Detection:
-    def __init__(self, coords, category, conf, metadata):
-        """Create a Detection object, recording the bounding box, category and confidence."""
-        self.category = category
-        self.conf = conf
-        self.box = imx500.convert_inference_coords(coords, metadata, picam2)
+# Worker-process state, set once by init_worker
+worker_ring = None
+worker_params = None
 
+renderer = OverlayRenderer()  # main process only, keeps text metrics between frames
 
-def parse_detections(metadata: dict):
-    """Parse the output tensor into a number of detected objects, scaled to the ISP output."""
-    bbox_normalization = intrinsics.bbox_normalization
-    threshold = args.threshold
-    iou = args.iou
-    max_detections = args.max_detections
 
-    np_outputs = imx500.get_outputs(metadata, add_batch=True)
-    input_w, input_h = imx500.get_input_size()
-    if np_outputs is None:
-        return None
-    if intrinsics.postprocess == "nanodet":
+def init_worker(ring_spec: dict, params: dict):
+    """Attach a pool worker to the shared tensor ring. Workers never touch imx500/picam2."""
+    global worker_ring, worker_params
+    worker_ring = SharedTensorRing.attach(ring_spec)
+    worker_params = params
+
+
+def decode_slot(slot: int):
+    """Decode the output tensors in a ring slot into compact (boxes, scores, classes) arrays.
+
+    Boxes are returned in the normalised inference coordinates expected by
+    imx500.convert_inference_coords, which is applied in the main process.
+    """
+    start = time.perf_counter()
+    p = worker_params
+    np_outputs = worker_ring.views(slot)
+    if p["postprocess"] == "nanodet":
         boxes, scores, classes = \
-            postprocess_nanodet_detection(outputs=np_outputs[0], conf=threshold, iou_thres=iou,
-                                          max_out_dets=max_detections)[0]
+            postprocess_nanodet_detection(outputs=np_outputs[0], conf=p["threshold"], iou_thres=p["iou"],
+                                          max_out_dets=p["max_detections"])[0]
         from picamera2.devices.imx500.postprocess import scale_boxes
-        boxes = scale_boxes(boxes, 1, 1, input_h, input_w, False, False)
+        boxes = scale_boxes(boxes, 1, 1, p["input_h"], p["input_w"], False, False)
+        detections = Detections(np.asarray(boxes, dtype=np.float32), np.asarray(scores, dtype=np.float32),
+                                np.asarray(classes, dtype=np.int32))
     else:
-        boxes, scores, classes = np_outputs[0][0], np_outputs[1][0], np_outputs[2][0]
-        if bbox_normalization:
-            boxes = boxes / input_h
+        # decode_ssd indexes out of the slot, so the slot can be reused as soon as the result is read
+        detections = decode_ssd(np_outputs[0][0], np_outputs[1][0], np_outputs[2][0], p["threshold"],
+                                iou=p["iou"], max_detections=p["max_detections"],
+                                bbox_normalization=p["bbox_normalization"], input_h=p["input_h"])
+
+    return detections.boxes, detections.scores, detections.classes, (time.perf_counter() - start) * 1000
+
+
+class StageTimer:
+    def __init__(self, stages, report_every: int = 100):
+        """Accumulate per-stage latencies (ms) and print averages every report_every frames."""
+        self.totals = dict.fromkeys(stages, 0.0)
+        self.frames = 0
+        self.dropped = 0
+        self.report_every = report_every
+        self.lock = threading.Lock()
 
-        boxes = np.array_split(boxes, 4, axis=1)
-        boxes = zip(*boxes)
+    def add(self, **stage_ms):
+        with self.lock:
+            for stage, ms in stage_ms.items():
+                self.totals[stage] += ms
+            self.frames += 1
+            if self.frames % self.report_every == 0:
+                avg = ", ".join(f"{k} {v / self.frames:.2f}" for k, v in self.totals.items())
+                print(f"[{self.frames} frames, {self.dropped} dropped] avg ms: {avg}")
 
-    detections = [
-        Detection(box, category, score, metadata)
-        for box, score, category in zip(boxes, scores, classes)
-        if score > threshold
-    ]
-    return detections
+    def drop(self):
+        with self.lock:
+            self.dropped += 1
 
 
 @lru_cache
@@ -64,46 +90,23 @@ def get_labels():
     return labels
 
 
-def draw_detections(jobs):
+def draw_detections(jobs, ring, timer, mapper):
     """Draw the detections for this request onto the ISP output."""
     labels = get_labels()
     # Wait for result from child processes in the order submitted.
-    last_detections = []
     while (job := jobs.get()) is not None:
-        request, async_result = job
-        detections = async_result.get()
-        if detections is None:
-            detections = last_detections
-        last_detections = detections
+        request, metadata, slot, async_result, t_submit, copy_ms = job
+        boxes, scores, classes, decode_ms = async_result.get()
+        t_result = time.perf_counter()
+        ring.release(slot)
+        # Box conversion needs imx500/picam2, so it stays in the main process
+        detections = Detections(mapper.to_isp(boxes, metadata), scores, classes)
+        convert_ms = (time.perf_counter() - t_result) * 1000
+        t_draw = time.perf_counter()
         with MappedArray(request, 'main') as m:
-            for detection in detections:
-                x, y, w, h = detection.box
-                label = f"{labels[int(detection.category)]} ({detection.conf:.2f})"
-
-                # Calculate text size and position
-                (text_width, text_height), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-                text_x = x + 5
-                text_y = y + 15
-
-                # Create a copy of the array to draw the background with opacity
-                overlay = m.array.copy()
-
-                # Draw the background rectangle on the overlay
-                cv2.rectangle(overlay,
-                              (text_x, text_y - text_height),
-                              (text_x + text_width, text_y + baseline),
-                              (255, 255, 255),  # Background color (white)
-                              cv2.FILLED)
-
-                alpha = 0.3
-                cv2.addWeighted(overlay, alpha, m.array, 1 - alpha, 0, m.array)
-
-                # Draw text on top of the background
-                cv2.putText(m.array, label, (text_x, text_y),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-
-                # Draw detection box
-                cv2.rectangle(m.array, (x, y), (x + w, y + h), (0, 255, 0), thickness=2)
+            texts = [f"{labels[int(category)]} ({conf:.2f})"
+                     for category, conf in zip(detections.classes, detections.scores)]
+            draw_detections_batch(m.array, detections.boxes, texts, renderer=renderer)
 
             if intrinsics.preserve_aspect_ratio:
                 b_x, b_y, b_w, b_h = imx500.get_roi_scaled(request)
@@ -114,6 +117,9 @@ def draw_detections(jobs):
             cv2.imshow('IMX500 Object Detection', m.array)
             cv2.waitKey(1)
         request.release()
+        draw_ms = (time.perf_counter() - t_draw) * 1000
+        wait_ms = (t_result - t_submit) * 1000 - decode_ms
+        timer.add(copy=copy_ms, queue_wait=wait_ms, decode=decode_ms, convert=convert_ms, draw=draw_ms)
 
 
 def get_args():
@@ -134,7 +140,13 @@ def get_args():
                         help="Path to the labels file")
     parser.add_argument("--print-intrinsics", action="store_true",
                         help="Print JSON network_intrinsics then exit")
-    return parser.parse_args()
+    parser.add_argument("--workers", type=int, default=4, help="Number of decoding processes")
+    parser.add_argument("--slots", type=int, default=8,
+                        help="Shared-memory tensor slots (frames in flight); frames are dropped when all are busy")
+    args = parser.parse_args()
+    if args.slots >= 12:
+        parser.error("--slots must leave some of the camera's 12 buffers free, each frame in flight holds one")
+    return args
 
 
 if __name__ == "__main__":
@@ -177,18 +189,61 @@ if __name__ == "__main__":
     if intrinsics.preserve_aspect_ratio:
         imx500.set_auto_aspect_ratio()
 
-    pool = multiprocessing.Pool(processes=4)
-    jobs = queue.Queue()
-
-    thread = threading.Thread(target=draw_detections, args=(jobs,))
-    thread.start()
-
-    while True:
-        # The request gets released by handle_results
-        request = picam2.capture_request()
-        metadata = request.get_metadata()
-        if metadata:
-            async_result = pool.apply_async(parse_detections, (metadata,))
-            jobs.put((request, async_result))
-        else:
-            request.release()
+    input_w, input_h = imx500.get_input_size()
+    params = {
+        "threshold": args.threshold,
+        "iou": args.iou,
+        "max_detections": args.max_detections,
+        "bbox_normalization": intrinsics.bbox_normalization,
+        "postprocess": intrinsics.postprocess,
+        "input_w": input_w,
+        "input_h": input_h,
+    }
+    mapper = CoordinateMapper(imx500, picam2)
+    ring = None
+    pool = None
+    jobs = queue.Queue()  # every job holds a ring slot, so at most --slots requests wait here
+    timer = StageTimer(["copy", "queue_wait", "decode", "convert", "draw"])
+
+    try:
+        while True:
+            # The request gets released by draw_detections
+            request = picam2.capture_request()
+            t_capture = time.perf_counter()
+            metadata = request.get_metadata()
+            np_outputs = imx500.get_outputs(metadata, add_batch=True) if metadata else None
+            if np_outputs is None:
+                # Nothing to decode, so don't hold the request: queued behind slow decodes, frames
+                # without a tensor would starve the camera of its 12 buffers
+                request.release()
+                continue
+
+            if ring is None:
+                # Tensor shapes are only known once the first output arrives
+                ring = SharedTensorRing([t.shape for t in np_outputs], [t.dtype for t in np_outputs], args.slots)
+                pool = multiprocessing.Pool(processes=args.workers, initializer=init_worker,
+                                            initargs=(ring.spec, params))
+                thread = threading.Thread(target=draw_detections, args=(jobs, ring, timer, mapper), daemon=True)
+                thread.start()
+
+            slot = ring.acquire()
+            if slot is None:
+                # Every slot is still in flight: drop this frame instead of queueing without bound
+                timer.drop()
+                request.release()
+                continue
+            ring.write(slot, np_outputs)
+            t_submit = time.perf_counter()
+            async_result = pool.apply_async(decode_slot, (slot,))
+            jobs.put((request, metadata, slot, async_result, t_submit, (t_submit - t_capture) * 1000))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Shared memory outlives the process unless unlinked, so always hand it back
+        if ring is not None:
+            jobs.put(None)
+            thread.join(timeout=5)
+            pool.terminate()  # Ctrl-C also reaches the workers, so don't wait on them
+            pool.join()
+            ring.close()
+        picam2.stop()
@@ -10,10 +10,15 @@ from picamera2.devices.imx500.postprocess import COCODrawer
 from picamera2.devices.imx500.postprocess_highernet import \
     postprocess_higherhrnet
 
+from runtime import FrameRuntime
+from telemetry import Telemetry, add_telemetry_arguments
+
 last_boxes = None
 last_scores = None
 last_keypoints = None
 WINDOW_SIZE_H_W = (480, 640)
+telemetry = None  # parse / draw latency and frame drops, see telemetry.py
+runtime = None    # runs ai_output_tensor_parse off the camera thread
 
 
 def ai_output_tensor_parse(metadata: dict):
@@ -45,9 +50,16 @@ def ai_output_tensor_draw(request: CompletedRequest, boxes, scores, keypoints, s
 
 
 def picamera2_pre_callback(request: CompletedRequest):
-    """Analyse the detected objects in the output tensor and draw them on the main output image."""
-    boxes, scores, keypoints = ai_output_tensor_parse(request.get_metadata())
-    ai_output_tensor_draw(request, boxes, scores, keypoints)
+    """Queue the output tensor for post-processing and draw the latest poses on the main output image.
+
+    postprocess_higherhrnet takes longer than a frame, so it runs on the runtime's worker
+    thread; the drawn poses are from the most recent frame that has finished.
+    """
+    metadata = request.get_metadata()
+    runtime.submit(metadata, metadata.get("SensorTimestamp"), metadata.get("FrameDuration"))
+    result = runtime.latest
+    if result is not None:
+        ai_output_tensor_draw(request, *result.value)
 
 
 def get_args():
@@ -61,6 +73,9 @@ def get_args():
                         help="Path to the labels file")
     parser.add_argument("--print-intrinsics", action="store_true",
                         help="Print JSON network_intrinsics then exit")
+    parser.add_argument("--queue-size", type=int, default=2,
+                        help="Frames waiting for post-processing before the oldest is dropped")
+    add_telemetry_arguments(parser)
     return parser.parse_args()
 
 
@@ -104,6 +119,10 @@ if __name__ == "__main__":
         exit()
 
     drawer = get_drawer()
+    telemetry = Telemetry.from_args(args, intrinsics.inference_rate)
+    ai_output_tensor_parse = telemetry.wrap(ai_output_tensor_parse, "parse")
+    ai_output_tensor_draw = telemetry.wrap(ai_output_tensor_draw, "draw")
+    runtime = FrameRuntime(ai_output_tensor_parse, queue_size=args.queue_size, telemetry=telemetry)
 
     picam2 = Picamera2(imx500.camera_num)
     config = picam2.create_preview_configuration(controls={'FrameRate': intrinsics.inference_rate}, buffer_count=12)
@@ -113,5 +132,10 @@ if __name__ == "__main__":
     imx500.set_auto_aspect_ratio()
     picam2.pre_callback = picamera2_pre_callback
 
-    while True:
-        time.sleep(0.5)
+    try:
+        while True:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        runtime.close()
+        print("Runtime:", runtime.stats())
+        telemetry.close()
@@ -1,58 +1,47 @@
 import argparse
 import sys
 import time
-from typing import Dict
-
 import numpy as np
 
 from picamera2 import CompletedRequest, Picamera2
 from picamera2.devices import IMX500
 from picamera2.devices.imx500 import NetworkIntrinsics
 
+from segmentation import MaskRenderer
+from telemetry import Telemetry, add_telemetry_arguments
+
 COLOURS = np.loadtxt("assets/colours.txt")
+renderer = None  # MaskRenderer, created once the input size is known
+last_fractions = None  # per-class pixel fractions of the latest mask
+last_report = 0.0
+telemetry = None  # mask / overlay latency and frame drops, see telemetry.py
 
 
 def create_and_draw_masks(request: CompletedRequest):
     """Create masks from the output tensor and draw them on the main output image."""
-    masks = create_masks(request)
-    draw_masks(masks)
-
-
-def create_masks(request: CompletedRequest) -> Dict[int, np.ndarray]:
-    """Create masks from the output tensor, scaled to the ISP output."""
-    res = {}
-    np_outputs = imx500.get_outputs(metadata=request.get_metadata())
-    input_w, input_h = imx500.get_input_size()
+    global last_fractions, last_report
+    metadata = request.get_metadata()
+    telemetry.monitor.frame(metadata.get("SensorTimestamp"), metadata.get("FrameDuration"))
+    np_outputs = imx500.get_outputs(metadata=metadata)
     if np_outputs is None:
-        return res
-    mask = np_outputs[0]
-    found_indices = np.unique(mask)
-
-    for i in found_indices:
-        if i == 0:
-            continue
-        output_shape = [input_h, input_w, 4]
-        colour = [(0, 0, 0, 0), COLOURS[int(i)]]
-        colour[1][3] = 150  # update the alpha value here, to save setting it later
-        overlay = np.array(mask == i, dtype=np.uint8)
-        overlay = np.array(colour)[overlay].reshape(output_shape).astype(np.uint8)
-        # No need to resize the overlay, it will be stretched to the output window.
-        res[i] = overlay
-    return res
-
-
-def draw_masks(masks: Dict[int, np.ndarray]):
-    """Draw the masks for this request onto the ISP output."""
-    if not masks:
         return
-    input_w, input_h = imx500.get_input_size()
-    output_shape = [input_h, input_w, 4]
-    overlay = np.zeros(output_shape, dtype=np.uint8)
-    if masks:
-        for v in masks.values():
-            overlay += v
-        # Set Alphas and overlay
+    # One LUT lookup into a reused buffer, plus per-class area fractions from the same index
+    with telemetry.timer("masks"):
+        overlay, last_fractions = renderer.render(np_outputs[0])
+    # No need to resize the overlay, it will be stretched to the output window.
+    with telemetry.timer("overlay"):
         picam2.set_overlay(overlay)
+    telemetry.monitor.result(metadata.get("SensorTimestamp"))
+
+    if time.monotonic() - last_report > args.coverage_interval:
+        last_report = time.monotonic()
+        present = np.flatnonzero(last_fractions[1:] > 0.01) + 1
+        print("Coverage:", ", ".join(f"{class_name(i)} {last_fractions[i]:.1%}" for i in present) or "none")
+
+
+def class_name(idx: int) -> str:
+    labels = intrinsics.labels
+    return labels[idx] if labels and idx < len(labels) else str(idx)
 
 
 def get_args():
@@ -61,8 +50,12 @@ def get_args():
     parser.add_argument("--model", type=str, help="Path of the model",
                         default="/usr/share/imx500-models/imx500_network_deeplabv3plus.rpk")
     parser.add_argument("--fps", type=int, help="Frames per second")
+    parser.add_argument("--labels", type=str, help="Path to the labels file, used to size the colour table")
+    parser.add_argument("--coverage-interval", type=float, default=5.0,
+                        help="Seconds between printed per-class area fractions")
     parser.add_argument("--print-intrinsics", action="store_true",
                         help="Print JSON network_intrinsics then exit")
+    add_telemetry_arguments(parser)
     return parser.parse_args()
 
 
@@ -81,7 +74,10 @@ if __name__ == "__main__":
 
     # Override intrinsics from args
     for key, value in vars(args).items():
-        if hasattr(intrinsics, key) and value is not None:
+        if key == 'labels' and value is not None:
+            with open(value, 'r') as f:
+                intrinsics.labels = f.read().splitlines()
+        elif hasattr(intrinsics, key) and value is not None:
             setattr(intrinsics, key, value)
 
     # Defaults
@@ -91,6 +87,12 @@ if __name__ == "__main__":
         print(intrinsics)
         exit()
 
+    telemetry = Telemetry.from_args(args, intrinsics.inference_rate)
+    input_w, input_h = imx500.get_input_size()
+    # Without labels assume one class per colour plus background (DeepLabV3+ VOC: 21)
+    num_classes = len(intrinsics.labels) if intrinsics.labels else len(COLOURS) + 1
+    renderer = MaskRenderer(COLOURS, num_classes, (input_h, input_w))
+
     picam2 = Picamera2(imx500.camera_num)
     config = picam2.create_preview_configuration(controls={'FrameRate': intrinsics.inference_rate}, buffer_count=12)
     imx500.show_network_fw_progress_bar()
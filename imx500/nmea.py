@@ -0,0 +1,161 @@
+"""
+Streaming NMEA parser for continuous-output GPS.
+
+Raw serial bytes go straight into feed(), which keeps a preallocated buffer, splits
+complete lines, validates NMEA checksums and parses GGA / RMC / VTG sentences plus
+the Spresense 'lat,lon,alt,time' reply. Numbers are read directly from the byte
+buffer between comma positions; no decode(), split() or datetime per fix. Time is
+kept as UTC seconds of day.
+
+Each GPS epoch produces one GpsFix, on the first valid position sentence of that epoch.
+"""
+import math
+from typing import List, Optional
+
+import numpy as np
+
+from gps import GpsFix
+from gps_track import sensor_clock
+
+KNOTS_TO_MPS = 0.514444
+KMH_TO_MPS = 1 / 3.6
+NAN = float("nan")
+
+
+def format_utc(seconds: float) -> str:
+    """HH:MM:SS display string for UTC seconds of day."""
+    if math.isnan(seconds):
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class NmeaStreamParser:
+    def __init__(self, buffer_size: int = 4096, max_fields: int = 20):
+        """Create a parser with a fixed-size line buffer."""
+        self._buf = bytearray(buffer_size)
+        self._n = 0
+        self._commas = [0] * max_fields
+        self.speed = NAN       # m/s, from RMC or VTG
+        self.course = NAN      # degrees true
+        self.hdop = NAN
+        self._last_epoch = NAN
+        self.sentences = 0
+        self.checksum_errors = 0
+        self.overflows = 0
+
+    def feed(self, data: bytes, received: Optional[float] = None) -> List[GpsFix]:
+        """Consume raw serial bytes and return the fixes completed by them."""
+        received = sensor_clock() if received is None else received
+        buf = self._buf
+        fixes = []
+        for start in range(0, len(data), len(buf)):
+            chunk = data[start:start + len(buf)]
+            if self._n + len(chunk) > len(buf):
+                # a line longer than the buffer is garbage, drop what we have
+                self.overflows += 1
+                self._n = 0
+            buf[self._n:self._n + len(chunk)] = chunk
+            self._n += len(chunk)
+
+            pos = 0
+            while (end := buf.find(b"\n", pos, self._n)) != -1:
+                line_end = end - 1 if end > pos and buf[end - 1] == 0x0D else end  # strip \r
+                fix = self._parse_line(pos, line_end, received)
+                if fix is not None:
+                    fixes.append(fix)
+                pos = end + 1
+            # keep the incomplete tail at the start of the buffer
+            buf[:self._n - pos] = buf[pos:self._n]
+            self._n -= pos
+        return fixes
+
+    def _fields(self, start: int, end: int) -> int:
+        """Record comma positions of buf[start:end] in self._commas; returns the field count."""
+        buf, commas = self._buf, self._commas
+        count, pos = 0, start
+        while count < len(commas) - 1 and (pos := buf.find(b",", pos, end)) != -1:
+            commas[count] = pos
+            count += 1
+            pos += 1
+        commas[count] = end
+        return count + 1
+
+    def _num(self, i: int) -> float:
+        """Field i (0 = sentence id) as a float, NaN if empty."""
+        a, b = self._commas[i - 1] + 1, self._commas[i]
+        return float(self._buf[a:b]) if b > a else NAN
+
+    def _char(self, i: int) -> int:
+        a, b = self._commas[i - 1] + 1, self._commas[i]
+        return self._buf[a] if b > a else 0
+
+    def _coord(self, i: int, hemisphere: int) -> float:
+        """NMEA ddmm.mmmm / dddmm.mmmm field to signed decimal degrees."""
+        value = self._num(i)
+        degrees = int(value / 100)
+        decimal = degrees + (value - degrees * 100) / 60
+        return -decimal if self._char(hemisphere) in (ord("S"), ord("W")) else decimal
+
+    def _utc(self, i: int) -> float:
+        value = self._num(i)  # hhmmss.ss
+        hours = int(value / 10000)
+        minutes = int(value / 100) % 100
+        return hours * 3600 + minutes * 60 + (value - int(value / 100) * 100)
+
+    def _parse_line(self, start: int, end: int, received: float) -> Optional[GpsFix]:
+        if end - start < 6:
+            return None
+        buf = self._buf
+        self.sentences += 1
+        try:
+            if buf[start] != ord("$"):
+                return self._parse_custom(start, end, received)
+
+            star = buf.rfind(b"*", start, end)
+            if star == -1 or end - star < 3:
+                self.checksum_errors += 1
+                return None
+            checksum = np.bitwise_xor.reduce(np.frombuffer(buf, np.uint8, star - start - 1, start + 1))
+            if checksum != int(buf[star + 1:star + 3], 16):
+                self.checksum_errors += 1
+                return None
+
+            kind = bytes(buf[start + 3:start + 6])
+            n = self._fields(start, star)
+            if kind == b"GGA" and n > 9:
+                if self._char(6) in (0, ord("0")):  # no fix
+                    return None
+                self.hdop = self._num(8)
+                return self._emit(self._utc(1), self._coord(2, 3), self._coord(4, 5), received)
+            if kind == b"RMC" and n > 8:
+                if self._char(2) != ord("A"):  # void
+                    return None
+                self.speed = self._num(7) * KNOTS_TO_MPS
+                self.course = self._num(8)
+                return self._emit(self._utc(1), self._coord(3, 4), self._coord(5, 6), received)
+            if kind == b"VTG" and n > 7:
+                self.course = self._num(1)
+                self.speed = self._num(7) * KMH_TO_MPS
+        except ValueError:
+            self.checksum_errors += 1
+        return None
+
+    def _parse_custom(self, start: int, end: int, received: float) -> Optional[GpsFix]:
+        """Spresense GET_GPS reply: lat,lon,alt,YYYY-MM-DDTHH:MM:SSZ"""
+        if self._fields(start, end) < 4:
+            return None
+        a = self._commas[2] + 1  # start of the ISO time
+        utc = NAN
+        if end - a >= 19:
+            buf = self._buf
+            utc = int(buf[a + 11:a + 13]) * 3600 + int(buf[a + 14:a + 16]) * 60 + int(buf[a + 17:a + 19])
+        lat = float(self._buf[start:self._commas[0]])
+        lon = self._num(1)
+        return self._emit(utc, lat, lon, received)
+
+    def _emit(self, utc: float, lat: float, lon: float, received: float) -> Optional[GpsFix]:
+        if utc == self._last_epoch:
+            return None  # GGA and RMC of the same epoch
+        self._last_epoch = utc
+        return GpsFix(lat, lon, None, received, utc=utc, speed=self.speed, course=self.course, hdop=self.hdop)
@@ -0,0 +1,158 @@
+"""
+Overlay renderer for the camera callbacks.
+
+The demos used to copy the whole frame and run a full-frame cv2.addWeighted for every
+label they drew, just to get a translucent background behind a few small strings.
+OverlayRenderer queues a frame's annotations and draws them in one pass: each text
+background is blended in place on its own ROI sub-view, text metrics are cached per
+string, and all box outlines go out in a single cv2.polylines call.
+
+Compare against the old per-label full-frame blend:
+    python overlay.py --benchmark
+"""
+import argparse
+import time
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+class OverlayRenderer:
+    def __init__(self, font_scale: float = 0.5, thickness: int = 1, alpha: float = 0.3,
+                 background=(255, 255, 255), text_colour=(0, 0, 255), cache_size: int = 2048):
+        """Queue text and boxes with add_text / add_box, then draw them with render(array)."""
+        self.font_scale = font_scale
+        self.thickness = thickness
+        self.alpha = alpha
+        self.background = background
+        self.text_colour = text_colour
+        self.cache_size = cache_size
+        self._metrics: Dict[str, Tuple[int, int, int]] = {}
+        self._patch = None
+        self._texts: List[tuple] = []
+        self._boxes: Dict[tuple, list] = {}
+
+    def text_size(self, text: str) -> Tuple[int, int, int]:
+        """(width, height, baseline) of text, measured once per distinct string."""
+        metrics = self._metrics.get(text)
+        if metrics is None:
+            if len(self._metrics) >= self.cache_size:
+                self._metrics.clear()  # GPS/score strings keep changing, don't grow forever
+            (w, h), baseline = cv2.getTextSize(text, FONT, self.font_scale, self.thickness)
+            metrics = self._metrics[text] = (w, h, baseline)
+        return metrics
+
+    def add_text(self, text: str, x: int, y: int, colour=None, background: bool = True):
+        """Text with its baseline-left corner at (x, y), on a translucent background."""
+        self._texts.append((text, int(x), int(y), colour or self.text_colour, background))
+
+    def add_lines(self, lines: List[str], left: int, top: int, spacing: int = 20):
+        """Stack lines downwards from (left, top), laid out like the demos' label list."""
+        for index, text in enumerate(lines):
+            self.add_text(text, left + 5, top + 15 + index * spacing)
+
+    def add_box(self, x: int, y: int, w: int, h: int, colour=(0, 255, 0), thickness: int = 2):
+        corners = np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], dtype=np.int32)
+        self._boxes.setdefault((tuple(colour), thickness), []).append(corners)
+
+    def add_boxes(self, boxes_xywh: np.ndarray, colour=(0, 255, 0), thickness: int = 2):
+        """Many (x, y, w, h) boxes of one colour at once."""
+        if len(boxes_xywh) == 0:
+            return
+        x, y, w, h = np.asarray(boxes_xywh, dtype=np.int32).T
+        corners = np.stack([np.stack([x, y], 1), np.stack([x + w, y], 1),
+                            np.stack([x + w, y + h], 1), np.stack([x, y + h], 1)], axis=1)
+        self._boxes.setdefault((tuple(colour), thickness), []).extend(corners)
+
+    def _background_patch(self, h: int, w: int, channels: int) -> np.ndarray:
+        """Solid background colour, reused between frames and only grown when needed."""
+        patch = self._patch
+        if patch is None or patch.shape[0] < h or patch.shape[1] < w or patch.shape[2] != channels:
+            colour = (tuple(self.background) + (0,) * channels)[:channels]
+            shape = (max(h, 64), max(w, 512), channels)
+            patch = self._patch = np.empty(shape, dtype=np.uint8)
+            patch[:] = colour
+        return patch[:h, :w]
+
+    def _blend(self, array: np.ndarray, x0: int, y0: int, x1: int, y1: int):
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, array.shape[1]), min(y1, array.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return
+        roi = array[y0:y1, x0:x1]
+        channels = roi.shape[2] if roi.ndim == 3 else 1
+        patch = self._background_patch(y1 - y0, x1 - x0, channels).reshape(roi.shape)
+        cv2.addWeighted(patch, self.alpha, roi, 1 - self.alpha, 0, roi)
+
+    def render(self, array: np.ndarray):
+        """Draw everything queued since the last render onto array, in place."""
+        for text, x, y, _, background in self._texts:
+            if background:
+                w, h, baseline = self.text_size(text)
+                # same pixels as cv2.rectangle with inclusive corners
+                self._blend(array, x, y - h, x + w + 1, y + baseline + 1)
+        for text, x, y, colour, _ in self._texts:
+            cv2.putText(array, text, (x, y), FONT, self.font_scale, colour, self.thickness)
+        for (colour, thickness), corners in self._boxes.items():
+            cv2.polylines(array, corners, True, colour, thickness=thickness)
+        self._texts.clear()
+        self._boxes.clear()
+
+
+def draw_full_frame_blend(array: np.ndarray, lines: List[str], left: int = 0, top: int = 0):
+    """The previous approach: one full-frame copy and addWeighted per line (benchmark reference)."""
+    for index, text in enumerate(lines):
+        (w, h), baseline = cv2.getTextSize(text, FONT, 0.5, 1)
+        x, y = left + 5, top + 15 + index * 20
+        overlay = array.copy()
+        cv2.rectangle(overlay, (x, y - h), (x + w, y + baseline), (255, 255, 255), cv2.FILLED)
+        cv2.addWeighted(overlay, 0.3, array, 0.7, 0, array)
+        cv2.putText(array, text, (x, y), FONT, 0.5, (0, 0, 255), 1)
+
+
+def benchmark(sizes=((640, 480), (2028, 1520)), n_lines: int = 4, iterations: int = 200) -> dict:
+    """Per-frame draw cost (ms) of the old full-frame blend and the renderer on synthetic XBGR buffers."""
+    rng = np.random.default_rng(0)
+    labels = ["Broadleaf", "Grass", "Soil"]
+    renderer = OverlayRenderer()
+    results = {}
+    for width, height in sizes:
+        frame = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+        for name in ("full_frame", "renderer"):
+            times = np.empty(iterations)
+            for i in range(iterations):
+                # scores and GPS change every frame, like the callback's strings
+                lines = [f"{labels[k % 3]}: {rng.random():.3f}" for k in range(n_lines - 1)]
+                lines.append(f"Lat:{38.5 + i * 1e-6:.6f} Lon: {-121.76:.6f} Time:12:00:{i % 60:02d}")
+                start = time.perf_counter_ns()
+                if name == "full_frame":
+                    draw_full_frame_blend(frame, lines)
+                else:
+                    renderer.add_lines(lines, 0, 0)
+                    renderer.render(frame)
+                times[i] = (time.perf_counter_ns() - start) / 1e6
+            results.setdefault(f"{width}x{height}", {})[name] = {"p50_ms": float(np.percentile(times, 50)),
+                                                                 "p99_ms": float(np.percentile(times, 99))}
+    for size, stats in results.items():
+        speedup = stats["full_frame"]["p50_ms"] / stats["renderer"]["p50_ms"]
+        print(f"{size:>10}: " + ", ".join(f"{name} p50 {s['p50_ms']:.3f} ms / p99 {s['p99_ms']:.3f} ms"
+                                          for name, s in stats.items()) + f" ({speedup:.0f}x)")
+    return results
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true", help="Time the renderer against full-frame blending")
+    parser.add_argument("--lines", type=int, default=4, help="Labels drawn per frame (including the GPS line)")
+    parser.add_argument("--iterations", type=int, default=200)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.benchmark:
+        benchmark(n_lines=args.lines, iterations=args.iterations)
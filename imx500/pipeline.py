@@ -0,0 +1,376 @@
+"""
+Per-frame classification pipeline as importable stages.
+
+The camera callback of imx500_classification_demo_ucd.py used to be a handful of
+functions reading globals set in __main__. Here each step is a stage object that gets
+its dependencies (imx500, GPS track, recorder, renderer, ...) passed in and works on a
+Frame:
+
+    parse -> smooth -> geotag -> sample -> audit -> log -> draw
+
+Nothing here imports picamera2 at module level, so the same pipeline can be driven by
+the camera on the Pi or by replay.py with stand-in objects on any Linux box.
+Pipeline.process() times every stage with perf_counter_ns into telemetry.py
+histograms and counts dropped and late frames from the SensorTimestamps.
+"""
+import math
+import time
+from typing import Callable, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from detection_log import FLAG_AUDIT, FLAG_CLASS_CHANGE, FLAG_DISTANCE
+from gps import poll_once
+from gps_track import GpsTrack, sensor_time
+from nmea import format_utc
+from rate_control import ground_speed
+from smoothing import ClassSmoother
+from telemetry import Telemetry
+
+
+def softmax(x: np.ndarray) -> np.ndarray:
+    e = np.exp(x - np.max(x))
+    return e / e.sum()
+
+
+def resolve_labels(labels: Sequence[str], output_size: int) -> List[str]:
+    """Drop a leading background label when the network has one output fewer than labels."""
+    labels = list(labels)
+    return labels[1:] if len(labels) == output_size + 1 else labels
+
+
+class Frame:
+    __slots__ = ("request", "metadata", "timestamp", "sensor_time", "output", "probabilities", "class_idx",
+                 "score", "lat", "lon", "log", "flags")
+
+    def __init__(self, request, metadata: dict, timestamp: float):
+        """State of one frame as it passes through the stages."""
+        self.request = request
+        self.metadata = metadata
+        self.timestamp = timestamp            # unix seconds, used for log records
+        self.sensor_time = sensor_time(metadata)
+        self.output = None                    # probability vector, None if no new inference this frame
+        self.probabilities = None             # the unsmoothed output of this frame's inference
+        self.class_idx = -1
+        self.score = 0.0
+        self.lat = math.nan
+        self.lon = math.nan
+        self.log = True                       # cleared by stages that decide not to log this frame
+        self.flags = 0
+
+
+class ParseStage:
+    name = "parse"
+
+    def __init__(self, imx500, labels: Sequence[str], apply_softmax: bool = False):
+        """Top-1 class of the output tensor; frames without a new tensor keep the last result."""
+        self.imx500 = imx500
+        self.raw_labels = labels
+        self.labels = None
+        self.apply_softmax = apply_softmax
+        self._last = (-1, 0.0)
+
+    def __call__(self, frame: Frame):
+        np_outputs = self.imx500.get_outputs(frame.metadata)
+        if np_outputs is None:
+            frame.class_idx, frame.score = self._last
+            return
+        output = np_outputs[0]
+        if self.apply_softmax:
+            output = softmax(output)
+        if self.labels is None:
+            self.labels = resolve_labels(self.raw_labels, len(output))
+        frame.output = frame.probabilities = output
+        idx = int(np.argmax(output))
+        frame.class_idx, frame.score = self._last = (idx, float(output[idx]))
+
+    def label(self, idx: int) -> str:
+        if self.labels is None or not 0 <= idx < len(self.labels):
+            return str(idx)
+        return self.labels[idx]
+
+
+class SmoothStage:
+    name = "smooth"
+
+    def __init__(self, window: int = 8, hold: int = 3, distance: float = 0.0):
+        """Replace the per-frame top-1 by the ClassSmoother's held class (created on the first tensor)."""
+        self.window = window
+        self.hold = hold
+        self.distance = distance
+        self.smoother: Optional[ClassSmoother] = None
+
+    def __call__(self, frame: Frame):
+        if frame.output is not None:
+            if self.smoother is None:
+                self.smoother = ClassSmoother(len(frame.output), window=self.window, hold=self.hold,
+                                              distance=self.distance)
+            self.smoother.update(frame.output)
+            frame.output = self.smoother.smoothed
+        if self.smoother is not None:
+            frame.class_idx, frame.score = self.smoother.class_idx, self.smoother.score
+
+
+class GeotagStage:
+    name = "geotag"
+
+    def __init__(self, track: GpsTrack, gps=None, ser=None, poll_interval: float = 3.0, poll_timer=None):
+        """Place the frame on the GPS track and keep the display fix up to date.
+
+        With ser (and no gps reader) the Spresense is polled from inside the stage every
+        poll_interval seconds, the old blocking behaviour, timed by poll_timer if given.
+        """
+        self.track = track
+        self.gps = gps
+        self.ser = ser
+        self.poll_interval = poll_interval
+        self.poll_timer = poll_timer
+        if gps is None and ser is not None:
+            track.expect_fixes_every(poll_interval, ser.timeout or 1.0)
+        self._last_poll = 0.0
+        self.lat, self.lon = 0.0, 0.0
+        self.time_text = "--:--:--"
+
+    def __call__(self, frame: Frame):
+        if self.gps is not None:
+            fix = self.gps.latest
+        elif self.ser is not None and time.time() - self._last_poll > self.poll_interval:
+            self._last_poll = time.time()
+            if self.poll_timer is not None:
+                with self.poll_timer:
+                    fix = poll_once(self.ser)
+            else:
+                fix = poll_once(self.ser)
+            if fix is not None:
+                self.track.append(fix.received, fix.lat, fix.lon)
+                print(f"Latitude: {fix.lat}, Longitude: {fix.lon}, Time: {fix.time}")
+        else:
+            fix = None
+        if fix is not None and fix.time is not None:
+            self.time_text = str(fix.time)
+        elif fix is not None and not math.isnan(fix.utc):
+            self.time_text = format_utc(fix.utc)
+
+        frame.lat, frame.lon = self.track.position_at(frame.sensor_time)
+        if not math.isnan(frame.lat):
+            self.lat, self.lon = frame.lat, frame.lon
+
+    def text(self) -> str:
+        return f"Lat:{self.lat:.6f} Lon: {self.lon:.6f} Time:{self.time_text}"
+
+
+class SampleStage:
+    name = "sample"
+
+    def __init__(self, controller, track: GpsTrack, gps=None, picam2=None):
+        """Ground-speed rate control: frames closer than the target spacing are not logged."""
+        self.controller = controller
+        self.track = track
+        self.gps = gps
+        self.picam2 = picam2
+
+    def __call__(self, frame: Frame):
+        if frame.output is None:
+            return
+        speed = ground_speed(self.gps.latest if self.gps is not None else None, self.track)
+        if self.picam2 is not None:
+            self.controller.update_camera(self.picam2, speed, time.monotonic())
+        frame.log = self.controller.should_process(frame.sensor_time, speed)
+
+
+class LogStage:
+    name = "log"
+
+    def __init__(self, recorder_factory: Callable, parse: ParseStage, smooth: Optional[SmoothStage] = None,
+                 log_probabilities: bool = False):
+        """Queue a record per logged frame; the recorder is made on the first tensor (needs its size)."""
+        self.recorder_factory = recorder_factory
+        self.parse = parse
+        self.smooth = smooth
+        self.log_probabilities = log_probabilities
+        self.recorder = None
+
+    def __call__(self, frame: Frame):
+        # audit frames are always logged (their record is the audit record), whatever rate control says
+        audit = frame.flags & FLAG_AUDIT
+        if frame.output is None or frame.class_idx < 0 or not (frame.log or audit):
+            return
+        if self.smooth is not None:
+            # only class changes and distance ticks are logged, not every frame
+            reason = self.smooth.smoother.emit(frame.lat, frame.lon)
+            if reason is None and not audit:
+                return
+            if reason is not None:
+                frame.flags |= FLAG_CLASS_CHANGE if reason == "change" else FLAG_DISTANCE
+        if self.recorder is None:
+            self.recorder = self.recorder_factory(len(frame.output) if self.log_probabilities else 0,
+                                                  self.parse.labels)
+        # an audit record keeps the unsmoothed vector the sampler judged the frame by
+        probabilities = frame.probabilities if audit else frame.output
+        self.recorder.record(frame.timestamp, frame.lat, frame.lon, frame.class_idx, frame.score,
+                             probabilities if self.log_probabilities else None, flags=frame.flags)
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+class AuditStage:
+    name = "audit"
+
+    def __init__(self, sampler, writer, mapped_array=None, stream: str = "main"):
+        """Save frames the AuditSampler picks through the AuditWriter and flag them FLAG_AUDIT.
+
+        Runs before LogStage, which then logs the frame's own record with the flag (no extra
+        record), and before DrawStage so the saved image has no overlay on it. Headless
+        frames come without a request: a selected one is only flagged and its image is
+        taken from the next frame, which survey.py captures when wants_capture() says so.
+        """
+        if mapped_array is None:
+            from picamera2 import MappedArray as mapped_array
+        self.sampler = sampler
+        self.writer = writer
+        self.mapped_array = mapped_array
+        self.stream = stream
+        self.pending = None  # timestamp of a headless audit frame still waiting for its image
+
+    def __call__(self, frame: Frame):
+        if frame.probabilities is None or self.writer.full or self.pending is not None:
+            return
+        if not self.sampler.select(frame.probabilities, frame.lat, frame.lon, time.monotonic()):
+            return
+        if frame.request is None:
+            self.pending = frame.timestamp
+            frame.flags |= FLAG_AUDIT
+        elif self.save(frame.request, frame.timestamp):
+            frame.flags |= FLAG_AUDIT
+
+    def save(self, request, timestamp: float) -> bool:
+        """Copy the request's frame to the writer, if its queue has room for it."""
+        with self.mapped_array(request, self.stream) as m:
+            if not self.writer.has_room(m.array.nbytes):
+                self.writer.dropped += 1
+                return False
+            image = m.array.copy()
+        return self.writer.submit(image, timestamp)
+
+    def wants_capture(self) -> bool:
+        return self.pending is not None
+
+    def capture(self, request):
+        """Headless: save a captured request as the image of the pending audit frame."""
+        self.save(request, self.pending)
+        self.pending = None
+
+    def close(self):
+        self.writer.close()
+
+
+class DrawStage:
+    name = "draw"
+
+    def __init__(self, renderer, parse: ParseStage, geotag: Optional[GeotagStage] = None,
+                 roi: Optional[Callable] = None, mapped_array=None, stream: str = "main"):
+        """Label (and GPS line) with translucent backgrounds; roi(request) gives the ROI box to outline."""
+        if mapped_array is None:
+            from picamera2 import MappedArray as mapped_array
+        self.renderer = renderer
+        self.parse = parse
+        self.geotag = geotag
+        self.roi = roi
+        self.mapped_array = mapped_array
+        self.stream = stream
+
+    def __call__(self, frame: Frame):
+        with self.mapped_array(frame.request, self.stream) as m:
+            text_left, text_top = 0, 0
+            if self.roi is not None:
+                b_x, b_y, b_w, b_h = self.roi(frame.request)
+                cv2.putText(m.array, "ROI", (b_x + 5, b_y + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+                cv2.rectangle(m.array, (b_x, b_y), (b_x + b_w, b_y + b_h), (255, 0, 0, 0))
+                text_left, text_top = b_x, b_y + 20
+            lines = []
+            if frame.class_idx >= 0:
+                lines.append(f"{self.parse.label(frame.class_idx)}: {frame.score:.3f}")
+            if self.geotag is not None:
+                lines.append(self.geotag.text())
+            self.renderer.add_lines(lines, text_left, text_top)
+            self.renderer.render(m.array)
+
+
+class Pipeline:
+    def __init__(self, stages: List, telemetry: Optional[Telemetry] = None):
+        """Run stages in order on every frame, timing each into the telemetry's histograms."""
+        self.stages = stages
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self._histograms = [self.telemetry.histogram(s.name) for s in stages]
+        self._total = self.telemetry.histogram("total")
+        self.frames = 0
+
+    def stage(self, name: str):
+        return next((s for s in self.stages if s.name == name), None)
+
+    def process(self, request=None, metadata: Optional[dict] = None, timestamp: Optional[float] = None) -> Frame:
+        """Process one frame, from a request (preview callback) or bare metadata (headless)."""
+        if metadata is None:
+            metadata = request.get_metadata()
+        sensor_ns = metadata.get("SensorTimestamp")
+        self.telemetry.monitor.frame(sensor_ns, metadata.get("FrameDuration"))
+        frame = Frame(request, metadata, time.time() if timestamp is None else timestamp)
+        start = previous = time.perf_counter_ns()
+        for stage, histogram in zip(self.stages, self._histograms):
+            stage(frame)
+            now = time.perf_counter_ns()
+            histogram.record(now - previous)
+            previous = now
+        self._total.record(previous - start)
+        self.telemetry.monitor.result(sensor_ns)
+        self.frames += 1
+        return frame
+
+    def stage_stats(self) -> dict:
+        """p50 / p99 / max in ms per stage and in total, over the whole run."""
+        if self.frames == 0:
+            return {}
+        totals = self.telemetry.totals()
+        return {name: {k: totals[name][k] for k in ("p50_ms", "p99_ms", "max_ms")}
+                for name in [s.name for s in self.stages] + ["total"]}
+
+    def close(self):
+        for stage in self.stages:
+            if hasattr(stage, "close"):
+                stage.close()
+
+
+def build_classification_pipeline(imx500, labels: Sequence[str], track: GpsTrack, *, apply_softmax: bool = False,
+                                  gps=None, ser=None, gps_interval: float = 3.0, smooth_window: int = 0,
+                                  smooth_hold: int = 3, event_distance: float = 0.0, controller=None,
+                                  picam2=None, recorder_factory: Optional[Callable] = None,
+                                  log_probabilities: bool = False, audit_sampler=None, audit_writer=None,
+                                  renderer=None, roi: Optional[Callable] = None, mapped_array=None,
+                                  telemetry: Optional[Telemetry] = None) -> Pipeline:
+    """The stages of the UCD classification demo; no renderer means headless (nothing drawn).
+
+    Audit frames (audit_sampler and audit_writer) need the recorder and always log probabilities.
+    """
+    telemetry = telemetry if telemetry is not None else Telemetry()
+    parse = ParseStage(imx500, labels, apply_softmax=apply_softmax)
+    stages = [parse]
+    smooth = None
+    if smooth_window > 0:
+        smooth = SmoothStage(smooth_window, smooth_hold, event_distance)
+        stages.append(smooth)
+    geotag = GeotagStage(track, gps=gps, ser=ser, poll_interval=gps_interval,
+                         poll_timer=telemetry.timer("gps_poll"))
+    stages.append(geotag)
+    if controller is not None:
+        stages.append(SampleStage(controller, track, gps=gps, picam2=picam2))
+    if recorder_factory is not None:
+        audit = audit_sampler is not None and audit_writer is not None
+        if audit:
+            stages.append(AuditStage(audit_sampler, audit_writer, mapped_array=mapped_array))
+        stages.append(LogStage(recorder_factory, parse, smooth, log_probabilities or audit))
+    if renderer is not None:
+        stages.append(DrawStage(renderer, parse, geotag, roi=roi, mapped_array=mapped_array))
+    return Pipeline(stages, telemetry)
@@ -0,0 +1,89 @@
+"""
+Ground-speed driven processing rate.
+
+A fixed FrameRate over-samples while the mower is parked or turning at a row end and
+under-samples at speed. RateController keeps an even spacing on the ground instead:
+it integrates GPS ground speed between frames and lets a frame through to parsing and
+logging only once the mower has moved target_spacing metres (or max_interval seconds
+have passed, so a parked mower still logs now and then). It also retunes the camera's
+FrameRate to a little above the rate that spacing needs, so the ISP and the IMX500 are
+not producing frames that would only be skipped.
+"""
+import math
+from typing import Optional
+
+NAN = float("nan")
+
+
+def ground_speed(fix=None, track=None) -> float:
+    """Speed in m/s: NMEA speed over ground if the fix has it, else from the last two track fixes."""
+    if fix is not None and not math.isnan(fix.speed):
+        return fix.speed
+    velocity = track.velocity() if track is not None else None
+    return velocity[0] if velocity else NAN
+
+
+class RateController:
+    def __init__(self, target_spacing: float = 0.5, max_interval: float = 5.0, min_fps: float = 2.0,
+                 max_fps: float = 30.0, headroom: float = 1.5, retune_interval: float = 2.0,
+                 retune_ratio: float = 0.2):
+        """Process a frame every target_spacing metres travelled, and at least every max_interval seconds.
+
+        The camera FrameRate is kept at headroom x the needed rate within [min_fps, max_fps],
+        changed at most every retune_interval seconds and only by more than retune_ratio.
+        """
+        self.target_spacing = target_spacing
+        self.max_interval = max_interval
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.headroom = headroom
+        self.retune_interval = retune_interval
+        self.retune_ratio = retune_ratio
+        self.frame_rate = max_fps
+        self.processed = 0
+        self.skipped = 0
+        self._distance = 0.0
+        self._prev_t = None
+        self._last_processed = None
+        self._last_retune = -math.inf
+
+    def should_process(self, t: float, speed: float) -> bool:
+        """Decide for the frame at sensor-clock time t, given the ground speed in m/s.
+
+        With no speed available every frame is processed, as without the controller.
+        """
+        if self._prev_t is not None and not math.isnan(speed):
+            self._distance += speed * max(t - self._prev_t, 0.0)
+        self._prev_t = t
+
+        if (math.isnan(speed) or self._last_processed is None or self._distance >= self.target_spacing
+                or t - self._last_processed >= self.max_interval):
+            # keep the remainder so the spacing stays even when frames don't land exactly on it
+            self._distance = self._distance % self.target_spacing if self.target_spacing > 0 else 0.0
+            self._last_processed = t
+            self.processed += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def target_fps(self, speed: float) -> float:
+        if math.isnan(speed) or self.target_spacing <= 0:
+            return self.max_fps
+        return min(max(speed / self.target_spacing * self.headroom, self.min_fps), self.max_fps)
+
+    def update_camera(self, picam2, speed: float, now: float) -> Optional[float]:
+        """Retune the camera FrameRate if the needed rate has moved enough; returns the new rate."""
+        if now - self._last_retune < self.retune_interval:
+            return None
+        target = self.target_fps(speed)
+        if abs(target - self.frame_rate) <= self.retune_ratio * self.frame_rate:
+            return None
+        picam2.set_controls({"FrameRate": target})
+        self.frame_rate = target
+        self._last_retune = now
+        return target
+
+    def stats(self) -> dict:
+        total = self.processed + self.skipped
+        return {"processed": self.processed, "skipped": self.skipped,
+                "skip_ratio": self.skipped / total if total else 0.0, "frame_rate": self.frame_rate}
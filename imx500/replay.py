@@ -0,0 +1,283 @@
+"""
+Offline replay of the classification pipeline, no camera needed.
+
+Feeds recorded or synthetic output tensors and frames through stand-ins for
+Picamera2's CompletedRequest / MappedArray and the IMX500 device, into the same
+stages the UCD demo builds (pipeline.build_classification_pipeline), and reports
+per-stage frame times, drops against the frame budget and throughput.
+
+    python replay.py --frames 900 --fps 30 --smooth-window 8 --output replay.json
+    python replay.py --source session.npz --realtime --baseline replay.json
+
+A recorded session is an .npz with `outputs` (N, num_classes) and optionally
+`sensor_times` (N,) seconds and `frames` (N, H, W, 4) uint8.
+
+--realtime paces frames at --fps like the camera and drops the frames that arrive
+while the pipeline is still busy (the newest waiting frame is processed next).
+Without it frames are pushed back to back to measure the maximum throughput.
+With --baseline the run is compared against an earlier --output and the exit
+status is 1 if a timing or the drop rate regressed by more than --tolerance.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from detection_log import DetectionRecorder, list_segments, read_logs
+from gps_track import GpsTrack, sensor_clock
+from overlay import OverlayRenderer
+from pipeline import build_classification_pipeline
+from rate_control import RateController
+
+
+class FakeRequest:
+    def __init__(self, array: np.ndarray, metadata: dict):
+        """Stand-in for picamera2.CompletedRequest around one frame buffer."""
+        self.array = array
+        self.metadata = metadata
+
+    def get_metadata(self) -> dict:
+        return self.metadata
+
+    def make_array(self, stream: str = "main") -> np.ndarray:
+        return self.array.copy()
+
+    def save(self, stream: str, path: str):
+        cv2.imwrite(path, self.array[..., :3])
+
+    def release(self):
+        pass
+
+
+class FakeMappedArray:
+    def __init__(self, request: FakeRequest, stream: str = "main"):
+        """Stand-in for picamera2.MappedArray: the request's buffer, drawn on in place."""
+        self.request = request
+
+    def __enter__(self):
+        self.array = self.request.array
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeIMX500:
+    def __init__(self, input_size=(224, 224), output_size=(640, 480)):
+        """Stand-in for picamera2.devices.IMX500, reading tensors put in the metadata by the replay."""
+        self.input_size = input_size
+        self.output_size = output_size
+        self.camera_num = 0
+        self.network_intrinsics = None
+
+    def get_outputs(self, metadata: dict, add_batch: bool = False):
+        tensor = metadata.get("CnnOutputTensor")
+        if tensor is None:
+            return None
+        return [tensor[None]] if add_batch else [tensor]
+
+    def get_output_shapes(self, metadata: dict):
+        tensor = metadata.get("CnnOutputTensor")
+        return [] if tensor is None else [tensor.shape]
+
+    def get_input_size(self):
+        return self.input_size
+
+    def get_roi_scaled(self, request):
+        return 0, 0, self.output_size[0], self.output_size[1]
+
+    def convert_inference_coords(self, coords, metadata, picam2, stream="main"):
+        y0, x0, y1, x1 = coords
+        w, h = self.output_size
+        return int(x0 * w), int(y0 * h), int((x1 - x0) * w), int((y1 - y0) * h)
+
+
+class FakePicamera2:
+    def __init__(self, size=(640, 480)):
+        """Records controls and overlays instead of applying them."""
+        self.size = size
+        self.sensor_resolution = (2028, 1520)
+        self.controls = {}
+        self.overlay = None
+
+    def set_controls(self, controls: dict):
+        self.controls.update(controls)
+
+    def set_overlay(self, overlay):
+        self.overlay = overlay
+
+    def camera_configuration(self):
+        return {"main": {"size": self.size}}
+
+
+class SyntheticSource:
+    def __init__(self, frames: int = 900, num_classes: int = 3, fps: float = 30.0, size=(640, 480),
+                 segment_s: float = 3.0, noise: float = 0.15, buffers: int = 12, seed: int = 0):
+        """Flickering softmax outputs around a true class that changes every segment_s seconds."""
+        rng = np.random.default_rng(seed)
+        self.fps = fps
+        truth = np.repeat(rng.integers(0, num_classes, frames // int(segment_s * fps) + 1),
+                          int(segment_s * fps))[:frames]
+        logits = rng.normal(0, noise * 5, (frames, num_classes))
+        logits[np.arange(frames), truth] += 1.0
+        e = np.exp(logits - logits.max(axis=1, keepdims=True))
+        self.outputs = (e / e.sum(axis=1, keepdims=True)).astype(np.float32)
+        self.truth = truth
+        # on the SensorTimestamp clock, like the camera's, so fixes stamped with sensor_clock() line up
+        self.sensor_times = sensor_clock() + np.arange(frames) / fps
+        # a fixed pool of buffers, reused round robin like the camera's buffer_count
+        base = rng.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+        self._buffers = [base.copy() for _ in range(buffers)]
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def frame(self, i: int) -> np.ndarray:
+        return self._buffers[i % len(self._buffers)]
+
+
+class NpzSource:
+    def __init__(self, path: str, fps: float = 30.0, size=(640, 480), buffers: int = 12):
+        """A recorded session: outputs (N, K), optional sensor_times (N,) and frames (N, H, W, 4)."""
+        data = np.load(path)
+        self.outputs = data["outputs"].astype(np.float32)
+        self.sensor_times = data["sensor_times"] if "sensor_times" in data else sensor_clock() + np.arange(len(self)) / fps
+        self._frames = data["frames"] if "frames" in data else None
+        self._buffers = [np.zeros((size[1], size[0], 4), dtype=np.uint8) for _ in range(buffers)]
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def frame(self, i: int) -> np.ndarray:
+        buffer = self._buffers[i % len(self._buffers)]
+        if self._frames is not None and self._frames[i].shape == buffer.shape:
+            np.copyto(buffer, self._frames[i])
+        return buffer
+
+
+def synthetic_track(sensor_times: np.ndarray, speed_mps: float = 1.5, interval: float = 1.0) -> GpsTrack:
+    """Fixes every `interval` seconds along a straight northbound line covering the replay."""
+    start, end = sensor_times[0] - interval, sensor_times[-1] + interval
+    t = np.arange(start, end, interval)
+    track = GpsTrack(capacity=len(t) + 1)
+    for ti in t:
+        track.append(ti, 38.5382 + (ti - start) * speed_mps / 111_320.0, -121.7617)
+    return track
+
+
+def replay(pipeline, source, fps: float = 30.0, realtime: bool = False, mapped: bool = True) -> dict:
+    """Run every frame of the source through the pipeline and summarise timings and drops."""
+    budget_ns = 1e9 / fps
+    processed = dropped = overruns = 0
+    start = time.perf_counter_ns()
+    i = 0
+    while i < len(source):
+        if realtime:
+            arrival = start + i * budget_ns
+            now = time.perf_counter_ns()
+            if now < arrival:
+                time.sleep((arrival - now) / 1e9)
+            else:
+                # frames that arrived while we were busy: only the newest is processed
+                newest = min(int((now - start) // budget_ns), len(source) - 1)
+                dropped += newest - i
+                i = newest
+        metadata = {"SensorTimestamp": int(source.sensor_times[i] * 1e9), "CnnOutputTensor": source.outputs[i]}
+        request = FakeRequest(source.frame(i), metadata) if mapped else None
+        t0 = time.perf_counter_ns()
+        pipeline.process(request, metadata=metadata)
+        if time.perf_counter_ns() - t0 > budget_ns:
+            overruns += 1
+        processed += 1
+        i += 1
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    return {
+        "frames": len(source),
+        "processed": processed,
+        "dropped": dropped,
+        "drop_rate": dropped / len(source),
+        "overruns": overruns,
+        "budget_ms": budget_ns / 1e6,
+        "throughput_fps": processed / elapsed,
+        "stages": pipeline.stage_stats(),
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """Regressions of the p99 stage times and the drop rate beyond tolerance (relative)."""
+    regressions = []
+    for stage, stats in baseline.get("stages", {}).items():
+        now = current["stages"].get(stage)
+        # tiny stages are all noise, give them an absolute floor of 0.05 ms
+        if now and now["p99_ms"] > max(stats["p99_ms"] * (1 + tolerance), stats["p99_ms"] + 0.05):
+            regressions.append(f"{stage} p99 {stats['p99_ms']:.3f} -> {now['p99_ms']:.3f} ms")
+    if current["drop_rate"] > baseline["drop_rate"] * (1 + tolerance) + 0.01:
+        regressions.append(f"drop rate {baseline['drop_rate']:.3f} -> {current['drop_rate']:.3f}")
+    return regressions
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, help="Recorded session .npz (default: synthetic tensors)")
+    parser.add_argument("--frames", type=int, default=900, help="Synthetic frames")
+    parser.add_argument("--num-classes", type=int, default=3, help="Synthetic classes")
+    parser.add_argument("--fps", type=float, default=30.0, help="Frame rate, sets the per-frame budget")
+    parser.add_argument("--size", type=str, default="640x480", help="Frame buffer size WxH")
+    parser.add_argument("--realtime", action="store_true", help="Pace frames at --fps and drop late ones")
+    parser.add_argument("--headless", action="store_true", help="Leave out the draw stage")
+    parser.add_argument("--smooth-window", type=int, default=0)
+    parser.add_argument("--smooth-hold", type=int, default=3)
+    parser.add_argument("--event-distance", type=float, default=0.0)
+    parser.add_argument("--spacing", type=float, default=0.0)
+    parser.add_argument("--log-probabilities", action="store_true")
+    parser.add_argument("--log-dir", type=str, help="Keep the detection log here (default: temporary)")
+    parser.add_argument("--output", type=str, help="Write the results as JSON")
+    parser.add_argument("--baseline", type=str, help="Results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    size = tuple(int(v) for v in args.size.split("x"))
+    if args.source:
+        source = NpzSource(args.source, fps=args.fps, size=size)
+    else:
+        source = SyntheticSource(args.frames, args.num_classes, fps=args.fps, size=size)
+    labels = [f"class_{i}" for i in range(source.outputs.shape[1])]
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix="replay_log_")
+    picam2 = FakePicamera2(size)
+
+    pipeline = build_classification_pipeline(
+        FakeIMX500(output_size=size), labels, synthetic_track(source.sensor_times),
+        smooth_window=args.smooth_window, smooth_hold=args.smooth_hold, event_distance=args.event_distance,
+        controller=RateController(args.spacing) if args.spacing > 0 else None, picam2=picam2,
+        recorder_factory=lambda k, names: DetectionRecorder(log_dir, num_classes=k, labels=names),
+        log_probabilities=args.log_probabilities,
+        renderer=None if args.headless else OverlayRenderer(), mapped_array=FakeMappedArray)
+
+    results = replay(pipeline, source, fps=args.fps, realtime=args.realtime, mapped=not args.headless)
+    pipeline.close()
+    results["records"] = int(len(read_logs(list_segments(log_dir))))
+    results["config"] = {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}
+
+    for name, stats in results["stages"].items():
+        print(f"{name:>8}: p50 {stats['p50_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms, max {stats['max_ms']:.3f} ms")
+    print(f"{results['processed']}/{results['frames']} frames processed, {results['dropped']} dropped, "
+          f"{results['overruns']} over the {results['budget_ms']:.1f} ms budget, "
+          f"{results['throughput_fps']:.0f} fps, {results['records']} log records")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION:", line)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,154 @@
+"""
+Threaded capture -> post-process -> sink runtime for the single-process demos.
+
+The camera side only submits: each frame's metadata (or anything else small) goes
+into a bounded input queue, tagged with a frame sequence number and its
+SensorTimestamp, and the caller goes straight back to the camera. Post-processing
+runs on worker thread(s) and every result is handed to the sink on its own thread
+and kept as `latest`, which a pre_callback can draw without waiting.
+
+Both queues drop their oldest entry when full, so a slow post-process costs
+skipped frames rather than an ever-growing backlog of stale ones, and nothing ever
+blocks the camera. With several workers results can finish out of order; results
+older than one already delivered are discarded. With a telemetry.Telemetry the
+queue wait, process time and sensor -> result latency are recorded.
+"""
+import collections
+import threading
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+
+class Result(NamedTuple):
+    seq: int               # frame sequence number, in submit order
+    sensor_ns: int         # SensorTimestamp of the frame, 0 if unknown
+    value: Any             # what the process function returned
+
+
+class DropOldestQueue:
+    def __init__(self, maxsize: int = 2):
+        """Bounded FIFO where put() never blocks: when full the oldest item is dropped."""
+        self._items = collections.deque()
+        self.maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item) -> Optional[Any]:
+        """Queue item; returns the item dropped to make room, if any."""
+        with self._cond:
+            dropped = None
+            if len(self._items) >= self.maxsize:
+                dropped = self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+            return dropped
+
+    def get(self, timeout: Optional[float] = None):
+        """Oldest item, or None once closed and empty (or on timeout)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            return self._items.popleft() if self._items else None
+
+    def close(self) -> list:
+        """Wake every waiting get(); returns the items still queued."""
+        with self._cond:
+            self._closed = True
+            items = list(self._items)
+            self._items.clear()
+            self._cond.notify_all()
+            return items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FrameRuntime:
+    def __init__(self, process: Callable[[Any], Any], sink: Optional[Callable[[Result], None]] = None,
+                 workers: int = 1, queue_size: int = 2, on_drop: Optional[Callable[[Any], None]] = None,
+                 telemetry=None):
+        """Run process(item) on `workers` threads and sink(result) on another.
+
+        on_drop(item) is called for submitted items that are dropped unprocessed, e.g. to
+        release a CompletedRequest. Process functions that keep state between frames need
+        workers=1.
+        """
+        self.process = process
+        self.sink = sink
+        self.on_drop = on_drop
+        self.inputs = DropOldestQueue(queue_size)
+        self.outputs = DropOldestQueue(queue_size)
+        self.latest: Optional[Result] = None
+        self.seq = 0
+        self.stale = 0     # results discarded because a newer one was already delivered
+        self.errors = 0
+        self.telemetry = telemetry
+        if telemetry is not None:
+            self._wait = telemetry.histogram("queue_wait")
+            self._process = telemetry.histogram("process")
+        self._threads = [threading.Thread(target=self._work, daemon=True, name=f"runtime-worker-{i}")
+                         for i in range(workers)]
+        self._threads.append(threading.Thread(target=self._deliver, daemon=True, name="runtime-sink"))
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def dropped(self) -> int:
+        return self.inputs.dropped + self.outputs.dropped
+
+    def submit(self, item, sensor_ns: Optional[int] = None, frame_duration_us: Optional[int] = None) -> int:
+        """Queue one frame's item for post-processing; returns its sequence number. Never blocks.
+
+        sensor_ns and frame_duration_us are the frame's SensorTimestamp and FrameDuration, for telemetry.
+        """
+        seq = self.seq
+        self.seq += 1
+        if self.telemetry is not None:
+            self.telemetry.monitor.frame(sensor_ns, frame_duration_us)
+        dropped = self.inputs.put((seq, sensor_ns or 0, time.perf_counter_ns(), item))
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped[3])
+        return seq
+
+    def _work(self):
+        while (job := self.inputs.get()) is not None:
+            seq, sensor_ns, submitted, item = job
+            start = time.perf_counter_ns()
+            try:
+                value = self.process(item)
+            except Exception as e:
+                # one bad frame must not kill the worker
+                self.errors += 1
+                print(f"Post-process of frame {seq} failed:", e)
+                continue
+            if self.telemetry is not None:
+                self._wait.record(start - submitted)
+                self._process.record(time.perf_counter_ns() - start)
+            self.outputs.put(Result(seq, sensor_ns, value))
+
+    def _deliver(self):
+        while (result := self.outputs.get()) is not None:
+            if self.latest is not None and result.seq < self.latest.seq:
+                self.stale += 1
+                continue
+            self.latest = result
+            if self.telemetry is not None:
+                self.telemetry.monitor.result(result.sensor_ns)
+            if self.sink is not None:
+                self.sink(result)
+
+    def stats(self) -> dict:
+        return {"submitted": self.seq, "dropped": self.dropped, "stale": self.stale, "errors": self.errors,
+                "in_flight": len(self.inputs) + len(self.outputs)}
+
+    def close(self, timeout: float = 2.0):
+        """Stop the threads; queued items that were never processed go to on_drop."""
+        for _, _, _, item in self.inputs.close():
+            if self.on_drop is not None:
+                self.on_drop(item)
+        for thread in self._threads[:-1]:
+            thread.join(timeout)
+        self.outputs.close()
+        self._threads[-1].join(timeout)
@@ -0,0 +1,41 @@
+"""
+Single-pass segmentation overlay and per-class area fractions.
+
+The demo used to build a boolean mask and a fresh [H, W, 4] colour array for every
+class present in the frame and then sum them. MaskRenderer instead indexes a
+precomputed (num_classes, 4) uint8 colour LUT directly with the class mask, writing
+into a reused overlay buffer, and counts the pixels of every class with one
+bincount over the same index buffer.
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+def colour_lut(colours: np.ndarray, num_classes: int, alpha: int = 150) -> np.ndarray:
+    """(num_classes, 4) RGBA table; class 0 (background) is transparent, colours repeat if too few."""
+    colours = np.asarray(colours, dtype=np.uint8).reshape(-1, 4)
+    lut = colours[np.arange(num_classes) % len(colours)].copy()
+    lut[:, 3] = alpha
+    lut[0] = 0
+    return lut
+
+
+class MaskRenderer:
+    def __init__(self, colours: np.ndarray, num_classes: int, shape: Tuple[int, int], alpha: int = 150):
+        """Render (H, W) class masks of the given shape with a fixed colour LUT."""
+        self.lut = colour_lut(colours, num_classes, alpha)
+        self.num_classes = num_classes
+        self._index = np.zeros(shape, dtype=np.intp)
+        # two buffers, so the preview can still be reading the last overlay while we write the next
+        self._overlays = [np.zeros(shape + (4,), dtype=np.uint8) for _ in range(2)]
+        self._frame = 0
+
+    def render(self, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (overlay (H, W, 4) uint8, per-class pixel fractions (num_classes,))."""
+        np.copyto(self._index, mask, casting="unsafe")  # the output tensor may be float
+        overlay = self._overlays[self._frame % 2]
+        self._frame += 1
+        np.take(self.lut, self._index, axis=0, out=overlay, mode="clip")
+        counts = np.bincount(self._index.ravel(), minlength=self.num_classes)[:self.num_classes]
+        return overlay, counts / self._index.size
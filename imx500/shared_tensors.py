@@ -0,0 +1,84 @@
+"""
+Ring of shared-memory slots for passing output tensors to worker processes.
+
+The main process copies each frame's output tensors into a free slot and sends only the
+slot index to the worker, so nothing tensor-sized is pickled. Workers attach to the same
+block once (in the pool initializer) and read the tensors through NumPy views.
+"""
+import queue
+from multiprocessing import shared_memory
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+class SharedTensorRing:
+    def __init__(self, shapes: Sequence[tuple], dtypes: Sequence, slots: int = 8,
+                 _shm: Optional[shared_memory.SharedMemory] = None):
+        """Create a ring of `slots` slots, each holding one tensor per entry of shapes/dtypes."""
+        self.shapes = [tuple(s) for s in shapes]
+        self.dtypes = [np.dtype(d) for d in dtypes]
+        self.slots = slots
+
+        # every tensor starts on a 64-byte boundary so views stay aligned
+        self.offsets = []
+        offset = 0
+        for shape, dtype in zip(self.shapes, self.dtypes):
+            self.offsets.append(offset)
+            offset += -(-int(np.prod(shape)) * dtype.itemsize // 64) * 64
+        self.slot_bytes = offset
+
+        self.owner = _shm is None
+        self.shm = _shm or shared_memory.SharedMemory(create=True, size=max(1, self.slot_bytes * slots))
+        self._views = [[np.ndarray(shape, dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes + off)
+                        for shape, dtype, off in zip(self.shapes, self.dtypes, self.offsets)]
+                       for slot in range(slots)]
+
+        self._free = queue.Queue()
+        if self.owner:
+            for slot in range(slots):
+                self._free.put(slot)
+
+    @property
+    def spec(self) -> dict:
+        """Small picklable description used by workers to attach to the ring."""
+        return {"name": self.shm.name, "shapes": self.shapes,
+                "dtypes": [d.str for d in self.dtypes], "slots": self.slots}
+
+    @classmethod
+    def attach(cls, spec: dict) -> "SharedTensorRing":
+        """Open an existing ring from its spec (worker side)."""
+        try:
+            shm = shared_memory.SharedMemory(name=spec["name"], track=False)  # Python 3.13+
+        except TypeError:
+            # Pool workers share the parent's resource tracker, so registering again is harmless
+            shm = shared_memory.SharedMemory(name=spec["name"])
+        return cls(spec["shapes"], spec["dtypes"], spec["slots"], _shm=shm)
+
+    def acquire(self) -> Optional[int]:
+        """Take a free slot, or None if all slots are still being processed."""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            return None
+
+    def release(self, slot: int):
+        """Give a slot back once its result has been consumed."""
+        self._free.put(slot)
+
+    def write(self, slot: int, tensors: Sequence[np.ndarray]):
+        """Copy one frame's tensors into a slot."""
+        for view, tensor in zip(self._views[slot], tensors):
+            np.copyto(view, tensor, casting="same_kind")
+
+    def views(self, slot: int) -> List[np.ndarray]:
+        """NumPy views of the tensors stored in a slot (no copy)."""
+        return self._views[slot]
+
+    def close(self):
+        self._views = None
+        try:
+            self.shm.close()
+        finally:
+            if self.owner:  # unlink even if a stray view keeps the mapping open
+                self.shm.unlink()
@@ -0,0 +1,99 @@
+"""
+Temporal smoothing of per-frame classification outputs.
+
+Top-1 of each frame on its own flickers between Grass and Soil, which makes the
+spray map noisy and logs a record per frame. ClassSmoother keeps the last K
+probability vectors in a fixed NumPy ring buffer with a running sum (windowed mean),
+or a single EMA state, and only switches class once another class has led the
+smoothed vector by `margin` for `hold` consecutive frames. emit() then decides
+whether the frame is worth a log record: on a class change, or once the mower has
+moved `distance` metres since the last record.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+from gps_track import EARTH_RADIUS_M
+
+
+class ClassSmoother:
+    def __init__(self, num_classes: int, window: int = 8, mode: str = "mean", alpha: float = 0.3,
+                 hold: int = 3, margin: float = 0.05, distance: float = 0.0):
+        """Smooth over `window` frames ("mean") or with EMA factor `alpha` ("ema").
+
+        distance > 0 also emits a record every that many metres while the class holds.
+        """
+        if mode not in ("mean", "ema"):
+            raise ValueError(f"Unknown smoothing mode {mode}")
+        self.mode = mode
+        self.window = window
+        self.alpha = alpha
+        self.hold = hold
+        self.margin = margin
+        self.distance = distance
+        self._ring = np.zeros((window, num_classes), dtype=np.float32)
+        self._sum = np.zeros(num_classes, dtype=np.float64)
+        self._count = 0
+        self.smoothed = np.zeros(num_classes, dtype=np.float32)
+        self.class_idx = -1
+        self._candidate = -1
+        self._pending = 0
+        self._changed = False
+        self._last_lat = math.nan
+        self._last_lon = math.nan
+
+    @property
+    def score(self) -> float:
+        return float(self.smoothed[self.class_idx]) if self.class_idx >= 0 else 0.0
+
+    def update(self, probabilities: np.ndarray) -> int:
+        """Add one frame's probability vector and return the (held) smoothed class."""
+        if self.mode == "mean":
+            slot = self._count % self.window
+            self._sum += probabilities - self._ring[slot]  # drop the oldest, add the newest
+            self._ring[slot] = probabilities
+            self._count += 1
+            if self._count % (self.window * 4096) == 0:
+                self._sum = self._ring.sum(axis=0, dtype=np.float64)  # flush rounding drift
+            np.divide(self._sum, min(self._count, self.window), out=self.smoothed, casting="unsafe")
+        elif self._count == 0:
+            self.smoothed[:] = probabilities
+            self._count = 1
+        else:
+            self.smoothed *= 1 - self.alpha
+            self.smoothed += self.alpha * probabilities
+
+        best = int(np.argmax(self.smoothed))
+        if self.class_idx < 0:
+            self.class_idx, self._changed = best, True
+        elif best == self.class_idx or self.smoothed[best] - self.smoothed[self.class_idx] < self.margin:
+            self._pending = 0
+        else:
+            # hysteresis: the new class has to keep the lead for `hold` frames
+            self._pending = self._pending + 1 if best == self._candidate else 1
+            self._candidate = best
+            if self._pending >= self.hold:
+                self.class_idx, self._changed, self._pending = best, True, 0
+        return self.class_idx
+
+    def emit(self, lat: float = math.nan, lon: float = math.nan) -> Optional[str]:
+        """Reason to log this frame ("change" or "distance"), or None to skip it."""
+        if self._changed:
+            reason = "change"
+        elif self.distance > 0 and self._moved(lat, lon) >= self.distance:
+            reason = "distance"
+        else:
+            return None
+        self._changed = False
+        if not math.isnan(lat):
+            self._last_lat, self._last_lon = lat, lon
+        return reason
+
+    def _moved(self, lat: float, lon: float) -> float:
+        """Metres from the last emitted position (equirectangular, fine at field scale)."""
+        if math.isnan(lat) or math.isnan(self._last_lat):
+            return 0.0 if math.isnan(lat) else math.inf
+        north = math.radians(lat - self._last_lat) * EARTH_RADIUS_M
+        east = math.radians(lon - self._last_lon) * EARTH_RADIUS_M * math.cos(math.radians(lat))
+        return math.hypot(north, east)
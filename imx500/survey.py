@@ -0,0 +1,104 @@
+"""
+Headless survey loop for the IMX500 demos.
+
+On the mower there is no display, so survey mode starts the camera without a preview,
+draws nothing and only pulls request metadata (which carries the output tensor) with
+capture_metadata(). Each frame is handed to the demo's on_frame(metadata) callback,
+which parses the tensor and queues compact records on a DetectionRecorder. Every Nth
+frame can be kept as a full-resolution JPEG for auditing, named by the same unix
+timestamp as its log record; the loop only copies the frame, and an AuditWriter
+encodes it on its own thread (dropping frames while its queue is full). A stage that
+picks frames to keep itself (the audit sampler) asks for the next frame's request with
+capture_wanted and gets it through on_capture, so only the few picked frames are ever
+captured whole.
+
+ThroughputMeter reports sustained frames/sec and process CPU% in both survey and
+preview mode, so the two can be compared on the same numbers.
+"""
+import time
+from typing import Callable, Optional
+
+from audit_sampler import AuditWriter
+
+
+class ThroughputMeter:
+    def __init__(self, name: str = "", report_interval: float = 10.0):
+        """Count frames and print fps and CPU% every report_interval seconds."""
+        self.name = name
+        self.report_interval = report_interval
+        self.frames = 0
+        self._window_frames = 0
+        self._wall = self._start_wall = time.monotonic()
+        self._cpu = self._start_cpu = time.process_time()
+        self.fps = 0.0
+        self.cpu_percent = 0.0
+
+    def tick(self, frames: int = 1):
+        self.frames += frames
+        self._window_frames += frames
+        now = time.monotonic()
+        if now - self._wall >= self.report_interval:
+            self._update(now)
+            print(f"{self.name} {self.fps:.1f} fps, CPU {self.cpu_percent:.0f}% ({self.frames} frames)")
+
+    def _update(self, now: float):
+        cpu = time.process_time()  # all threads of this process; 100% = one core
+        self.fps = self._window_frames / (now - self._wall)
+        self.cpu_percent = (cpu - self._cpu) / (now - self._wall) * 100
+        self._window_frames, self._wall, self._cpu = 0, now, cpu
+
+    def stats(self) -> dict:
+        """Averages since the meter was created."""
+        elapsed = max(time.monotonic() - self._start_wall, 1e-9)
+        return {"frames": self.frames, "fps": self.frames / elapsed,
+                "cpu_percent": (time.process_time() - self._start_cpu) / elapsed * 100}
+
+
+def run_survey(picam2, on_frame: Callable[[dict, float], None], frames_dir: Optional[str] = None,
+               save_every: int = 0, duration: Optional[float] = None,
+               meter: Optional[ThroughputMeter] = None, capture_wanted: Optional[Callable[[], bool]] = None,
+               on_capture: Optional[Callable] = None) -> dict:
+    """Process frames headless until duration elapses (or Ctrl-C).
+
+    on_frame(metadata, timestamp) gets each frame's metadata and the unix time used for
+    its records. With frames_dir and save_every > 0, every save_every-th frame is
+    captured as a full request and written as <timestamp>.jpg in frames_dir in the
+    background. Whenever capture_wanted() is true the next frame is captured as a full
+    request too and passed to on_capture(request) before its metadata goes to on_frame;
+    the request is released after.
+    """
+    meter = meter or ThroughputMeter("survey")
+    writer = None
+    if frames_dir and save_every:
+        writer = AuditWriter(frames_dir, max_mb=float("inf"))
+        main = picam2.camera_configuration()["main"]
+        frame_bytes = main["stride"] * main["size"][1]
+    end = None if duration is None else time.monotonic() + duration
+    try:
+        while end is None or time.monotonic() < end:
+            now = time.time()
+            save = frames_dir and save_every and meter.frames % save_every == 0
+            capture = capture_wanted is not None and capture_wanted()
+            if save or capture:
+                request = picam2.capture_request()
+                try:
+                    metadata = request.get_metadata()
+                    if save and writer.has_room(frame_bytes):
+                        writer.submit(request.make_array("main"), now)
+                    elif save:
+                        writer.dropped += 1
+                    if capture:
+                        on_capture(request)
+                finally:
+                    request.release()
+                on_frame(metadata, now)
+            else:
+                on_frame(picam2.capture_metadata(), now)
+            meter.tick()
+    except KeyboardInterrupt:
+        print("Exiting...")
+    stats = meter.stats()
+    if writer is not None:
+        writer.close()
+        stats.update(saved_frames=writer.written, dropped_frames=writer.dropped)
+    return stats
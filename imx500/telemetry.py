@@ -0,0 +1,274 @@
+"""
+Low-overhead latency and frame-drop telemetry for the camera callbacks.
+
+LatencyHistogram is an HDR-style log-linear histogram over integer nanoseconds: a
+fixed NumPy count array where each power of two is split into 2**(precision-1)
+buckets, so every recorded value is kept to within 2**-(precision-1) relative error
+(~1.6% by default) from 1 ns to about a minute. Recording is a few integer
+operations and one array increment, with nothing allocated per frame.
+
+Telemetry keeps one histogram per named stage, reusable timers for wrapping
+existing functions, and a FrameMonitor that counts dropped frames (gaps in the
+SensorTimestamp sequence) and late results (sensor timestamp to result longer than
+the frame budget). A daemon thread writes a rolling JSON summary every few seconds
+to a file (replaced atomically) and/or a UDP socket for the dashboard.
+"""
+import functools
+import json
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from gps_track import sensor_clock
+
+
+class LatencyHistogram:
+    def __init__(self, precision: int = 7, max_value_ns: int = 64 * 10**9):
+        """Log-linear buckets, 2**(precision-1) per power of two, up to max_value_ns (larger values clamp)."""
+        self.precision = precision
+        self._half = 1 << (precision - 1)
+        self.max_value_ns = max_value_ns
+        self.counts = np.zeros(self._index(max_value_ns) + 1, dtype=np.int64)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self._lock = threading.Lock()
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.precision
+        if shift <= 0:
+            return value
+        return shift * self._half + (value >> shift)
+
+    def _lower_bound(self, index: np.ndarray) -> np.ndarray:
+        """Smallest value falling in each bucket."""
+        index = np.asarray(index, dtype=np.int64)
+        shift = np.maximum(index // self._half - 1, 0)
+        return np.where(index < 2 * self._half, index, (index - shift * self._half) << shift)
+
+    def record(self, value_ns: int):
+        value_ns = int(value_ns)
+        if value_ns < 0:
+            value_ns = 0
+        elif value_ns > self.max_value_ns:
+            value_ns = self.max_value_ns
+        index = self._index(value_ns)
+        with self._lock:  # uncontended except while the exporter swaps windows
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ns += value_ns
+            if value_ns > self.max_ns:
+                self.max_ns = value_ns
+
+    def percentile(self, q) -> np.ndarray:
+        """Value (ns) at percentile(s) q in [0, 100], as the midpoint of the bucket it falls in."""
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.count == 0:
+            return np.zeros(len(q))
+        cumulative = np.cumsum(self.counts)
+        index = np.searchsorted(cumulative, np.maximum(np.ceil(q / 100 * self.count), 1))
+        low = self._lower_bound(index)
+        high = self._lower_bound(index + 1)
+        return np.minimum((low + high) / 2, self.max_ns)
+
+    def summary(self) -> dict:
+        """Count, mean, p50 / p90 / p99 and max in milliseconds."""
+        p50, p90, p99 = self.percentile([50, 90, 99]) / 1e6
+        return {"count": self.count, "mean_ms": self.total_ns / max(self.count, 1) / 1e6,
+                "p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99), "max_ms": self.max_ns / 1e6}
+
+    def merge(self, other: "LatencyHistogram"):
+        with other._lock:
+            self._merge(other)
+
+    def merge_and_reset(self, other: "LatencyHistogram"):
+        """Move other's counts into this histogram, atomically with respect to other.record()."""
+        with other._lock:
+            self._merge(other)
+            other.reset()
+
+    def _merge(self, other: "LatencyHistogram"):
+        self.counts += other.counts
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = self.total_ns = self.max_ns = 0
+
+
+class StageTimer:
+    def __init__(self, histogram: LatencyHistogram):
+        """Reusable `with` timer; one per stage, not re-entrant (use one per thread)."""
+        self.histogram = histogram
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter_ns() - self._start)
+        return False
+
+
+class FrameMonitor:
+    def __init__(self, fps: float, latency: LatencyHistogram):
+        """Drops from gaps between consecutive SensorTimestamps, late results from the frame budget.
+
+        fps is only the starting frame period: frames that carry their FrameDuration replace
+        it, so a FrameRate lowered at runtime (rate_control.py) is not counted as drops.
+        """
+        self.period_ns = int(1e9 / fps)
+        self.latency = latency
+        self.frames = 0
+        self.dropped = 0
+        self.late = 0
+        self._last_ns = None
+
+    def frame(self, sensor_ns: Optional[int], frame_duration_us: Optional[int] = None):
+        """Call once per frame seen, with its SensorTimestamp (ns) and FrameDuration (us) metadata."""
+        self.frames += 1
+        if frame_duration_us:
+            self.period_ns = int(frame_duration_us) * 1000
+        if not sensor_ns:
+            return
+        if self._last_ns is not None:
+            # a gap of k periods means k - 1 frames never reached us
+            gap = (sensor_ns - self._last_ns + self.period_ns // 2) // self.period_ns
+            if gap > 1:
+                self.dropped += gap - 1
+        self._last_ns = sensor_ns
+
+    def result(self, sensor_ns: Optional[int]):
+        """Call when a frame's result is ready: records sensor -> result latency."""
+        if not sensor_ns:
+            return
+        latency = int(sensor_clock() * 1e9) - sensor_ns
+        self.latency.record(latency)
+        if latency > self.period_ns:
+            self.late += 1
+
+
+class Telemetry:
+    def __init__(self, fps: float = 30.0, path: Optional[str] = None, udp: Optional[str] = None,
+                 interval: float = 5.0):
+        """Histograms per stage; with path and/or udp ("host:port") a rolling summary is exported."""
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._timers: Dict[str, StageTimer] = {}
+        self._lock = threading.Lock()
+        self.monitor = FrameMonitor(fps, self.histogram("sensor_to_result"))
+        self.path = path
+        self.udp = None
+        if udp:
+            host, port = udp.rsplit(":", 1)
+            self.udp = (host, int(port))
+        self.interval = interval
+        self._socket = None
+        self._window_start = time.time()
+        self._totals: Dict[str, LatencyHistogram] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        if path or udp:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="telemetry")
+            self._thread.start()
+
+    @classmethod
+    def from_args(cls, args, fps: float) -> "Telemetry":
+        return cls(fps, path=args.telemetry_file, udp=args.telemetry_udp, interval=args.telemetry_interval)
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        if name not in self.histograms:
+            with self._lock:
+                self.histograms.setdefault(name, LatencyHistogram())
+        return self.histograms[name]
+
+    def timer(self, name: str) -> StageTimer:
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = StageTimer(self.histogram(name))
+        return timer
+
+    def wrap(self, fn: Callable, name: Optional[str] = None) -> Callable:
+        """fn with every call timed into histogram `name` (default: fn's name)."""
+        histogram = self.histogram(name or fn.__name__)
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter_ns() - start)
+        return timed
+
+    def summary(self, reset: bool = False) -> dict:
+        """Current window of every histogram plus frame counters; reset starts a new window."""
+        now = time.time()
+        stages = {}
+        with self._lock:
+            for name, h in self.histograms.items():
+                # copy (and with reset, empty) the window under the histogram's lock, then summarise the copy
+                window = LatencyHistogram(h.precision, h.max_value_ns)
+                if reset:
+                    window.merge_and_reset(h)
+                    self._totals.setdefault(name, LatencyHistogram(h.precision, h.max_value_ns)).merge(window)
+                else:
+                    window.merge(h)
+                stages[name] = window.summary()
+        monitor = self.monitor
+        result = {"time": now, "window_s": now - self._window_start, "stages": stages,
+                  "frames": monitor.frames, "dropped": monitor.dropped, "late": monitor.late,
+                  "drop_rate": monitor.dropped / max(monitor.frames + monitor.dropped, 1)}
+        if reset:
+            self._window_start = now
+        return result
+
+    def totals(self) -> dict:
+        """Summaries over the whole run (all exported windows plus the current one)."""
+        totals = {}
+        for name, h in self.histograms.items():
+            total = LatencyHistogram()
+            total.merge(h)
+            if name in self._totals:
+                total.merge(self._totals[name])
+            totals[name] = total.summary()
+        return totals
+
+    def export(self):
+        summary = json.dumps(self.summary(reset=True))
+        if self.path:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(summary)
+            os.replace(tmp, self.path)  # readers never see a half-written file
+        if self.udp:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                self._socket.sendto(summary.encode(), self.udp)
+            except OSError as e:
+                print("Telemetry send failed:", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.export()
+
+
+def add_telemetry_arguments(parser):
+    """The --telemetry-* options shared by the demos, see Telemetry.from_args."""
+    parser.add_argument("--telemetry-file", type=str,
+                        help="Write a rolling JSON summary of stage latencies and frame drops to this file")
+    parser.add_argument("--telemetry-udp", type=str, help="Also send the summary to this host:port over UDP")
+    parser.add_argument("--telemetry-interval", type=float, default=5.0, help="Seconds between summaries")
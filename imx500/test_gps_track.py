@@ -0,0 +1,41 @@
+import numpy as np
+
+from gps import GpsReader
+from gps_track import GpsTrack
+
+
+def live_positions(track: GpsTrack, fix_interval: float, duration: float = 60.0, fps: float = 30.0,
+                   round_trip: float = 0.3):
+    """Place frames as the live pipeline does: each only sees the fixes received before it."""
+    lats = []
+    fixes = np.arange(0.0, duration, fix_interval)
+    for t in np.arange(fixes[0] + round_trip, duration, 1 / fps):
+        # a fix is stamped at the middle of its poll, but only lands once the reply is read
+        while len(fixes) and fixes[0] + round_trip / 2 <= t:
+            track.append(fixes[0], 38.5 + fixes[0] * 1e-5, -121.7)
+            fixes = fixes[1:]
+        lats.append(track.position_at(t)[0])
+    return np.array(lats)
+
+
+def test_reader_track_bridges_a_3s_fix_cadence():
+    reader = GpsReader(interval=3.0)
+    lats = live_positions(reader.track, 3.0)
+    assert not np.isnan(lats).any()
+
+
+def test_track_needs_the_poll_interval():
+    track = GpsTrack()
+    assert np.isnan(live_positions(track, 3.0)).any()
+    track = GpsTrack()
+    track.expect_fixes_every(3.0)
+    assert not np.isnan(live_positions(track, 3.0)).any()
+
+
+def test_extrapolation_is_still_bounded():
+    track = GpsTrack()
+    track.expect_fixes_every(3.0, slack=1.0)
+    track.append(0.0, 38.5, -121.7)
+    track.append(3.0, 38.5001, -121.7)
+    assert not np.isnan(track.position_at(6.9)[0])
+    assert np.isnan(track.position_at(7.1)[0])
@@ -0,0 +1,187 @@
+"""
+SORT-style multi-object tracker for the detection demos.
+
+The same weed is re-detected in 10-30 consecutive frames. SortTracker links those
+detections into tracks with stable IDs and reports each track once, when it ends, so
+a plant is counted and geotagged once.
+
+Every track has a constant-velocity Kalman filter on (cx, cy, area, aspect), as in
+SORT (Bewley et al. 2016). All tracks live in fixed-capacity NumPy arrays: predict
+and update are batched matrix products over the active tracks, association is a
+vectorized IoU matrix with greedy highest-IoU-first matching. With max_tracks tracks
+and at most max_detections boxes per frame the per-frame cost is bounded, which
+keeps it cheap enough for a Pi Zero.
+"""
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+class TrackRecord(NamedTuple):
+    track_id: int
+    class_idx: int
+    score: float       # best detection score along the track
+    time: float        # sensor time of the hit closest to the image centre, best for geotagging
+    first_time: float
+    last_time: float
+    hits: int
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU between every (x0, y0, x1, y1) box in a (N, 4) and b (M, 4)."""
+    inter_w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def greedy_match(iou: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Match rows to columns highest IoU first; returns matched (rows, cols)."""
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    used_rows = np.zeros(iou.shape[0], dtype=bool)
+    used_cols = np.zeros(iou.shape[1], dtype=bool)
+    keep = []
+    for k in order:
+        r, c = rows[k], cols[k]
+        if not used_rows[r] and not used_cols[c]:
+            used_rows[r] = used_cols[c] = True
+            keep.append(k)
+    return rows[keep], cols[keep]
+
+
+def _to_z(boxes: np.ndarray) -> np.ndarray:
+    """(x0, y0, x1, y1) -> (cx, cy, area, aspect)."""
+    w = boxes[:, 2] - boxes[:, 0]
+    h = np.maximum(boxes[:, 3] - boxes[:, 1], 1e-6)
+    return np.stack([boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / h], axis=1)
+
+
+def _to_box(x: np.ndarray) -> np.ndarray:
+    """Kalman states (N, 7) -> (x0, y0, x1, y1)."""
+    area = np.maximum(x[:, 2], 1e-6)
+    w = np.sqrt(area * np.maximum(x[:, 3], 1e-6))
+    h = area / w
+    return np.stack([x[:, 0] - w / 2, x[:, 1] - h / 2, x[:, 0] + w / 2, x[:, 1] + h / 2], axis=1)
+
+
+class SortTracker:
+    # constant velocity on cx, cy and area; aspect is constant
+    F = np.eye(7)
+    F[0, 4] = F[1, 5] = F[2, 6] = 1.0
+    H = np.eye(4, 7)
+    Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 1e-4])
+    R = np.diag([1.0, 1.0, 10.0, 10.0])
+    P0 = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4])
+
+    def __init__(self, max_tracks: int = 64, iou_threshold: float = 0.3, max_age: int = 5, min_hits: int = 3,
+                 centre: Optional[Tuple[float, float]] = None):
+        """Tracks end after max_age frames without a match; only tracks with min_hits are reported.
+
+        centre is the image centre in box units, used to pick each track's geotag time.
+        """
+        self.max_tracks = max_tracks
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.centre = np.asarray(centre if centre is not None else (0.5, 0.5), dtype=np.float64)
+        self.x = np.zeros((max_tracks, 7))
+        self.P = np.zeros((max_tracks, 7, 7))
+        self.active = np.zeros(max_tracks, dtype=bool)
+        self.ids = np.zeros(max_tracks, dtype=np.int64)
+        self.hits = np.zeros(max_tracks, dtype=np.int32)
+        self.misses = np.zeros(max_tracks, dtype=np.int32)
+        self.best_score = np.zeros(max_tracks)
+        self.best_class = np.zeros(max_tracks, dtype=np.int32)
+        self.best_offset = np.zeros(max_tracks)  # distance of the best-centred hit from the centre
+        self.best_time = np.zeros(max_tracks)
+        self.first_time = np.zeros(max_tracks)
+        self.last_time = np.zeros(max_tracks)
+        self.next_id = 1
+        self.dropped = 0  # new detections ignored because all track slots were in use
+
+    def update(self, boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray,
+               t: float) -> Tuple[np.ndarray, List[TrackRecord]]:
+        """Advance one frame with (x0, y0, x1, y1) boxes.
+
+        Returns the track ID of each detection (0 if none) and the tracks that ended.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        track_ids = np.zeros(len(boxes), dtype=np.int64)
+        slots = np.flatnonzero(self.active)
+
+        # predict every active track at once
+        if len(slots):
+            x = self.x[slots]
+            x[x[:, 2] + x[:, 6] <= 0, 6] = 0.0  # area can't go negative
+            self.x[slots] = x @ self.F.T
+            self.P[slots] = self.F @ self.P[slots] @ self.F.T + self.Q
+
+        rows = cols = np.zeros(0, dtype=np.int64)
+        if len(slots) and len(boxes):
+            rows, cols = greedy_match(iou_matrix(_to_box(self.x[slots]), boxes), self.iou_threshold)
+
+        if len(rows):
+            matched = slots[rows]
+            z = _to_z(boxes[cols])
+            P = self.P[matched]
+            S = self.H @ P @ self.H.T + self.R
+            K = P @ self.H.T @ np.linalg.inv(S)
+            innovation = z - self.x[matched] @ self.H.T
+            self.x[matched] += np.einsum("nij,nj->ni", K, innovation)
+            self.P[matched] = (np.eye(7) - K @ self.H) @ P
+            self._hit(matched, boxes[cols], scores[cols], classes[cols], t)
+            track_ids[cols] = self.ids[matched]
+
+        missed = np.setdiff1d(slots, slots[rows] if len(rows) else [])
+        self.misses[missed] += 1
+        ended = self._end(missed[self.misses[missed] > self.max_age])
+
+        new = np.setdiff1d(np.arange(len(boxes)), cols)
+        free = np.flatnonzero(~self.active)[:len(new)]
+        self.dropped += len(new) - len(free)
+        if len(free):
+            new = new[:len(free)]
+            self.x[free] = 0.0
+            self.x[free, :4] = _to_z(boxes[new])
+            self.P[free] = self.P0
+            self.active[free] = True
+            self.ids[free] = np.arange(self.next_id, self.next_id + len(free))
+            self.next_id += len(free)
+            self.hits[free] = 0
+            self.best_score[free] = -1.0
+            self.best_offset[free] = np.inf
+            self.first_time[free] = t
+            self._hit(free, boxes[new], scores[new], classes[new], t)
+            track_ids[new] = self.ids[free]
+        return track_ids, ended
+
+    def _hit(self, slots: np.ndarray, boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray, t: float):
+        self.hits[slots] += 1
+        self.misses[slots] = 0
+        self.last_time[slots] = t
+        better = scores > self.best_score[slots]
+        self.best_score[slots[better]] = scores[better]
+        self.best_class[slots[better]] = classes[better]
+        offset = np.hypot((boxes[:, 0] + boxes[:, 2]) / 2 - self.centre[0], (boxes[:, 1] + boxes[:, 3]) / 2 - self.centre[1])
+        closer = offset < self.best_offset[slots]
+        self.best_offset[slots[closer]] = offset[closer]
+        self.best_time[slots[closer]] = t
+
+    def _end(self, slots: np.ndarray) -> List[TrackRecord]:
+        self.active[slots] = False
+        return [TrackRecord(int(self.ids[s]), int(self.best_class[s]), float(self.best_score[s]),
+                            float(self.best_time[s]), float(self.first_time[s]), float(self.last_time[s]),
+                            int(self.hits[s]))
+                for s in slots if self.hits[s] >= self.min_hits]
+
+    def boxes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, predicted (x0, y0, x1, y1) boxes) of the active tracks."""
+        slots = np.flatnonzero(self.active)
+        return self.ids[slots], _to_box(self.x[slots])
+
+    def flush(self) -> List[TrackRecord]:
+        """End all tracks, e.g. at shutdown."""
+        return self._end(np.flatnonzero(self.active))
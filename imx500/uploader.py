@@ -0,0 +1,169 @@
+"""
+Ship detection-log segments to the ingestion server over an intermittent link.
+
+Segments are append-only, so the uploader tracks one byte offset per segment: the
+length the server has acknowledged. Each request carries the next slice of the file
+(at most batch_bytes, cut at a record boundary and before any zero-filled tail),
+deflate-compressed, with the SHA-256 of the uncompressed bytes:
+
+    POST /v1/segments/<device>/<segment>?offset=<n>
+    Content-Encoding: deflate
+    X-Content-SHA256: <hex>
+    -> 200 {"size": <acknowledged length>}
+    -> 409 {"size": <server length>}    offset was ahead of the server; resume there
+    -> 409 {"size": ..., "error": ...}  the server holds different bytes; raises ValueError
+
+The server appends only the part past its current length, so a batch resent after a
+lost response is acknowledged without being written twice. Acknowledged offsets
+are saved to a small JSON state file (replaced atomically) and, if that is lost,
+recovered with a GET of the same path. Only one batch is held in memory at a time,
+which keeps the uploader at a few hundred KiB on a Pi Zero.
+
+    python uploader.py logs/ http://192.168.1.20:8750 --device pi-01
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+from typing import Dict, Optional
+
+import numpy as np
+
+from detection_log import RECORD_COMMIT, RECORD_MARKER, list_segments, read_header
+
+
+class Uploader:
+    def __init__(self, log_dir: str, url: str, device: str = "", batch_bytes: int = 256 * 1024, level: int = 6,
+                 state_path: Optional[str] = None, timeout: float = 30.0):
+        """Upload the segments in log_dir to the server at url, batch_bytes of log per request."""
+        self.log_dir = log_dir
+        self.url = url.rstrip("/")
+        self.device = device or socket.gethostname()
+        self.batch_bytes = batch_bytes
+        self.level = level
+        self.timeout = timeout
+        self.state_path = state_path or os.path.join(log_dir, ".upload_state.json")
+        self.acked: Dict[str, int] = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.acked = json.load(f)
+        self.sent_bytes = 0  # compressed bytes on the wire
+        self.log_bytes = 0  # log bytes acknowledged
+        self.batches = 0
+        self.retries = 0
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.acked, f)
+        os.replace(tmp, self.state_path)
+
+    def _segment_url(self, name: str) -> str:
+        return f"{self.url}/v1/segments/{urllib.parse.quote(self.device)}/{urllib.parse.quote(name)}"
+
+    def _request(self, request: urllib.request.Request) -> dict:
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code != 409:
+                raise
+            body = json.loads(e.read())
+            if "error" in body:  # the server holds different bytes under this name; don't paper over it
+                raise ValueError(body["error"]) from e
+            return body
+
+    def server_size(self, name: str) -> int:
+        return self._request(urllib.request.Request(self._segment_url(name)))["size"]
+
+    def _uploadable(self, path: str) -> int:
+        """Length of the segment up to the last whole record (the writer may be mid-batch)."""
+        header = read_header(path)
+        records = (os.path.getsize(path) - header["header_size"]) // header["record_size"]
+        return header["header_size"] + max(records, 0) * header["record_size"]
+
+    def _read_batch(self, path: str, offset: int) -> bytes:
+        """Next slice from offset: whole records only, stopping at a torn record or zero-filled tail."""
+        header = read_header(path)
+        size, start = header["record_size"], header["header_size"]
+        end = min(self._uploadable(path), max(offset, start) + self.batch_bytes // size * size)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(end - offset)
+        prefix = max(start - offset, 0)  # the header goes with the first batch
+        records = np.frombuffer(data, dtype=np.uint8, offset=prefix).reshape(-1, size)
+        valid = records[:, 0] == RECORD_MARKER
+        if header["version"] >= 2:
+            valid &= records[:, -1] == RECORD_COMMIT  # the commit byte is each record's last
+        bad = np.flatnonzero(~valid)
+        return data[:prefix + bad[0] * size] if len(bad) else data
+
+    def upload_segment(self, path: str) -> int:
+        """Upload everything new in one segment; returns the log bytes acknowledged."""
+        name = os.path.basename(path)
+        if name not in self.acked:
+            self.acked[name] = self.server_size(name)
+        before = self.acked[name]
+        while self.acked[name] < self._uploadable(path):
+            offset = self.acked[name]
+            data = self._read_batch(path, offset)
+            if not data:
+                break
+            body = zlib.compress(data, self.level)
+            request = urllib.request.Request(
+                f"{self._segment_url(name)}?offset={offset}", data=body, method="POST",
+                headers={"Content-Type": "application/octet-stream", "Content-Encoding": "deflate",
+                         "X-Content-SHA256": hashlib.sha256(data).hexdigest()})
+            self.acked[name] = self._request(request)["size"]
+            self.sent_bytes += len(body)
+            self.batches += 1
+            self._save_state()
+        self.log_bytes += self.acked[name] - before
+        return self.acked[name] - before
+
+    def sync(self) -> int:
+        """One pass over all segments; raises OSError if the link drops (progress so far is kept)."""
+        return sum(self.upload_segment(path) for path in list_segments(self.log_dir))
+
+    def run(self, interval: float = 30.0, max_backoff: float = 600.0):
+        """Sync every interval seconds, backing off exponentially while the server is unreachable."""
+        delay = interval
+        while True:
+            try:
+                self.sync()
+                delay = interval
+            except (OSError, ValueError) as e:  # URLError and timeouts are OSErrors
+                self.retries += 1
+                delay = min(delay * 2, max_backoff)
+                print(f"Upload failed ({e}), retrying in {delay:.0f} s")
+            time.sleep(delay)
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log_dir", type=str, help="Directory of detection-log segments")
+    parser.add_argument("url", type=str, help="Ingestion server, e.g. http://192.168.1.20:8750")
+    parser.add_argument("--device", type=str, default="", help="Device name on the server (default: hostname)")
+    parser.add_argument("--batch-kb", type=int, default=256, help="Log bytes per request")
+    parser.add_argument("--interval", type=float, default=30.0, help="Seconds between syncs")
+    parser.add_argument("--once", action="store_true", help="Sync once and exit")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    uploader = Uploader(args.log_dir, args.url, args.device, args.batch_kb * 1024)
+    if args.once:
+        start = time.perf_counter()
+        sent = uploader.sync()
+        elapsed = time.perf_counter() - start
+        print(f"Uploaded {sent} log bytes as {uploader.sent_bytes} bytes in {uploader.batches} batches, {elapsed:.1f} s")
+    else:
+        uploader.run(args.interval)
@@ -0,0 +1,167 @@
+"""
+Tiled weed-density inference over full-resolution captures.
+
+The IMX500 classifies the whole ROI into one label. For spray mapping we want to know
+how much of the frame is broadleaf / grass / soil, so the frame is cut into an
+overlapping grid of 224x224 tiles (zero-copy strided views), all tiles are classified
+in a single batched ONNX Runtime call on the host, and the result is a per-frame class
+grid plus class coverage fractions.
+
+Run offline on a saved frame:
+    python weed_density.py --model ../model_development/optimized_models/model_quantized.onnx --image frame.jpg
+"""
+import argparse
+import json
+import math
+import time
+
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+DEFAULT_LABELS = ["Broadleaf", "Grass", "Soil"]
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def _tile_starts(length: int, tile: int, overlap: float):
+    """Number of tiles, stride and first offset along one axis.
+
+    The count is the one whose even spread comes closest to the requested stride, but
+    never so few that gaps open between tiles. Rounding up instead would put a second
+    tile on an axis only a few pixels longer than one (a 240px axis: 93% overlap), so
+    up to half a stride is left out, split between both edges.
+    """
+    if length <= tile:
+        return 1, tile, 0
+    step = max(1, int(tile * (1 - overlap)))
+    span = length - tile
+    strides = math.floor(span / step + 0.5)
+    if strides == 0:
+        return 1, tile, span // 2
+    count = max(strides, math.ceil(span / tile)) + 1
+    stride = span // (count - 1)
+    return count, stride, (span - stride * (count - 1)) // 2
+
+
+def tile_layout(height: int, width: int, tile: int = 224, overlap: float = 0.25) -> dict:
+    """Rows and columns of the tile grid and the overlap it actually has along each axis."""
+    rows, step_y, _ = _tile_starts(height, tile, overlap)
+    cols, step_x, _ = _tile_starts(width, tile, overlap)
+    return {"rows": rows, "cols": cols,
+            "overlap_y": 1 - step_y / tile if rows > 1 else 0.0,
+            "overlap_x": 1 - step_x / tile if cols > 1 else 0.0}
+
+
+def tile_view(frame: np.ndarray, tile: int = 224, overlap: float = 0.25) -> np.ndarray:
+    """Return a (rows, cols, tile, tile, C) strided view of the frame, no pixels are copied."""
+    height, width, channels = frame.shape
+    if height < tile or width < tile:
+        raise ValueError(f"Frame {width}x{height} is smaller than the {tile}px tile")
+    rows, step_y, y0 = _tile_starts(height, tile, overlap)
+    cols, step_x, x0 = _tile_starts(width, tile, overlap)
+    s_y, s_x, s_c = frame.strides
+    return as_strided(frame[y0:, x0:],
+                      shape=(rows, cols, tile, tile, channels),
+                      strides=(s_y * step_y, s_x * step_x, s_y, s_x, s_c),
+                      writeable=False)
+
+
+class DensityEstimator:
+    def __init__(self, model_path: str, labels=None, tile: int = 224, overlap: float = 0.25,
+                 scale: float = 0.5, bgr: bool = True, threads: int = 0):
+        """Load the ONNX classifier used to label each tile."""
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.labels = labels or DEFAULT_LABELS
+        self.tile = tile
+        self.overlap = overlap
+        self.scale = scale
+        self.bgr = bgr
+        self._batch = None  # reused input buffer, reallocated only if the tile count changes
+
+    def _prepare(self, tiles: np.ndarray) -> np.ndarray:
+        """Normalize (N, tile, tile, 3) uint8 tiles into the reused NCHW float32 batch."""
+        n = tiles.shape[0]
+        if self._batch is None or self._batch.shape[0] != n:
+            self._batch = np.empty((n, 3, self.tile, self.tile), dtype=np.float32)
+        # NHWC -> NCHW is a view; one write pass into the preallocated batch
+        np.multiply(tiles.transpose(0, 3, 1, 2), 1 / 255.0, out=self._batch, casting="unsafe")
+        self._batch -= MEAN.reshape(1, 3, 1, 1)
+        self._batch /= STD.reshape(1, 3, 1, 1)
+        return self._batch
+
+    def estimate(self, frame: np.ndarray) -> dict:
+        """Classify every tile of the frame and return the class grid and coverage fractions."""
+        start = time.perf_counter()
+        frame = frame[..., :3]
+        if self.bgr:
+            frame = frame[..., ::-1]  # Picamera2 RGB888 / cv2 frames are BGR in memory
+        if self.scale != 1.0:
+            frame = cv2.resize(np.ascontiguousarray(frame), None, fx=self.scale, fy=self.scale,
+                               interpolation=cv2.INTER_AREA)
+
+        grid = tile_view(frame, self.tile, self.overlap)
+        rows, cols = grid.shape[:2]
+        layout = tile_layout(frame.shape[0], frame.shape[1], self.tile, self.overlap)
+        logits = self.session.run(None, {self.input_name: self._prepare(grid.reshape(-1, self.tile, self.tile, 3))})[0]
+
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        classes = probabilities.argmax(axis=1)
+        fractions = np.bincount(classes, minlength=len(self.labels)) / len(classes)
+
+        return {
+            "grid": classes.reshape(rows, cols),
+            "probabilities": probabilities.reshape(rows, cols, -1),
+            "fractions": {label: float(f) for label, f in zip(self.labels, fractions)},
+            "tiles": int(rows * cols),
+            "overlap": max(layout["overlap_x"], layout["overlap_y"]),  # effective, see _tile_starts
+            "elapsed_ms": (time.perf_counter() - start) * 1000,
+        }
+
+
+class DensityWriter:
+    def __init__(self, path: str):
+        """Append per-frame density grids, one JSON object per line."""
+        self.file = open(path, "a")
+
+    def write(self, result: dict, lat: float, lon: float, gps_time=None, timestamp=None):
+        record = {
+            "timestamp": time.time() if timestamp is None else timestamp,
+            "lat": None if math.isnan(lat) else lat,  # NaN: no GPS fix near this frame
+            "lon": None if math.isnan(lon) else lon,
+            "gps_time": None if gps_time is None else str(gps_time),
+            "fractions": result["fractions"],
+            "grid": result["grid"].tolist(),
+        }
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, required=True, help="Path of the ONNX tile classifier")
+    parser.add_argument("--image", type=str, required=True, help="Path of a captured frame")
+    parser.add_argument("--overlap", type=float, default=0.25, help="Fractional overlap between tiles")
+    parser.add_argument("--scale", type=float, default=0.5, help="Resize factor applied before tiling")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    estimator = DensityEstimator(args.model, overlap=args.overlap, scale=args.scale)
+    result = estimator.estimate(cv2.imread(args.image))
+    print(f"{result['tiles']} tiles (overlap {result['overlap']:.0%}) in {result['elapsed_ms']:.1f} ms")
+    print("Coverage:", ", ".join(f"{k}: {v:.1%}" for k, v in result["fractions"].items()))
+    print(result["grid"])
@@ -0,0 +1,281 @@
+"""
+Latency benchmark harness for the PyTorch, ONNX and TFLite weed classifiers.
+
+Each configuration is warmed up until the latency settles (steady state), then timed
+with perf_counter_ns over many runs. p50/p95/p99 are reported with bootstrap
+confidence intervals, and the results are written as JSON so a CI runner can compare
+two commits.
+
+Usage:
+    python model_development/benchmark.py --model-path optimized_models/model_quantized.onnx --batch-sizes 1 4 8 --threads 1 2 4 --output bench/onnx.json
+
+PyTorch checkpoints are loaded into TinyResViT(num_classes=2) exactly as rpi_inference.py does:
+    python model_development/benchmark.py --model-path full_training/run_20250503_045116/best_model.pth --threads 1 4
+
+To flag regressions against a previous run (exit code 1 if any config got slower):
+    python model_development/benchmark.py --model-path optimized_models/model_quantized.onnx --output bench/new.json --baseline bench/main.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from datetime import datetime
+import numpy as np
+
+
+PERCENTILES = (50, 95, 99)
+
+
+def warm_up(run, min_iters=5, max_iters=200, window=10, tolerance=0.05):
+    """Run until the median of the last two windows differs by less than tolerance.
+
+    Returns the number of warmup iterations and whether steady state was reached.
+    """
+    samples = []
+    for i in range(max_iters):
+        start = time.perf_counter_ns()
+        run()
+        samples.append(time.perf_counter_ns() - start)
+
+        if i + 1 >= max(min_iters, 2 * window):
+            previous = np.median(samples[-2 * window:-window])
+            current = np.median(samples[-window:])
+            if abs(current - previous) <= tolerance * previous:
+                return i + 1, True
+    return max_iters, False
+
+
+def measure_latency(run, iterations=200, **warmup_kwargs):
+    """Warm up `run`, then time `iterations` calls. Returns (samples in ns, warmup info)"""
+    warmup_iters, steady = warm_up(run, **warmup_kwargs)
+
+    samples = np.empty(iterations, dtype=np.int64)
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        run()
+        samples[i] = time.perf_counter_ns() - start
+
+    return samples, {'iterations': warmup_iters, 'steady_state': steady}
+
+
+def latency_stats(samples_ns, confidence=0.95, n_boot=1000, seed=0):
+    """Percentile latencies (ms) with bootstrap confidence intervals"""
+    samples_ms = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    rng = np.random.default_rng(seed)
+
+    # resample all bootstrap replicas at once: (n_boot, n)
+    idx = rng.integers(0, len(samples_ms), size=(n_boot, len(samples_ms)))
+    boot = np.percentile(samples_ms[idx], PERCENTILES, axis=1)
+    lo_q, hi_q = (1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100
+
+    stats = {
+        'n': int(len(samples_ms)),
+        'mean_ms': float(samples_ms.mean()),
+        'std_ms': float(samples_ms.std(ddof=1)) if len(samples_ms) > 1 else 0.0,
+        'confidence': confidence,
+    }
+    for p, point, replicas in zip(PERCENTILES, np.percentile(samples_ms, PERCENTILES), boot):
+        stats[f'p{p}_ms'] = float(point)
+        stats[f'p{p}_ci_ms'] = [float(np.percentile(replicas, lo_q)), float(np.percentile(replicas, hi_q))]
+    return stats
+
+
+def detect_backend(model_path):
+    """Pick the runtime from the model file extension"""
+    ext = os.path.splitext(model_path)[1].lower()
+    if ext == '.onnx':
+        return 'onnx'
+    if ext == '.tflite':
+        return 'tflite'
+    if ext in ('.pth', '.pt'):
+        return 'pytorch'
+    raise ValueError(f"Cannot infer backend from model path: {model_path}")
+
+
+def make_input(batch_size, img_size=224, data_dir=None, seed=0):
+    """Build a float32 NCHW input batch, from validation images if data_dir is given"""
+    if data_dir is None:
+        rng = np.random.default_rng(seed)
+        return rng.standard_normal((batch_size, 3, img_size, img_size), dtype=np.float32)
+
+    from data.dataset import WeedDataset
+    val_dataset = WeedDataset(data_dir, split='val', img_size=img_size)
+    images = [val_dataset[i % len(val_dataset)][0].numpy() for i in range(batch_size)]
+    return np.stack(images).astype(np.float32)
+
+
+def make_onnx_runner(model_path, inputs, threads):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+    feed = {session.get_inputs()[0].name: inputs}
+    return lambda: session.run(None, feed)
+
+
+def make_tflite_runner(model_path, inputs, threads):
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+
+    interpreter = Interpreter(model_path=model_path, num_threads=threads)
+    input_detail = interpreter.get_input_details()[0]
+    # ai-edge-torch keeps NCHW, onnx-tf exports NHWC
+    if input_detail['shape'][-1] == 3 and inputs.shape[1] == 3:
+        inputs = inputs.transpose(0, 2, 3, 1)
+    interpreter.resize_tensor_input(input_detail['index'], inputs.shape)
+    interpreter.allocate_tensors()
+    inputs = np.ascontiguousarray(inputs, dtype=input_detail['dtype'])
+
+    def run():
+        interpreter.set_tensor(input_detail['index'], inputs)
+        interpreter.invoke()
+    return run
+
+
+def make_pytorch_runner(model_path, inputs, threads):
+    import torch
+    # the deployed TinyResViT and its checkpoint handling, imported late as rpi_inference imports this module
+    from rpi_inference import load_pytorch_model
+
+    torch.set_num_threads(threads)
+    model = load_pytorch_model(model_path)
+    tensor = torch.from_numpy(inputs)
+
+    def run():
+        with torch.inference_mode():
+            model(tensor)
+    return run
+
+
+RUNNERS = {
+    'onnx': make_onnx_runner,
+    'tflite': make_tflite_runner,
+    'pytorch': make_pytorch_runner,
+}
+
+
+def run_sweep(model_path, batch_sizes, thread_counts, iterations=200, data_dir=None, img_size=224):
+    """Benchmark every (batch size, thread count) combination of one model"""
+    backend = detect_backend(model_path)
+    results = []
+    for batch_size in batch_sizes:
+        inputs = make_input(batch_size, img_size, data_dir)
+        for threads in thread_counts:
+            run = RUNNERS[backend](model_path, inputs, threads)
+            samples, warmup = measure_latency(run, iterations)
+            stats = latency_stats(samples)
+            stats['per_image_p50_ms'] = stats['p50_ms'] / batch_size
+            stats['throughput_img_s'] = 1000 * batch_size / stats['p50_ms']
+            results.append({
+                'backend': backend,
+                'model': os.path.basename(model_path),
+                'batch_size': batch_size,
+                'threads': threads,
+                'warmup': warmup,
+                **stats,
+            })
+            print(f"{backend} batch={batch_size} threads={threads}: "
+                  f"p50 {stats['p50_ms']:.2f} ms [{stats['p50_ci_ms'][0]:.2f}, {stats['p50_ci_ms'][1]:.2f}] | "
+                  f"p95 {stats['p95_ms']:.2f} ms | p99 {stats['p99_ms']:.2f} ms | "
+                  f"{stats['throughput_img_s']:.1f} img/s"
+                  f"{'' if warmup['steady_state'] else ' (no steady state)'}")
+    return results
+
+
+def environment_info():
+    """Metadata stored next to the results so runs from different machines are not mixed up"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+
+def compare_results(current, baseline, tolerance=0.10, metric='p50'):
+    """Find configs whose latency got worse than the baseline.
+
+    A config regresses when the current value is more than `tolerance` above the
+    baseline and the two confidence intervals do not overlap.
+    """
+    key = lambda r: (r['backend'], r['model'], r['batch_size'], r['threads'])
+    baseline_by_key = {key(r): r for r in baseline}
+
+    regressions = []
+    for result in current:
+        base = baseline_by_key.get(key(result))
+        if base is None:
+            continue
+        new_value, old_value = result[f'{metric}_ms'], base[f'{metric}_ms']
+        if new_value > old_value * (1 + tolerance) and result[f'{metric}_ci_ms'][0] > base[f'{metric}_ci_ms'][1]:
+            regressions.append({
+                'config': dict(zip(('backend', 'model', 'batch_size', 'threads'), key(result))),
+                f'baseline_{metric}_ms': old_value,
+                f'current_{metric}_ms': new_value,
+                'change': new_value / old_value - 1,
+            })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inference latency of weed detection models')
+    parser.add_argument('--model-path', type=str, nargs='+', required=True,
+                        help='One or more .pth, .onnx or .tflite models')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1])
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='Timed runs per configuration (after warmup)')
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='Optional: use validation images instead of random input')
+    parser.add_argument('--output', type=str, default='benchmark_results.json',
+                        help='Where to write the JSON results')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Optional: JSON results of a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed relative slowdown before a config counts as a regression')
+    args = parser.parse_args()
+
+    results = []
+    for model_path in args.model_path:
+        results.extend(run_sweep(model_path, args.batch_sizes, args.threads, args.iterations,
+                                 args.data_dir, args.img_size))
+
+    report = {'environment': environment_info(), 'results': results}
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        report['regressions'] = compare_results(results, baseline['results'], args.tolerance)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if report.get('regressions'):
+        print(f"\n{len(report['regressions'])} regression(s) against {args.baseline}:")
+        for reg in report['regressions']:
+            print(f"  {reg['config']}: {reg['baseline_p50_ms']:.2f} ms -> {reg['current_p50_ms']:.2f} ms "
+                  f"(+{reg['change']*100:.1f}%)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
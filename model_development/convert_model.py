@@ -17,6 +17,7 @@ import matplotlib.pyplot as plt
 # from models.tinyresvit import TinyResViT
 import onnxruntime
 from onnxruntime.quantization import quantize_dynamic, QuantType
+from benchmark import measure_latency, latency_stats
 
 
 def load_model(model_path):
@@ -109,32 +110,27 @@ def benchmark_inference(model, quantized_model, input_shape=(1, 3, 224, 224), nu
     """Benchmark inference time for original and quantized models"""
     device = torch.device('cpu')
     dummy_input = torch.randn(input_shape).to(device)
-    
-    for _ in range(10):
-        model(dummy_input)
-        quantized_model(dummy_input)
-    
-    # original model
-    start_time = time.time()
-    for _ in range(num_runs):
-        with torch.no_grad():
-            model(dummy_input)
-    original_time = (time.time() - start_time) / num_runs * 1000
-    
-    # quantized model
-    start_time = time.time()
-    for _ in range(num_runs):
-        with torch.no_grad():
-            quantized_model(dummy_input)
-    quantized_time = (time.time() - start_time) / num_runs * 1000
-    
+
+    def timed(m):
+        def run():
+            with torch.no_grad():
+                m(dummy_input)
+        # warms up until steady state instead of a fixed number of runs
+        return latency_stats(measure_latency(run, iterations=num_runs)[0])
+
+    original_stats = timed(model)
+    quantized_stats = timed(quantized_model)
+    original_time, quantized_time = original_stats['p50_ms'], quantized_stats['p50_ms']
+
     speedup = original_time / quantized_time
-    
-    print(f"\nInference Performance (CPU):")
-    print(f"Original model: {original_time:.2f} ms per image")
-    print(f"Quantized model: {quantized_time:.2f} ms per image")
+
+    print(f"\nInference Performance (CPU, median over {num_runs} runs):")
+    print(f"Original model: {original_time:.2f} ms per image "
+          f"(95% CI {original_stats['p50_ci_ms'][0]:.2f}-{original_stats['p50_ci_ms'][1]:.2f}, p95 {original_stats['p95_ms']:.2f})")
+    print(f"Quantized model: {quantized_time:.2f} ms per image "
+          f"(95% CI {quantized_stats['p50_ci_ms'][0]:.2f}-{quantized_stats['p50_ci_ms'][1]:.2f}, p95 {quantized_stats['p95_ms']:.2f})")
     print(f"Speedup: {speedup:.2f}x")
-    
+
     return original_time, quantized_time, speedup
 
 if __name__ == "__main__":
@@ -49,7 +49,7 @@ class WeedDataset(Dataset):
                 
             class_paths[class_idx] = []
             for fname in os.listdir(class_folder):
-                if fname.lower().endswith(('.png', '.jpg', '.jpeg')):
+                if fname.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
                     class_paths[class_idx].append((os.path.join(class_folder, fname), class_idx))
         
         # Set seed for reproducible splits
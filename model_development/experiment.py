@@ -27,6 +27,8 @@ from models.tinyresvit import TinyResViT
 from data.dataset import WeedDataset
 from torch.utils.data import DataLoader
 import onnxruntime
+from benchmark import measure_latency, latency_stats
+from tta import predict_batch, num_views
 
 
 def preprocess_image(image_path, size=224):
@@ -81,9 +83,9 @@ def inference_onnx(session, image_tensor):
     numpy_image = image_tensor.numpy()
     
     # Run inference
-    start_time = time.time()
+    start_time = time.perf_counter_ns()
     outputs = session.run(None, {input_name: numpy_image})
-    inference_time = (time.time() - start_time) * 1000  # ms
+    inference_time = (time.perf_counter_ns() - start_time) / 1e6  # ms
     
     # Process output
     scores = outputs[0][0]
@@ -94,6 +96,18 @@ def inference_onnx(session, image_tensor):
     return predicted_class, confidence, inference_time, probabilities
 
 
+def inference_onnx_tta(session, image_path, tta):
+    """Run inference with test-time augmentation, all views in one batched session call"""
+    image = Image.open(image_path).convert('RGB')
+
+    start_time = time.perf_counter_ns()
+    predicted, probabilities = predict_batch(session, [image], tta)
+    inference_time = (time.perf_counter_ns() - start_time) / 1e6  # ms, view preprocessing included
+
+    predicted_class = predicted[0]
+    return predicted_class, probabilities[0][predicted_class], inference_time, probabilities[0]
+
+
 def display_image_with_prediction(image, true_label, pred_label, confidence, class_names):
     """Display an image with its prediction"""
     # Convert image for display
@@ -119,7 +133,7 @@ def display_image_with_prediction(image, true_label, pred_label, confidence, cla
     plt.show()
 
 
-def run_validation_samples(model_path, data_dir='data', num_samples=5):
+def run_validation_samples(model_path, data_dir='data', num_samples=5, tta=None):
     """Run inference on random samples from validation set"""
     class_names = {0: 'Broadleaf', 1: 'Grass'}
     
@@ -153,7 +167,10 @@ def run_validation_samples(model_path, data_dir='data', num_samples=5):
         image = image.unsqueeze(0)  # Add batch dimension
         
         # inference
-        if use_onnx:
+        if use_onnx and tta:
+            pred_class, confidence, inf_time, probabilities = inference_onnx_tta(session, val_dataset.paths[idx][0], tta)
+            probs_str = ", ".join([f"{class_names[i]}: {prob:.4f}" for i, prob in enumerate(probabilities)])
+        elif use_onnx:
             pred_class, confidence, inf_time, probabilities = inference_onnx(session, image)
             probs_str = ", ".join([f"{class_names[i]}: {prob:.4f}" for i, prob in enumerate(probabilities)])
         else:
@@ -188,6 +205,8 @@ def main():
                         help='Path to data directory containing validation images')
     parser.add_argument('--num-samples', type=int, default=5,
                         help='Number of random validation samples to process')
+    parser.add_argument('--tta', type=str, default=None,
+                        help="Optional: test-time augmentation spec, e.g. 'flip', 'five-crop+flip', 'grid3x3'")
     parser.add_argument('--image', type=str,
                         help='Optional: Path to a specific image to process')
     args = parser.parse_args()
@@ -200,7 +219,18 @@ def main():
         
         if args.model_path.endswith('.onnx'):
             session = onnxruntime.InferenceSession(args.model_path)
-            predicted_class, confidence, inference_time, _ = inference_onnx(session, image_tensor)
+            if args.tta:
+                predicted_class, confidence, inference_time, _ = inference_onnx_tta(session, args.image, args.tta)
+                print(f"TTA '{args.tta}': {num_views(args.tta)} views in one batch")
+                image = Image.open(args.image).convert('RGB')
+                run = lambda: predict_batch(session, [image], args.tta)
+            else:
+                predicted_class, confidence, inference_time, _ = inference_onnx(session, image_tensor)
+                feed = {session.get_inputs()[0].name: image_tensor.numpy()}
+                run = lambda: session.run(None, feed)
+
+            # a single run includes session warmup, so time a steady-state series for the FPS estimate
+            stats = latency_stats(measure_latency(run, iterations=50)[0])
         else:
             print("Invalid model path. Please provide a valid ONNX model path.")
             return
@@ -211,11 +241,12 @@ def main():
         print("\nResults:")
         print(f"Predicted class: {class_names[predicted_class]} (Class ID: {predicted_class})")
         print(f"Confidence: {confidence:.4f} ({confidence*100:.2f}%)")
-        print(f"Inference time: {inference_time:.2f} ms")
-        print(f"Estimated FPS: {1000/inference_time:.1f}")
+        print(f"Inference time (first run): {inference_time:.2f} ms")
+        print(f"Steady-state latency: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms")
+        print(f"Estimated FPS: {1000/stats['p50_ms']:.1f}")
     else:
         # Process random validation samples
-        run_validation_samples(args.model_path, args.data_dir, args.num_samples)
+        run_validation_samples(args.model_path, args.data_dir, args.num_samples, args.tta)
 
 
 if __name__ == "__main__":
@@ -12,6 +12,8 @@ from PIL import Image
 import torchvision.transforms as transforms
 from models.tinyresvit import TinyResViT
 import onnxruntime
+from benchmark import measure_latency, latency_stats
+from tta import predict_batch, num_views
 
 ONNX_AVAILABLE = True
 
@@ -50,9 +52,9 @@ def load_pytorch_model(model_path):
 def inference_pytorch(model, image_tensor):
     """Run inference using PyTorch model"""
     with torch.no_grad():
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
         outputs = model(image_tensor)
-        inference_time = (time.time() - start_time) * 1000  # ms
+        inference_time = (time.perf_counter_ns() - start_time) / 1e6  # ms
     
     # Get prediction
     probabilities = torch.nn.functional.softmax(outputs, dim=1)
@@ -74,9 +76,9 @@ def inference_onnx(onnx_path, image_tensor):
     numpy_image = image_tensor.numpy()
     
     # Run inference
-    start_time = time.time()
+    start_time = time.perf_counter_ns()
     outputs = sess.run(None, {input_name: numpy_image})
-    inference_time = (time.time() - start_time) * 1000  # ms
+    inference_time = (time.perf_counter_ns() - start_time) / 1e6  # ms
     
     # Process output
     scores = outputs[0][0]
@@ -87,6 +89,19 @@ def inference_onnx(onnx_path, image_tensor):
     return predicted_class, confidence, inference_time
 
 
+def inference_onnx_tta(onnx_path, image_path, tta):
+    """Run inference with test-time augmentation, all views in one batched session call"""
+    sess = onnxruntime.InferenceSession(onnx_path)
+    image = Image.open(image_path).convert('RGB')
+
+    start_time = time.perf_counter_ns()
+    predicted, probabilities = predict_batch(sess, [image], tta)
+    inference_time = (time.perf_counter_ns() - start_time) / 1e6  # ms
+
+    predicted_class = predicted[0]
+    return predicted_class, probabilities[0][predicted_class], inference_time
+
+
 def main():
     parser = argparse.ArgumentParser(description='Run inference with optimized weed detection models')
     parser.add_argument('--image', type=str, required=True, help='Path to input image')
@@ -95,6 +110,10 @@ def main():
     parser.add_argument('--model-path', type=str, 
                         default='optimized_models/model.onnx' if ONNX_AVAILABLE else 'optimized_models/quantized_model.pth',
                         help='Path to the model file')
+    parser.add_argument('--tta', type=str, default=None,
+                        help="Optional (ONNX only): test-time augmentation spec, e.g. 'flip', 'five-crop+flip'")
+    parser.add_argument('--benchmark-runs', type=int, default=50,
+                        help='Timed runs used for the steady-state latency estimate')
     args = parser.parse_args()
     
     # Load and preprocess image
@@ -105,7 +124,10 @@ def main():
     class_names = {0: 'Broadleaf', 1: 'Grass'}
     
     # Run inference based on model type
-    if args.model_type == 'onnx' and ONNX_AVAILABLE:
+    if args.model_type == 'onnx' and ONNX_AVAILABLE and args.tta:
+        print(f"Running inference with ONNX model: {args.model_path} (TTA '{args.tta}', {num_views(args.tta)} views)")
+        predicted_class, confidence, inference_time = inference_onnx_tta(args.model_path, args.image, args.tta)
+    elif args.model_type == 'onnx' and ONNX_AVAILABLE:
         print(f"Running inference with ONNX model: {args.model_path}")
         predicted_class, confidence, inference_time = inference_onnx(args.model_path, image_tensor)
     else:
@@ -113,12 +135,28 @@ def main():
         model = load_pytorch_model(args.model_path)
         predicted_class, confidence, inference_time = inference_pytorch(model, image_tensor)
     
+    # The single run above includes warmup, so estimate FPS from a steady-state series
+    if args.model_type == 'onnx' and ONNX_AVAILABLE:
+        sess = onnxruntime.InferenceSession(args.model_path)
+        if args.tta:
+            image = Image.open(args.image).convert('RGB')
+            run = lambda: predict_batch(sess, [image], args.tta)
+        else:
+            feed = {sess.get_inputs()[0].name: image_tensor.numpy()}
+            run = lambda: sess.run(None, feed)
+    else:
+        def run():
+            with torch.no_grad():
+                model(image_tensor)
+    stats = latency_stats(measure_latency(run, iterations=args.benchmark_runs)[0])
+
     # Print results
     print("\nResults:")
     print(f"Predicted class: {class_names[predicted_class]} (Class ID: {predicted_class})")
     print(f"Confidence: {confidence:.4f} ({confidence*100:.2f}%)")
-    print(f"Inference time: {inference_time:.2f} ms")
-    print(f"Estimated FPS: {1000/inference_time:.1f}")
+    print(f"Inference time (first run): {inference_time:.2f} ms")
+    print(f"Steady-state latency: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms")
+    print(f"Estimated FPS: {1000/stats['p50_ms']:.1f}")
 
 
 if __name__ == "__main__":
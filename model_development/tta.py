@@ -0,0 +1,181 @@
+"""
+Test-time augmentation (TTA) for the ONNX weed classifier.
+
+Each full-resolution image is turned into several 224x224 views (flips, five-crop,
+tiled grid). The views of all images are packed into one batch and run with a single
+session.run call, and the logits are averaged per image.
+
+A TTA spec is a '+'-joined list of view sets, e.g. 'flip', 'five-crop+flip', 'grid3x3'.
+The plain resized full frame is always the first view, so 'none' is the normal
+single-crop path.
+
+Usage (accuracy / latency trade-off on the validation split):
+    python model_development/tta.py --model-path optimized_models/model_quantized.onnx --data-dir model_development/data --specs none flip five-crop five-crop+flip grid3x3
+"""
+
+import os
+import argparse
+import numpy as np
+from PIL import Image
+
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def parse_spec(spec):
+    """Turn a TTA spec string into (flips, crop layout) settings"""
+    settings = {'flip': False, 'five_crop': False, 'grid': None}
+    if spec in (None, '', 'none'):
+        return settings
+    for part in spec.split('+'):
+        if part == 'flip':
+            settings['flip'] = True
+        elif part == 'five-crop':
+            settings['five_crop'] = True
+        elif part.startswith('grid'):
+            rows, cols = part[len('grid'):].split('x')
+            settings['grid'] = (int(rows), int(cols))
+        else:
+            raise ValueError(f"Unknown TTA view set '{part}' in spec '{spec}'")
+    return settings
+
+
+def crop_boxes(height, width, settings, crop_frac=0.6):
+    """(top, left, h, w) boxes of the crops for one image, full frame first"""
+    boxes = [(0, 0, height, width)]
+    if settings['five_crop']:
+        side = int(min(height, width) * crop_frac)
+        boxes += [
+            (0, 0, side, side),
+            (0, width - side, side, side),
+            (height - side, 0, side, side),
+            (height - side, width - side, side, side),
+            ((height - side) // 2, (width - side) // 2, side, side),
+        ]
+    if settings['grid'] is not None:
+        rows, cols = settings['grid']
+        tile_h, tile_w = height // rows, width // cols
+        boxes += [(r * tile_h, c * tile_w, tile_h, tile_w) for r in range(rows) for c in range(cols)]
+    return boxes
+
+
+def num_views(spec):
+    """Number of views a spec produces per image"""
+    settings = parse_spec(spec)
+    n_crops = 1 + 5 * settings['five_crop']
+    if settings['grid'] is not None:
+        n_crops += settings['grid'][0] * settings['grid'][1]
+    return n_crops * (3 if settings['flip'] else 1)
+
+
+def make_views(image, spec, size=224, crop_frac=0.6):
+    """Build the normalized (V, 3, size, size) float32 views of one full-resolution image"""
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image.convert('RGB'))
+    settings = parse_spec(spec)
+
+    views = np.empty((num_views(spec), size, size, 3), dtype=np.uint8)
+    i = 0
+    for top, left, h, w in crop_boxes(image.shape[0], image.shape[1], settings, crop_frac):
+        crop = np.asarray(Image.fromarray(image[top:top + h, left:left + w]).resize((size, size), Image.BILINEAR))
+        views[i] = crop
+        i += 1
+        if settings['flip']:
+            views[i] = crop[:, ::-1]      # horizontal
+            views[i + 1] = crop[::-1, :]  # vertical
+            i += 2
+
+    views = (views.astype(np.float32) / 255.0 - MEAN) / STD
+    return np.ascontiguousarray(views.transpose(0, 3, 1, 2))
+
+
+def predict_batch(session, images, spec, size=224):
+    """Classify images with TTA in one batched session call.
+
+    Returns (predicted classes, probabilities) with one row per image.
+    """
+    views = [make_views(img, spec, size) for img in images]
+    n_views = views[0].shape[0]
+    batch = np.concatenate(views)
+
+    input_name = session.get_inputs()[0].name
+    logits = session.run(None, {input_name: batch})[0]
+
+    # average logits over the views of each image
+    logits = logits.reshape(len(images), n_views, -1).mean(axis=1)
+    logits = logits - logits.max(axis=1, keepdims=True)
+    probabilities = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+    return probabilities.argmax(axis=1), probabilities
+
+
+def tta_report(session, image_paths, labels, specs, batch_size=8, iterations=20):
+    """Accuracy and batched latency of each TTA spec on a labelled image set"""
+    from benchmark import measure_latency, latency_stats
+
+    images = [Image.open(p).convert('RGB') for p in image_paths]
+    labels = np.asarray(labels)
+    rows = []
+    for spec in specs:
+        predictions = []
+        for start in range(0, len(images), batch_size):
+            predicted, _ = predict_batch(session, images[start:start + batch_size], spec)
+            predictions.append(predicted)
+        accuracy = float((np.concatenate(predictions) == labels).mean())
+
+        # time one full batch, preprocessing included, since views are built on the Pi too
+        sample = images[:batch_size]
+        stats = latency_stats(measure_latency(lambda: predict_batch(session, sample, spec),
+                                              iterations=iterations)[0])
+        rows.append({
+            'spec': spec,
+            'views': num_views(spec),
+            'accuracy': accuracy,
+            'latency_per_image_ms': stats['p50_ms'] / len(sample),
+        })
+
+    base = rows[0]
+    print(f"\n{'TTA spec':<18}{'views':>6}{'accuracy':>10}{'ms/image':>10}{'ms/added view':>15}{'acc gain':>10}")
+    for row in rows:
+        added = row['views'] - base['views']
+        per_view = (row['latency_per_image_ms'] - base['latency_per_image_ms']) / added if added else 0.0
+        row['latency_per_added_view_ms'] = per_view
+        row['accuracy_gain'] = row['accuracy'] - base['accuracy']
+        print(f"{row['spec']:<18}{row['views']:>6}{row['accuracy']:>10.4f}{row['latency_per_image_ms']:>10.2f}"
+              f"{per_view:>15.2f}{row['accuracy_gain']:>+10.4f}")
+    return rows
+
+
+def main():
+    import json
+    import onnxruntime
+    from data.dataset import WeedDataset
+
+    parser = argparse.ArgumentParser(description='Accuracy / latency report for test-time augmentation')
+    parser.add_argument('--model-path', type=str, default='optimized_models/model.onnx',
+                        help='Path to the ONNX model (exported with a dynamic batch axis)')
+    parser.add_argument('--data-dir', type=str, default='data',
+                        help='Path to data directory containing validation images')
+    parser.add_argument('--specs', type=str, nargs='+', default=['none', 'flip', 'five-crop', 'five-crop+flip'],
+                        help='TTA specs to compare, the first one is the baseline')
+    parser.add_argument('--num-samples', type=int, default=None,
+                        help='Optional: limit the number of validation images')
+    parser.add_argument('--batch-size', type=int, default=8, help='Images per session call')
+    parser.add_argument('--output', type=str, default=None, help='Optional: save the report as JSON')
+    args = parser.parse_args()
+
+    val_dataset = WeedDataset(args.data_dir, split='val')
+    samples = val_dataset.paths[:args.num_samples]
+    session = onnxruntime.InferenceSession(args.model_path)
+
+    print(f"Evaluating {len(args.specs)} TTA specs on {len(samples)} validation images...")
+    rows = tta_report(session, [p for p, _ in samples], [l for _, l in samples], args.specs, args.batch_size)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()